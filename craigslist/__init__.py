@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 
+import hashlib
+
 from google.appengine.ext import db
 from geo.geomodel import GeoModel
 
@@ -8,7 +10,17 @@ class List(db.Model):
     state = db.StringProperty()
     category = db.StringProperty(required=True)
     aggregated_prices = db.ListProperty(item_type=int, default=[0, 0, 0])
+    # The merged price sketch of the live posts; see craigslist.pricestats.
+    price_sketch = db.BlobProperty()
     last_updated = db.DateTimeProperty()
+    # Validators and hash of the last feed fetched by SyncHandler.
+    feed_etag = db.StringProperty()
+    feed_last_modified = db.StringProperty()
+    feed_hash = db.StringProperty()
+    # Polling schedule of the List's feed; see craigslist.schedule.
+    arrival_rate = db.FloatProperty()
+    last_polled = db.DateTimeProperty()
+    next_sync = db.DateTimeProperty()
 
     def _get_rss_url(self):
         return 'http://%(city)s.craigslist.org/%(category)s/index.rss' % {
@@ -19,10 +31,13 @@ class List(db.Model):
     rss_url = property(_get_rss_url)
 
     def pack(self):
+        from craigslist.pricestats import summary
+
         return {'city': self.city,
                 'state': self.state,
                 'category': self.category,
                 'aggregated_prices': self.aggregated_prices,
+                'price_stats': summary(self.price_sketch),
                }
 
 class Post(GeoModel):
@@ -31,6 +46,9 @@ class Post(GeoModel):
     description = db.TextProperty(required=True)
     price = db.IntegerProperty(required=True, default=0)
     created = db.DateTimeProperty()
+    # When the post was stored, to catch up with new posts whatever their
+    # creation times; missing on posts stored before it was added.
+    stored = db.DateTimeProperty(auto_now_add=True)
     approx_geolocation = db.BooleanProperty(required=True, default=False)
     posted_list = db.ReferenceProperty(collection_name="posts")
 
@@ -56,6 +74,14 @@ class Post(GeoModel):
 
     longitude = property(_get_longitude, _set_longitude)
 
+    @staticmethod
+    def key_name_for(list_id, link):
+        """Returns the key name of the Post of a List's feed item, so that
+        storing the item again replaces its Post instead of duplicating it.
+        Posts stored before have ids instead."""
+        digest = hashlib.md5(link.encode('utf-8')).hexdigest()
+        return '%d:%s' % (list_id, digest)
+
     def pack(self):
         return {'title': self.title,
                 'description': self.description,
@@ -70,11 +96,153 @@ class ListSubscriber(db.Model):
     subscriber = db.UserProperty(required=True)
 
 class AlertFilter(db.Model):
+    """A user's alert zone on a List: a circle, indexed by the geocells
+    covering it so that posts can be matched against the filters whose
+    cover contains them (see craigslist.alerts)."""
     sublist = db.ReferenceProperty(List, required=True)
     owner = db.UserProperty(required=True)
     max_price = db.IntegerProperty(required=True, default=0)
     street_name = db.StringProperty(required=True)
-    geo_region = db.ByteStringProperty(required=True)
+    center = db.GeoPtProperty()
+    radius = db.IntegerProperty()
+    cover_cells = db.StringListProperty()
+    # The pickled center and radius of filters stored before cover_cells.
+    geo_region = db.ByteStringProperty()
+
+    def set_region(self, latitude, longitude, radius):
+        """Sets the center and radius of the alert zone, and its cover."""
+        from geo import geocell
+
+        self.center = db.GeoPt(latitude, longitude)
+        self.radius = radius
+        self.cover_cells = geocell.circle_cover(self.center, radius)
+        self.geo_region = None
+
+    def get_region(self):
+        """Returns the ([latitude, longitude], radius) of the alert zone."""
+        if self.center is None and self.geo_region:
+            import pickle
+
+            region = pickle.loads(self.geo_region)
+            return region['center'], region['radius']
+        return [self.center.lat, self.center.lon], self.radius
+
+class AlertMatch(db.Model):
+    """A post matching an AlertFilter, keyed by '<filter id>:<post id>'."""
+    alert_filter = db.ReferenceProperty(AlertFilter, required=True,
+                                        collection_name='matches')
+    post = db.ReferenceProperty(Post, required=True,
+                                collection_name='alert_matches')
+    owner = db.UserProperty(required=True)
+    sublist = db.ReferenceProperty(List, required=True,
+                                   collection_name='alert_matches')
+    created = db.DateTimeProperty(auto_now_add=True)
+    notified = db.BooleanProperty(default=False)
+
+class ListSnapshot(db.Model):
+    """The columnar snapshot (see craigslist.snapshot) of the posts of the
+    List whose id is the key name, stored across ListSnapshotShards since
+    entities are limited to 1MB. A new snapshot is written to shards of a
+    new generation before it replaces the current one, so that readers
+    never mix shards of two snapshots."""
+    # The maximum size of a shard, and number of shards, of a snapshot.
+    SHARD_SIZE = 900 * 1024
+    MAX_SHARDS = 8
+
+    generation = db.IntegerProperty(default=0)
+    last_generation = db.IntegerProperty(default=0)
+    shard_count = db.IntegerProperty(default=0)
+    # When the query for the posts stored since the previous snapshot ran.
+    stored_since = db.DateTimeProperty()
+    updated = db.DateTimeProperty(auto_now=True)
+
+    def _shard_keys(self, generation, shard_count):
+        return [db.Key.from_path('ListSnapshotShard', '%s:%d:%d' % (
+                    self.key().name(), generation, i))
+                for i in range(shard_count)]
+
+    @classmethod
+    def load(cls, list_id):
+        """Returns the (snapshot data, stored_since) of a List, or None if
+        it has none or it was replaced while being read."""
+        list_snapshot = cls.get_by_key_name(str(list_id))
+        if list_snapshot is None or not list_snapshot.shard_count:
+            return None
+        shards = db.get(list_snapshot._shard_keys(list_snapshot.generation,
+                                                  list_snapshot.shard_count))
+        if None in shards:
+            return None
+        return ''.join([shard.data for shard in shards]), \
+            list_snapshot.stored_since
+
+    @classmethod
+    def store(cls, list_id, data, stored_since):
+        """Replaces the snapshot of a List, unless a snapshot of posts
+        stored since a later time was stored meanwhile. Returns False if the
+        snapshot is too large to store, or wasn't stored."""
+        shard_count = (len(data) + cls.SHARD_SIZE - 1) // cls.SHARD_SIZE
+        if shard_count > cls.MAX_SHARDS:
+            return False
+        key_name = str(list_id)
+
+        def claim_generation():
+            list_snapshot = cls.get_by_key_name(key_name)
+            if list_snapshot is None:
+                list_snapshot = cls(key_name=key_name)
+            list_snapshot.last_generation += 1
+            list_snapshot.put()
+            return list_snapshot
+        list_snapshot = db.run_in_transaction(claim_generation)
+        generation = list_snapshot.last_generation
+
+        keys = list_snapshot._shard_keys(generation, shard_count)
+        db.put([ListSnapshotShard(key=key, data=db.Blob(
+                    data[i * cls.SHARD_SIZE:(i + 1) * cls.SHARD_SIZE]))
+                for i, key in enumerate(keys)])
+
+        def replace():
+            list_snapshot = cls.get_by_key_name(key_name)
+            if (list_snapshot.stored_since and
+                list_snapshot.stored_since > stored_since):
+                return None
+            replaced = list_snapshot._shard_keys(list_snapshot.generation,
+                                                 list_snapshot.shard_count)
+            list_snapshot.generation = generation
+            list_snapshot.shard_count = shard_count
+            list_snapshot.stored_since = stored_since
+            list_snapshot.put()
+            return replaced
+        replaced = db.run_in_transaction(replace)
+        if replaced is None:
+            db.delete(keys)
+            return False
+        db.delete(replaced)
+        return True
+
+class ListSnapshotShard(db.Model):
+    """A part of the data of a ListSnapshot, keyed by
+    '<list id>:<generation>:<index>'."""
+    data = db.BlobProperty()
+
+class PriceSketch(db.Model):
+    """The craigslist.quantiles sketch of the prices of the posts of a List
+    created on a day, keyed by '<list id>:<day>'."""
+    sublist = db.ReferenceProperty(List, required=True,
+                                   collection_name='price_sketches')
+    day = db.DateProperty(required=True)
+    data = db.BlobProperty()
+    # The digests of the batches of prices added, so that a batch added again
+    # by a retried task is skipped.
+    batches = db.StringListProperty()
+
+class GeocodedAddress(db.Model):
+    """A cached result of craigslist.geocoding, keyed by a hash of the
+    normalized address."""
+    address = db.TextProperty(required=True)
+    status = db.StringProperty(required=True)
+    location = db.GeoPtProperty()
+    approx = db.BooleanProperty(default=False)
+    expires = db.DateTimeProperty(required=True)
 
 class Favorite(db.Model):
     post = db.ReferenceProperty(Post, required=True)
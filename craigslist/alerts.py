@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+"""Matching of new posts against AlertFilters at ingest time.
+
+Each AlertFilter stores the geocells covering its circle in cover_cells, and
+each Post the geocells containing it, at every resolution, in
+location_geocells. A filter's zone can therefore only contain a post if one
+of its cover cells is among the post's cells, so the filters a batch of posts
+may match are found with 'cover_cells IN' queries on the posts' cells,
+whatever the number of filters of the List. Candidates are then checked
+against the post's price and exact distance, and every match is stored as an
+AlertMatch.
+
+Matches are notified in digests: one email per owner, across all their
+filters and Lists, at most once per DIGEST_WINDOW, listing each post once.
+"""
+
+import logging
+from datetime import datetime, timedelta
+
+from google.appengine.ext import db
+
+from craigslist import AlertFilter, AlertMatch, Post
+from geo import geomath
+
+# The maximum number of values of an IN filter.
+MAX_IN_VALUES = 30
+
+# The minimum time between two digests to the same owner, and the maximum
+# number of posts listed in a digest.
+DIGEST_WINDOW = timedelta(hours=1)
+MAX_DIGEST_POSTS = 50
+
+DIGEST_BATCH_SIZE = 500
+MIGRATE_BATCH_SIZE = 500
+
+
+def _candidate_filters(list_key, cells):
+    """Returns the AlertFilters of a List with a cover cell among cells."""
+    cells = sorted(cells)
+    filters = {}
+    for i in range(0, len(cells), MAX_IN_VALUES):
+        query = AlertFilter.all().filter('sublist =', list_key).filter(
+            'cover_cells IN', cells[i:i + MAX_IN_VALUES])
+        for alert_filter in query:
+            filters[alert_filter.key()] = alert_filter
+    return filters.values()
+
+
+def _matches(alert_filter, post, post_cells):
+    if alert_filter.max_price and post.price > alert_filter.max_price:
+        return False
+    if not post_cells.intersection(alert_filter.cover_cells):
+        return False
+    return (geomath.haversine(alert_filter.center, post.location) <=
+            alert_filter.radius)
+
+
+def match_posts(posts):
+    """Stores an AlertMatch for each AlertFilter each of the given stored,
+    located posts matches, unless already stored, and returns the new
+    matches. Matches already stored, maybe notified, are left alone."""
+    by_list = {}
+    for post in posts:
+        if post.location is not None:
+            list_key = Post.posted_list.get_value_for_datastore(post)
+            by_list.setdefault(list_key, []).append(post)
+
+    matches = []
+    for list_key, list_posts in by_list.iteritems():
+        cells = set()
+        for post in list_posts:
+            cells.update(post.location_geocells)
+        filters = _candidate_filters(list_key, cells)
+        if not filters:
+            continue
+
+        for post in list_posts:
+            post_cells = set(post.location_geocells)
+            for alert_filter in filters:
+                if _matches(alert_filter, post, post_cells):
+                    matches.append(AlertMatch(
+                        key_name='%d:%s' % (alert_filter.key().id(),
+                                            post.key().id_or_name()),
+                        alert_filter=alert_filter,
+                        post=post,
+                        owner=alert_filter.owner,
+                        sublist=list_key))
+
+    if matches:
+        stored = db.get([match.key() for match in matches])
+        matches = [match for match, stored_match in zip(matches, stored)
+                   if stored_match is None]
+    if matches:
+        db.put(matches)
+        logging.info('Matched %d posts against alert filters: %d matches' %
+                     (len(posts), len(matches)))
+    return matches
+
+
+def pending_digests(now=None):
+    """Returns a dict from owner to the AlertMatches not notified yet, across
+    all filters and Lists, of the owners whose oldest pending match is at
+    least DIGEST_WINDOW old; so owners get at most one digest per window."""
+    now = now or datetime.utcnow()
+    by_owner = {}
+    oldest = {}
+    query = AlertMatch.all().filter('notified =', False)
+    while True:
+        batch = query.fetch(DIGEST_BATCH_SIZE)
+        for match in batch:
+            by_owner.setdefault(match.owner, []).append(match)
+            if (match.owner not in oldest or
+                match.created < oldest[match.owner]):
+                oldest[match.owner] = match.created
+        if len(batch) < DIGEST_BATCH_SIZE:
+            break
+        query.with_cursor(query.cursor())
+
+    return dict((owner, matches) for owner, matches in by_owner.iteritems()
+                if now - oldest[owner] >= DIGEST_WINDOW)
+
+
+def render_digest(owner, matches):
+    """Returns the (subject, body) of the digest of an owner's matches, with
+    each post listed once, under its List, along with the zones it matched.
+    Returns None if none of the matched posts still exists."""
+    post_keys = []
+    zones = {}
+    for match in matches:
+        post_key = AlertMatch.post.get_value_for_datastore(match)
+        if post_key not in zones:
+            post_keys.append(post_key)
+            zones[post_key] = []
+        zones[post_key].append(
+            AlertMatch.alert_filter.get_value_for_datastore(match))
+
+    posts = [post for post in db.get(post_keys) if post is not None]
+    if not posts:
+        return None
+    posts.sort(key=lambda post: post.created, reverse=True)
+
+    filter_keys = list(set([key for post in posts
+                            for key in zones[post.key()]]))
+    street_names = dict((key, alert_filter.street_name)
+                        for key, alert_filter in zip(filter_keys,
+                                                     db.get(filter_keys))
+                        if alert_filter is not None)
+
+    by_list = {}
+    for post in posts[:MAX_DIGEST_POSTS]:
+        list_key = Post.posted_list.get_value_for_datastore(post)
+        by_list.setdefault(list_key, []).append(post)
+    list_keys = by_list.keys()
+
+    sections = []
+    for list_key, post_list in zip(list_keys, db.get(list_keys)):
+        if post_list is None:
+            continue
+        lines = ['%s, %s:' % (post_list.city, post_list.category)]
+        for post in by_list[list_key]:
+            near = ', '.join(sorted(set(
+                [street_names[key] for key in zones[post.key()]
+                 if key in street_names])))
+            lines.append('    %s\n    $%d, near %s\n    %s' %
+                         (post.title, post.price, near, post.link))
+        sections.append('\n\n'.join(lines))
+    if len(posts) > MAX_DIGEST_POSTS:
+        sections.append('...and %d more.' % (len(posts) - MAX_DIGEST_POSTS))
+
+    subject = ('Craigsreptile Alert: %d new ads you might be interested in' %
+               len(posts))
+    body = """Hey %(nickname)s,
+
+    We are happy to notify you that %(count)d housing ads were posted lately
+that we thought you might be interested in, based on your alerts:
+
+%(updates)s
+
+    You can also visit your Craigsreptile website for map visualization.
+
+    NOTE: Please do not reply this email. Thanks.""" % {
+        'nickname': owner.nickname(),
+        'count': len(posts),
+        'updates': '\n\n'.join(sections)
+    }
+    return subject, body
+
+
+def _keys(query):
+    keys = []
+    while True:
+        batch = query.fetch(MIGRATE_BATCH_SIZE)
+        keys.extend(batch)
+        if len(batch) < MIGRATE_BATCH_SIZE:
+            return keys
+        query.with_cursor(query.cursor())
+
+
+def migrate_filters():
+    """Sets the center, radius and cover of AlertFilters stored with a
+    pickled geo_region only, which no 'cover_cells IN' query finds, and
+    returns how many were migrated. Run by cron, so that such filters match
+    posts again shortly after a deployment."""
+    # Filters stored before have no center index row, so no center filter
+    # finds them: take every filter but those with a center.
+    migrated_keys = set(_keys(AlertFilter.all(keys_only=True).filter(
+        'center >=', db.GeoPt(-90, -180))))
+    legacy_keys = [key for key in _keys(AlertFilter.all(keys_only=True))
+                   if key not in migrated_keys]
+
+    migrated = 0
+    for i in range(0, len(legacy_keys), MIGRATE_BATCH_SIZE):
+        batch = []
+        for alert_filter in db.get(legacy_keys[i:i + MIGRATE_BATCH_SIZE]):
+            if (alert_filter is not None and alert_filter.center is None and
+                alert_filter.geo_region):
+                center, radius = alert_filter.get_region()
+                alert_filter.set_region(center[0], center[1], radius)
+                batch.append(alert_filter)
+        if batch:
+            db.put(batch)
+        migrated += len(batch)
+    if migrated:
+        logging.info('Migrated %d alert filters' % migrated)
+    return migrated
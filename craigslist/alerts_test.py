@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+"""Unit tests for alerts.py.
+
+Needs the App Engine SDK and the application directory on the path.
+"""
+
+import pickle
+import unittest
+from datetime import datetime, timedelta
+
+from google.appengine.api import users
+from google.appengine.ext import db
+from google.appengine.ext import testbed
+
+from craigslist import AlertFilter, AlertMatch, List, Post
+import alerts
+
+NOW = datetime(2010, 11, 21, 12, 0, 0)
+
+# Lake Calhoun and downtown Minneapolis, about 5km apart.
+LAKE = (44.948, -93.310)
+DOWNTOWN = (44.977, -93.265)
+
+
+class AlertsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.list_key = List(city='minneapolis', category='apa').put()
+        self.owner = users.User('renter@example.com')
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def make_filter(self, center, radius, max_price=0, list_key=None,
+                    owner=None, street_name='Lake St'):
+        alert_filter = AlertFilter(sublist=list_key or self.list_key,
+                                   owner=owner or self.owner,
+                                   max_price=max_price,
+                                   street_name=street_name)
+        alert_filter.set_region(center[0], center[1], radius)
+        alert_filter.put()
+        return alert_filter
+
+    def make_post(self, name, location, price=900, list_key=None,
+                  created=NOW):
+        post = Post(key_name=name, title=u'Room %s' % name,
+                    link='http://example.com/%s' % name,
+                    description=u'Description', price=price,
+                    created=created, posted_list=list_key or self.list_key)
+        if location is not None:
+            post.location = db.GeoPt(*location)
+            post.update_location()
+        post.put()
+        return post
+
+
+class MatchesTests(AlertsTestCase):
+    def check(self, alert_filter, post):
+        return alerts._matches(alert_filter, post,
+                               set(post.location_geocells))
+
+    def test_matches(self):
+        alert_filter = self.make_filter(LAKE, 1000, max_price=1000)
+        self.assertTrue(self.check(alert_filter,
+                                   self.make_post('near', LAKE)))
+        self.assertFalse(self.check(alert_filter,
+                                    self.make_post('far', DOWNTOWN)))
+        self.assertFalse(self.check(alert_filter,
+                                    self.make_post('dear', LAKE, 1200)))
+
+    def test_no_price_limit(self):
+        alert_filter = self.make_filter(LAKE, 1000)
+        self.assertTrue(self.check(alert_filter,
+                                   self.make_post('a', LAKE, 10 ** 6)))
+
+    def test_covered_but_too_far(self):
+        # Just outside the circle, in one of its cover cells.
+        alert_filter = self.make_filter(LAKE, 1000)
+        post = self.make_post('edge', (LAKE[0] + 0.0095, LAKE[1]))
+        self.assertTrue(set(post.location_geocells).intersection(
+            alert_filter.cover_cells))
+        self.assertFalse(self.check(alert_filter, post))
+
+
+class MatchPostsTests(AlertsTestCase):
+    def test_match_posts(self):
+        lake = self.make_filter(LAKE, 1000)
+        downtown = self.make_filter(DOWNTOWN, 2000, max_price=1000)
+        posts = [self.make_post('lake', LAKE),
+                 self.make_post('downtown', DOWNTOWN, 1200),
+                 self.make_post('unlocated', None)]
+        matches = alerts.match_posts(posts)
+        self.assertEquals(['%d:lake' % lake.key().id()],
+                          [match.key().name() for match in matches])
+        self.assertEquals(self.owner, matches[0].owner)
+        self.assertEquals(self.list_key,
+                          AlertMatch.sublist.get_value_for_datastore(
+                              matches[0]))
+
+        post = self.make_post('cheap', DOWNTOWN, 800)
+        self.assertEquals(['%d:cheap' % downtown.key().id()],
+                          [match.key().name() for match in
+                           alerts.match_posts([post])])
+
+    def test_matched_once(self):
+        self.make_filter(LAKE, 1000)
+        post = self.make_post('lake', LAKE)
+        self.assertEquals(1, len(alerts.match_posts([post])))
+        match = AlertMatch.all().get()
+        match.notified = True
+        match.put()
+
+        # Storing the post again, as a retried task does, matches nothing
+        # new and leaves the notified match alone.
+        self.assertEquals([], alerts.match_posts([post]))
+        self.assertEquals(1, AlertMatch.all().count())
+        self.assertTrue(AlertMatch.all().get().notified)
+
+    def test_other_lists(self):
+        other_key = List(city='stpaul', category='apa').put()
+        self.make_filter(LAKE, 1000, list_key=other_key)
+        self.assertEquals([], alerts.match_posts(
+            [self.make_post('lake', LAKE)]))
+        self.assertEquals(1, len(alerts.match_posts(
+            [self.make_post('other', LAKE, list_key=other_key)])))
+
+
+class DigestTests(AlertsTestCase):
+    def make_match(self, alert_filter, post, created=NOW, notified=False):
+        match = AlertMatch(key_name='%d:%s' % (alert_filter.key().id(),
+                                               post.key().name()),
+                           alert_filter=alert_filter, post=post,
+                           owner=alert_filter.owner,
+                           sublist=post.posted_list.key(), created=created,
+                           notified=notified)
+        match.put()
+        return match
+
+    def test_pending_digests(self):
+        other = users.User('other@example.com')
+        late = users.User('late@example.com')
+        lake = self.make_filter(LAKE, 1000)
+        downtown = self.make_filter(DOWNTOWN, 1000)
+        other_filter = self.make_filter(LAKE, 1000, owner=other)
+        late_filter = self.make_filter(LAKE, 1000, owner=late)
+        post = self.make_post('lake', LAKE)
+        window = alerts.DIGEST_WINDOW
+
+        # An owner's matches are pending together, across filters, once
+        # the oldest is a window old.
+        self.make_match(lake, post, created=NOW - window)
+        self.make_match(downtown, self.make_post('downtown', DOWNTOWN))
+        self.make_match(other_filter, post, created=NOW - window * 2,
+                        notified=True)
+        self.make_match(late_filter, post,
+                        created=NOW - window + timedelta(minutes=1))
+
+        pending = alerts.pending_digests(NOW)
+        self.assertEquals([self.owner], pending.keys())
+        self.assertEquals(2, len(pending[self.owner]))
+        self.assertEquals(sorted([self.owner, late]),
+                          sorted(alerts.pending_digests(NOW + window)))
+
+    def test_render_digest(self):
+        other_key = List(city='stpaul', category='roo').put()
+        lake = self.make_filter(LAKE, 1000, street_name='Lake St')
+        near_lake = self.make_filter(LAKE, 2000, street_name='Hennepin Ave')
+        other_filter = self.make_filter(LAKE, 1000, list_key=other_key,
+                                        street_name='Grand Ave')
+        post = self.make_post('lake', LAKE)
+        other_post = self.make_post('other', LAKE, price=700,
+                                    list_key=other_key,
+                                    created=NOW - timedelta(hours=1))
+        gone = self.make_post('gone', LAKE)
+        matches = [self.make_match(lake, post),
+                   self.make_match(near_lake, post),
+                   self.make_match(other_filter, other_post),
+                   self.make_match(lake, gone)]
+        gone.delete()
+
+        subject, body = alerts.render_digest(self.owner, matches)
+        self.assertTrue(subject.startswith('Craigsreptile Alert: 2 new'),
+                        subject)
+        self.assertTrue('Hey renter' in body, body)
+        # Each post once, under its List, with all the zones it matched.
+        self.assertEquals(1, body.count('http://example.com/lake'))
+        self.assertTrue('minneapolis, apa:\n\n    Room lake\n    $900, '
+                        'near Hennepin Ave, Lake St\n' in body, body)
+        self.assertTrue('stpaul, roo:\n\n    Room other\n    $700, '
+                        'near Grand Ave\n' in body, body)
+        self.assertFalse('gone' in body, body)
+
+    def test_posts_gone(self):
+        lake = self.make_filter(LAKE, 1000)
+        post = self.make_post('lake', LAKE)
+        matches = [self.make_match(lake, post)]
+        post.delete()
+        self.assertEquals(None, alerts.render_digest(self.owner, matches))
+
+    def test_max_digest_posts(self):
+        lake = self.make_filter(LAKE, 1000)
+        count = alerts.MAX_DIGEST_POSTS + 3
+        matches = [self.make_match(lake, self.make_post(
+            'p%d' % i, LAKE, created=NOW + timedelta(minutes=i)))
+            for i in range(count)]
+        subject, body = alerts.render_digest(self.owner, matches)
+        self.assertTrue(('%d new' % count) in subject, subject)
+        self.assertEquals(alerts.MAX_DIGEST_POSTS, body.count('http://'))
+        self.assertTrue('...and 3 more.' in body, body)
+        # The newest posts are listed.
+        self.assertTrue('http://example.com/p%d\n' % (count - 1) in body)
+        self.assertFalse('http://example.com/p0\n' in body)
+
+
+class MigrateFiltersTests(AlertsTestCase):
+    def make_legacy_filter(self, center, radius):
+        alert_filter = AlertFilter(
+            sublist=self.list_key, owner=self.owner, street_name='Lake St',
+            geo_region=pickle.dumps({'center': list(center),
+                                     'radius': radius}))
+        alert_filter.put()
+        return alert_filter
+
+    def test_migrate_filters(self):
+        legacy = self.make_legacy_filter(LAKE, 1000)
+        self.make_filter(DOWNTOWN, 1000)
+        self.assertEquals([], alerts.match_posts(
+            [self.make_post('before', LAKE)]))
+
+        self.assertEquals(1, alerts.migrate_filters())
+        legacy = AlertFilter.get(legacy.key())
+        self.assertEquals(db.GeoPt(*LAKE), legacy.center)
+        self.assertEquals(1000, legacy.radius)
+        self.assertTrue(legacy.cover_cells)
+        self.assertEquals(None, legacy.geo_region)
+        self.assertEquals(([LAKE[0], LAKE[1]], 1000), legacy.get_region())
+        self.assertEquals(1, len(alerts.match_posts(
+            [self.make_post('after', LAKE)])))
+
+        self.assertEquals(0, alerts.migrate_filters())
+
+    def test_many_filters(self):
+        self.batch_size, alerts.MIGRATE_BATCH_SIZE = \
+            alerts.MIGRATE_BATCH_SIZE, 2
+        try:
+            for i in range(3):
+                self.make_legacy_filter(LAKE, 1000 + i)
+                self.make_filter(DOWNTOWN, 1000 + i)
+            self.assertEquals(3, alerts.migrate_filters())
+            self.assertEquals(0, alerts.migrate_filters())
+        finally:
+            alerts.MIGRATE_BATCH_SIZE = self.batch_size
+
+
+if __name__ == '__main__':
+    unittest.main()
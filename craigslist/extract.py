@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""Extraction of the fields of a post from a feed item's title and
+description.
+
+The price comes from the title. The description yields the precise location
+(the query of the Google Maps link Craigslist adds to it), the fallback
+'Location:' line, searched for only when there is no map link, and the text
+without tags. Tags are stripped with two regex passes and plain string
+replacements, which runs faster in CPython than a single tokenizing scan
+driven from Python.
+"""
+
+import re
+from urllib import unquote_plus
+
+RE_PRICE = re.compile(r'\$(\d+)')
+RE_LOC = re.compile(r'http://maps\.google\.com/\?q=loc\%3A([^"\n]+)"')
+RE_ALT_LOC = re.compile(r'-->Location: ([^\n<]+?)\s*<li>')
+RE_BR = re.compile(r'<br[^>]*>')
+RE_TAG = re.compile(r'</?\w[^>]*?>')
+RE_ENTITY = re.compile(r'&#\d+;')
+
+
+class ExtractedPost(object):
+    """The fields extracted from a feed item.
+
+    Attributes:
+      price: The highest dollar amount in the title, or None.
+      address: The unquoted precise location, or else the fallback location,
+          or None.
+      alt_addr: Whether address is the fallback location.
+      text: The description without tags, with line breaks as '<br />'.
+    """
+    __slots__ = ('price', 'address', 'alt_addr', 'text')
+
+    def __init__(self, price, address, alt_addr, text):
+        self.price = price
+        self.address = address
+        self.alt_addr = alt_addr
+        self.text = text
+
+
+def extract_price(title):
+    """Returns the highest dollar amount in a title, or None."""
+    prices = RE_PRICE.findall(title)
+    if prices:
+        return max(map(int, prices))
+
+
+def strip_tags(html):
+    """Removes all HTML tags, turning <br> tags into '<br />' and numeric
+    character references into spaces."""
+    # Newlines in the source are dropped; line breaks come from <br> tags.
+    html = RE_BR.sub('\n', html.replace('\n', ''))
+    html = RE_TAG.sub('', html).replace('\n', '<br />')
+    if '&#' in html:
+        html = RE_ENTITY.sub(' ', html)
+    return html.strip()
+
+
+def find_location(description):
+    """Returns the (location, is fallback location) of a description, with
+    the location None if there is none."""
+    match = RE_LOC.search(description)
+    if match:
+        return match.group(1), False
+    match = RE_ALT_LOC.search(description)
+    if match:
+        return match.group(1), True
+    return None, True
+
+
+def extract(title, description):
+    """Returns the ExtractedPost of a feed item."""
+    address, alt_addr = find_location(description)
+    if address is not None:
+        address = unquote_plus(address)
+    return ExtractedPost(extract_price(title), address, alt_addr,
+                         strip_tags(description))
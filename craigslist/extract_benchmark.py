@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""Benchmarks post extraction against the regex passes it replaced.
+
+Runs both over the items of one or more recorded feeds, checks that they
+extract the same fields, and prints the time per item of each:
+
+  python craigslist/extract_benchmark.py [feed.rss ...]
+
+Defaults to data/sample_feed.rss, a synthetic feed in Craigslist's format.
+Doesn't need App Engine.
+"""
+
+import optparse
+import os.path
+import re
+import sys
+import time
+from urllib import unquote_plus
+
+import extract
+import feed
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'data', 'sample_feed.rss')
+
+RE_LOC = re.compile(r'http://maps.google.com/\?q=loc\%3A(.+)"')
+RE_ALT_LOC = re.compile(r'-->Location: (.+)\s*<li>')
+
+
+def strip_tags(html):
+    """Remove all HTML tags"""
+    html = re.sub(r'\n', '', html)
+    html = re.sub(r'<br[^>]*>', '\n', html)
+    html = re.sub(r'</?\w[^>]*?>', '', html)
+    html = re.sub('\n', '<br />', html)
+    return re.sub(r'&#\d+;', ' ', html).strip()
+
+
+def legacy_extract(title, description):
+    """The extraction SyncHandler.process_posts used to run per item."""
+    prices = map(int, re.findall(r'\$(\d+)', title))
+    addr_match = RE_LOC.search(description)
+    alt_addr_match = RE_ALT_LOC.search(description)
+    address = None
+    if addr_match or alt_addr_match:
+        address = unquote_plus(addr_match and addr_match.group(1) or
+                               alt_addr_match.group(1))
+    return extract.ExtractedPost(prices and max(prices) or None, address,
+                                 addr_match is None, strip_tags(description))
+
+
+def _fields(post):
+    address = post.address
+    if address is not None:
+        # The legacy location patterns run greedily to the end of the line.
+        address = address.split('"')[0].strip()
+    return post.price, address, post.alt_addr, post.text
+
+
+def time_per_item(function, items, min_time=0.5):
+    """Returns the best time in seconds of function per item, over 3 runs."""
+    best = None
+    for i in range(3):
+        runs = 0
+        start = time.time()
+        while runs == 0 or time.time() - start < min_time:
+            for title, description in items:
+                function(title, description)
+            runs += 1
+        elapsed = (time.time() - start) / runs / len(items)
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(argv):
+    parser = optparse.OptionParser(usage='%prog [options] [feed.rss ...]')
+    parser.add_option('--min-time', type='float', default=0.5,
+                      help='minimum seconds per timing [default: %default]')
+    options, paths = parser.parse_args(argv[1:])
+
+    items = []
+    for path in paths or [DEFAULT_CORPUS]:
+        for item in feed.iter_items(open(path).read()):
+            items.append((item.title, item.description))
+    if not items:
+        print >>sys.stderr, 'No items in corpus.'
+        return 1
+
+    mismatches = 0
+    for title, description in items:
+        if (_fields(extract.extract(title, description)) !=
+            _fields(legacy_extract(title, description))):
+            print >>sys.stderr, 'Mismatch: %r' % title
+            mismatches += 1
+
+    legacy = time_per_item(legacy_extract, items, options.min_time)
+    current = time_per_item(extract.extract, items, options.min_time)
+    print '%d items, %d mismatches' % (len(items), mismatches)
+    print 'legacy:  %8.2fus per item' % (legacy * 1e6)
+    print 'extract: %8.2fus per item (%.2fx)' % (current * 1e6,
+                                                legacy / current)
+    return mismatches and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
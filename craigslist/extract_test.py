@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""Unit tests for extract.py."""
+
+import unittest
+
+import extract
+import extract_benchmark
+import feed
+
+MAP_LINK = ('<small> <a href="http://maps.google.com/?q=loc%3A+1129+'
+            'University+Ave+SE+Minneapolis+MN+US" target="_blank">google map'
+            '</a></small>')
+ALT_LOCATION = ('<ul class="blurbs">\n<li> <!-- CLTAG GeographicArea=Como Park'
+                ' -->Location: Como Park\n<li>it\'s NOT ok to contact this '
+                'poster</ul>')
+
+
+class ExtractPriceTests(unittest.TestCase):
+    def test_extract_price(self):
+        self.assertEquals(900, extract.extract_price('$900 / 1br - Lake'))
+        self.assertEquals(1200, extract.extract_price('$50 off $1200 / 2br'))
+        self.assertEquals(None, extract.extract_price('2br - No price'))
+        self.assertEquals(None, extract.extract_price(''))
+
+
+class StripTagsTests(unittest.TestCase):
+    def test_strip_tags(self):
+        self.assertEquals('Rent: $900<br />Deposit: $900<br />',
+                          extract.strip_tags('<b>Rent:</b> $900<br>\n'
+                                             '<b>Deposit:</b> $900<br/>'))
+        self.assertEquals('Call   email', extract.strip_tags(
+            'Call &#8212; email'))
+        self.assertEquals('a < b', extract.strip_tags('  a < b\n'))
+        self.assertEquals('', extract.strip_tags('<ul><li></ul>'))
+
+
+class FindLocationTests(unittest.TestCase):
+    def test_map_link_preferred(self):
+        self.assertEquals(
+            ('+1129+University+Ave+SE+Minneapolis+MN+US', False),
+            extract.find_location(ALT_LOCATION + '\n' + MAP_LINK))
+
+    def test_fallback_location(self):
+        self.assertEquals(('Como Park', True),
+                          extract.find_location(ALT_LOCATION))
+
+    def test_no_location(self):
+        self.assertEquals((None, True),
+                          extract.find_location('No location here'))
+
+
+class ExtractTests(unittest.TestCase):
+    def test_extract(self):
+        post = extract.extract('$2180 / 2br - Quiet building',
+                               '<b>Rent:</b> $2180<br>\n' + MAP_LINK)
+        self.assertEquals(2180, post.price)
+        self.assertEquals(' 1129 University Ave SE Minneapolis MN US',
+                          post.address)
+        self.assertEquals(False, post.alt_addr)
+        self.assertEquals('Rent: $2180<br /> google map', post.text)
+
+        post = extract.extract('2br', ALT_LOCATION)
+        self.assertEquals(None, post.price)
+        self.assertEquals('Como Park', post.address)
+        self.assertEquals(True, post.alt_addr)
+
+        post = extract.extract('', '')
+        self.assertEquals(None, post.address)
+        self.assertEquals('', post.text)
+
+    def test_same_as_legacy(self):
+        # The sample feed extracts the same as with the regexes of old.
+        content = open(extract_benchmark.DEFAULT_CORPUS).read()
+        items = list(feed.iter_items(content))
+        self.assertTrue(items)
+        for item in items:
+            self.assertEquals(
+                extract_benchmark._fields(
+                    extract_benchmark.legacy_extract(item.title,
+                                                     item.description)),
+                extract_benchmark._fields(
+                    extract.extract(item.title, item.description)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""Streaming parser for Craigslist RSS feeds.
+
+Items are read one at a time with iterparse, and cleared from the tree as
+soon as they are yielded, so memory use doesn't grow with the size of the
+feed. Elements are matched by local name, so both the RDF (RSS 1.0) feeds
+Craigslist serves and plain RSS 2.0 feeds are understood.
+"""
+
+import re
+from cStringIO import StringIO
+from datetime import datetime, timedelta
+
+try:
+    from xml.etree.cElementTree import iterparse
+except ImportError:
+    from xml.etree.ElementTree import iterparse
+
+RE_DATE = re.compile(
+    r'^(\d{4}-\d{2}-\d{2})T(\d{2}:\d{2}:\d{2})([-+]\d{2}:\d{2})$')
+
+# Local names of the item elements read into FeedItem attributes.
+_ITEM_FIELDS = {'title': 'title',
+                'link': 'link',
+                'date': 'date',
+                'description': 'description'}
+
+
+def parse_date(raw_date):
+    """Parses a W3C-DTF date such as dc:date into a naive UTC datetime, or
+    returns None."""
+    match = RE_DATE.match(raw_date or '')
+    if match:
+        post_date, post_time, tz_info = match.groups()
+        sign = tz_info[0] == '-' and -1 or 1
+        hours, minutes = map(int, tz_info[1:].split(':'))
+        return datetime.strptime(
+            ' '.join([post_date, post_time]),
+            '%Y-%m-%d %H:%M:%S') - sign * timedelta(hours=hours,
+                                                    minutes=minutes)
+
+
+class FeedItem(object):
+    """A feed item; missing fields are empty strings."""
+    __slots__ = ('title', 'link', 'date', 'description')
+
+    def __init__(self):
+        self.title = self.link = self.date = self.description = ''
+
+    def _get_created(self):
+        return parse_date(self.date)
+
+    created = property(_get_created)
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def iter_items(content, since=None):
+    """Yields the FeedItems of a feed, in document order.
+
+    Args:
+      content: The feed document, as a string.
+      since: An optional datetime. Craigslist feeds list the newest items
+          first, so parsing stops at the first item created at or before
+          it.
+
+    Raises:
+      SyntaxError: The feed is malformed, after the items before the error
+          are yielded. The ParseError of ElementTree is a SyntaxError.
+    """
+    root = None
+    item = None
+    for event, element in iterparse(StringIO(content), ('start', 'end')):
+        name = _local_name(element.tag)
+        if event == 'start':
+            if root is None:
+                root = element
+            elif name == 'item':
+                item = FeedItem()
+            continue
+
+        if item is None:
+            continue
+        if name == 'item':
+            created = item.created
+            if since is not None and created is not None and created <= since:
+                return
+            yield item
+            item = None
+            root.clear()
+        elif name in _ITEM_FIELDS:
+            setattr(item, _ITEM_FIELDS[name], element.text or '')
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""Unit tests for feed.py."""
+
+import os.path
+import unittest
+from datetime import datetime
+
+import feed
+
+SAMPLE_FEED = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'data', 'sample_feed.rss')
+
+RDF_FEED = '''<?xml version="1.0" encoding="ISO-8859-1"?>
+<rdf:RDF
+ xmlns="http://purl.org/rss/1.0/"
+ xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+ xmlns:dc="http://purl.org/dc/elements/1.1/">
+<channel rdf:about="http://minneapolis.craigslist.org/apa/index.rss">
+<title>craigslist | apts/housing for rent in minneapolis / st paul</title>
+<link>http://minneapolis.craigslist.org/apa/</link>
+</channel>
+<item rdf:about="http://minneapolis.craigslist.org/apa/3.html">
+<title><![CDATA[$900 / 1br - Third]]></title>
+<link>http://minneapolis.craigslist.org/apa/3.html</link>
+<description><![CDATA[Near the <b>lake</b>]]></description>
+<dc:date>2010-11-20T23:38:18-06:00</dc:date>
+</item>
+<item rdf:about="http://minneapolis.craigslist.org/apa/2.html">
+<title><![CDATA[$800 / 1br - Second]]></title>
+<link>http://minneapolis.craigslist.org/apa/2.html</link>
+<description></description>
+<dc:date>2010-11-20T21:00:00-06:00</dc:date>
+</item>
+<item rdf:about="http://minneapolis.craigslist.org/apa/1.html">
+<title><![CDATA[$700 / 1br - First]]></title>
+<link>http://minneapolis.craigslist.org/apa/1.html</link>
+<dc:date>2010-11-20T19:00:00-06:00</dc:date>
+</item>
+</rdf:RDF>
+'''
+
+RSS_FEED = '''<?xml version="1.0"?>
+<rss version="2.0" xmlns:dc="http://purl.org/dc/elements/1.1/">
+<channel>
+<title>Some feed</title>
+<item>
+<title>Only</title>
+<link>http://example.com/only</link>
+<description>Text</description>
+<dc:date>2010-11-20T12:00:00+00:00</dc:date>
+</item>
+</channel>
+</rss>
+'''
+
+
+class ParseDateTests(unittest.TestCase):
+    def test_offsets(self):
+        self.assertEquals(datetime(2010, 11, 21, 5, 38, 18),
+                          feed.parse_date('2010-11-20T23:38:18-06:00'))
+        self.assertEquals(datetime(2010, 11, 20, 20, 8, 18),
+                          feed.parse_date('2010-11-20T23:38:18+03:30'))
+        self.assertEquals(datetime(2010, 11, 21, 4, 8, 18),
+                          feed.parse_date('2010-11-20T23:38:18-04:30'))
+        self.assertEquals(datetime(2010, 11, 20, 23, 38, 18),
+                          feed.parse_date('2010-11-20T23:38:18+00:00'))
+
+    def test_invalid(self):
+        self.assertEquals(None, feed.parse_date(None))
+        self.assertEquals(None, feed.parse_date(''))
+        self.assertEquals(None, feed.parse_date('2010-11-20 23:38:18'))
+        self.assertEquals(None, feed.parse_date('2010-11-20T23:38:18Z'))
+
+
+class IterItemsTests(unittest.TestCase):
+    def test_rdf_feed(self):
+        items = list(feed.iter_items(RDF_FEED))
+        self.assertEquals(['$900 / 1br - Third', '$800 / 1br - Second',
+                           '$700 / 1br - First'],
+                          [item.title for item in items])
+        self.assertEquals('http://minneapolis.craigslist.org/apa/3.html',
+                          items[0].link)
+        self.assertEquals('Near the <b>lake</b>', items[0].description)
+        self.assertEquals(datetime(2010, 11, 21, 5, 38, 18),
+                          items[0].created)
+        # Missing or empty fields are empty strings.
+        self.assertEquals('', items[1].description)
+        self.assertEquals('', items[2].description)
+
+    def test_rss_feed(self):
+        items = list(feed.iter_items(RSS_FEED))
+        self.assertEquals(1, len(items))
+        self.assertEquals('Only', items[0].title)
+        self.assertEquals('http://example.com/only', items[0].link)
+        self.assertEquals(datetime(2010, 11, 20, 12), items[0].created)
+
+    def test_since_stops_early(self):
+        # The second item, created at 03:00 UTC, isn't newer.
+        items = list(feed.iter_items(RDF_FEED,
+                                     since=datetime(2010, 11, 21, 3)))
+        self.assertEquals(['$900 / 1br - Third'],
+                          [item.title for item in items])
+
+        items = list(feed.iter_items(RDF_FEED,
+                                     since=datetime(2010, 11, 21, 2, 59)))
+        self.assertEquals(2, len(items))
+        self.assertEquals([], list(feed.iter_items(
+            RDF_FEED, since=datetime(2010, 11, 22))))
+        self.assertEquals(3, len(list(feed.iter_items(
+            RDF_FEED, since=datetime(2010, 11, 20)))))
+
+    def test_stops_before_parsing_the_rest(self):
+        # Nothing past the first old item is parsed, not even broken XML.
+        content = RDF_FEED.replace('</rdf:RDF>', '<item><title>broken')
+        items = list(feed.iter_items(content,
+                                     since=datetime(2010, 11, 21, 3)))
+        self.assertEquals(1, len(items))
+        self.assertRaises(SyntaxError, list, feed.iter_items(content))
+
+    def test_sample_feed(self):
+        content = open(SAMPLE_FEED).read()
+        items = list(feed.iter_items(content))
+        self.assertEquals(60, len(items))
+        for item in items:
+            self.assertTrue(item.title)
+            self.assertTrue(item.link.startswith('http://'))
+            self.assertNotEquals(None, item.created)
+
+
+if __name__ == '__main__':
+    unittest.main()
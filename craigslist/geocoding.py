@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+
+"""Cached geocoding of post addresses.
+
+Addresses are normalized (case, whitespace and punctuation, with the List's
+city and state appended to fallback locations that lack them) and looked up
+in two cache tiers: an in-memory LRU cache per instance, then GeocodedAddress
+entities in the datastore. Only misses reach the geocoding service, with one
+concurrent fetch per distinct address, and lookups of an address already
+being fetched by another thread wait for that fetch instead of repeating it.
+
+Successful results are cached for POSITIVE_TTL and ZERO_RESULTS for
+NEGATIVE_TTL; transient failures such as OVER_QUERY_LIMIT aren't cached.
+
+Fetches are rate limited by the shared limiter; addresses that don't get a
+token aren't fetched and come back DEFERRED, and OVER_QUERY_LIMIT responses
+slow the limiter down.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+from datetime import datetime, timedelta
+from urllib import urlencode
+
+from google.appengine.api import urlfetch
+from google.appengine.ext import db
+from django.utils import simplejson as json
+
+from craigslist import GeocodedAddress
+from craigslist.ratelimit import RateLimiter
+from geo.lru import LRUCache
+
+GEOCODING_API = 'http://beta.tremblefrog.org/geocoding.php'
+
+POSITIVE_TTL = timedelta(days=30)
+NEGATIVE_TTL = timedelta(days=1)
+
+# Statuses cached with NEGATIVE_TTL.
+NEGATIVE_STATUSES = ('ZERO_RESULTS',)
+
+# Status of a failed or timed out fetch.
+UNAVAILABLE = 'UNAVAILABLE'
+
+# Status of an address not fetched for lack of a rate limiter token.
+DEFERRED = 'DEFERRED'
+
+# Quota error status of the geocoder.
+OVER_QUERY_LIMIT = 'OVER_QUERY_LIMIT'
+
+MEMORY_CACHE_SIZE = 5000
+
+# Seconds to wait for another thread's fetch of the same address.
+COALESCE_TIMEOUT = 10
+
+RE_SEPARATORS = re.compile(r'[\s,;]+')
+
+limiter = RateLimiter('geocoding', initial_rate=2, min_rate=0.1,
+                      max_rate=10)
+
+_cache = LRUCache(MEMORY_CACHE_SIZE)
+_inflight_lock = threading.Lock()
+_inflight = {}
+
+
+class GeocodeResult(object):
+    """The result of geocoding an address.
+
+    Attributes:
+      status: The geocoder's status, such as 'OK' or 'ZERO_RESULTS', or
+          UNAVAILABLE.
+      location: A db.GeoPt if status is 'OK', or None.
+      approx: Whether the location is only that of a political area, such as
+          a neighborhood or a city.
+      expires: The datetime after which the result is stale, or None if it
+          mustn't be cached.
+    """
+    __slots__ = ('status', 'location', 'approx', 'expires')
+
+    def __init__(self, status, location=None, approx=False, expires=None):
+        self.status = status
+        self.location = location
+        self.approx = approx
+        self.expires = expires
+
+
+def normalize_address(address, city=None, state=None):
+    """Returns the normalized form of an address, which is both sent to the
+    geocoder and used as the cache key.
+
+    Args:
+      address: The address as found in a post.
+      city, state: The city and state of the post's List, appended if the
+          address contains neither, as for fallback locations.
+    """
+    address = RE_SEPARATORS.sub(' ', address.lower()).strip(' .')
+    suffix = [part.lower() for part in (city, state) if part]
+    if suffix and not [part for part in suffix if part in address]:
+        address = ' '.join([address] + suffix)
+    return address
+
+
+def _cache_key_name(address):
+    # Key names are limited in length; addresses aren't.
+    return 'geo:' + hashlib.md5(address.encode('utf-8')).hexdigest()
+
+
+def _start_fetch(address):
+    rpc = urlfetch.create_rpc()
+    urlfetch.make_fetch_call(rpc, '%s?%s' % (GEOCODING_API, urlencode([
+        ('address', address.encode('utf-8')), ('sensor', 'false')])))
+    return rpc
+
+
+def _fetch_result(rpc):
+    try:
+        result = rpc.get_result()
+    except urlfetch.Error, e:
+        logging.warning('Geocoding fetch failed: %r' % e)
+        return GeocodeResult(UNAVAILABLE)
+
+    if result.status_code != 200:
+        return GeocodeResult(UNAVAILABLE)
+
+    now = datetime.utcnow()
+    try:
+        response = json.loads(result.content)
+        status = response['status']
+        if status == 'OK':
+            location = response['results'][0]['geometry']['location']
+            return GeocodeResult(
+                'OK', db.GeoPt(location['lat'], location['lng']),
+                'political' in response['results'][0]['types'],
+                now + POSITIVE_TTL)
+    except (ValueError, KeyError, IndexError, TypeError,
+            db.BadValueError), e:
+        # Malformed responses are transient failures, not cached.
+        logging.warning('Bad geocoding response: %r' % e)
+        return GeocodeResult(UNAVAILABLE)
+    if status in NEGATIVE_STATUSES:
+        return GeocodeResult(status, expires=now + NEGATIVE_TTL)
+    return GeocodeResult(status)
+
+
+def _stored_result(entity):
+    if entity is None or entity.expires < datetime.utcnow():
+        return None
+    return GeocodeResult(entity.status, entity.location, entity.approx,
+                         entity.expires)
+
+
+def geocode_many(addresses):
+    """Geocodes normalized addresses, returning a dict from address to
+    GeocodeResult."""
+    now = datetime.utcnow()
+    results = {}
+
+    # In-memory cache.
+    misses = []
+    for address in set(addresses):
+        result = _cache.get(address)
+        if result is not None and result.expires > now:
+            results[address] = result
+        else:
+            misses.append(address)
+    if not misses:
+        return results
+
+    # Datastore cache, in a single batch get.
+    keys = [db.Key.from_path('GeocodedAddress', _cache_key_name(address))
+            for address in misses]
+    fetch_addresses = []
+    for address, entity in zip(misses, db.get(keys)):
+        result = _stored_result(entity)
+        if result is not None:
+            _cache.put(address, result)
+            results[address] = result
+        else:
+            fetch_addresses.append(address)
+    if not fetch_addresses:
+        return results
+
+    # Fetch the rest, unless another thread already is.
+    owned = {}
+    waiting = {}
+    _inflight_lock.acquire()
+    try:
+        for address in fetch_addresses:
+            if address in _inflight:
+                waiting[address] = _inflight[address]
+            else:
+                owned[address] = _inflight[address] = threading.Event()
+    finally:
+        _inflight_lock.release()
+
+    try:
+        owned_addresses = owned.keys()
+        granted = limiter.acquire(len(owned_addresses))
+        for address in owned_addresses[granted:]:
+            results[address] = GeocodeResult(DEFERRED)
+
+        rpcs = [(address, _start_fetch(address))
+                for address in owned_addresses[:granted]]
+        stored = []
+        throttled = succeeded = False
+        for address, rpc in rpcs:
+            result = _fetch_result(rpc)
+            results[address] = result
+            if result.status == OVER_QUERY_LIMIT:
+                throttled = True
+            elif result.status != UNAVAILABLE:
+                succeeded = True
+            if result.expires is not None:
+                _cache.put(address, result)
+                stored.append(GeocodedAddress(
+                    key_name=_cache_key_name(address), address=address,
+                    status=result.status, location=result.location,
+                    approx=result.approx, expires=result.expires))
+        if stored:
+            db.put(stored)
+
+        if throttled:
+            limiter.throttled()
+        elif succeeded:
+            limiter.succeeded()
+    finally:
+        _inflight_lock.acquire()
+        try:
+            for address, event in owned.iteritems():
+                del _inflight[address]
+                event.set()
+        finally:
+            _inflight_lock.release()
+
+    for address, event in waiting.iteritems():
+        event.wait(COALESCE_TIMEOUT)
+        results[address] = _cache.get(address) or GeocodeResult(DEFERRED)
+
+    return results
+
+
+def geocode(address, city=None, state=None):
+    """Returns the GeocodeResult of an address; see normalize_address()."""
+    address = normalize_address(address, city, state)
+    return geocode_many([address])[address]
+
+
+def stats():
+    """Returns the stats of the in-memory cache and of the rate limiter."""
+    return {'cache': _cache.stats(), 'limiter': limiter.stats()}
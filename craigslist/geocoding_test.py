@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+"""Unit tests for geocoding.py.
+
+Needs the App Engine SDK and the application directory on the path. The
+geocoding service and the rate limiter are replaced by fakes.
+"""
+
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+from google.appengine.api import urlfetch
+from google.appengine.ext import db
+from google.appengine.ext import testbed
+
+from craigslist import GeocodedAddress
+import geocoding
+
+OK_RESPONSE = ('{"status": "OK", "results": [{"types": ["street_address"], '
+               '"geometry": {"location": {"lat": 44.97, "lng": -93.26}}}]}')
+
+
+class FakeResult(object):
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+
+class FakeRPC(object):
+    def __init__(self, result):
+        self.result = result
+
+    def get_result(self):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+class FakeLimiter(object):
+    def __init__(self, tokens=100):
+        self.tokens = tokens
+        self.calls = []
+
+    def acquire(self, count):
+        granted = min(count, self.tokens)
+        self.tokens -= granted
+        return granted
+
+    def throttled(self):
+        self.calls.append('throttled')
+
+    def succeeded(self):
+        self.calls.append('succeeded')
+
+
+class FetchResultTests(unittest.TestCase):
+    def fetch(self, content, status_code=200):
+        return geocoding._fetch_result(FakeRPC(FakeResult(content,
+                                                          status_code)))
+
+    def test_ok(self):
+        result = self.fetch(OK_RESPONSE)
+        self.assertEquals('OK', result.status)
+        self.assertEquals(db.GeoPt(44.97, -93.26), result.location)
+        self.assertFalse(result.approx)
+        self.assertTrue(result.expires > datetime.utcnow() +
+                        geocoding.NEGATIVE_TTL)
+
+    def test_political(self):
+        result = self.fetch(OK_RESPONSE.replace('street_address',
+                                                'political'))
+        self.assertTrue(result.approx)
+
+    def test_statuses(self):
+        result = self.fetch('{"status": "ZERO_RESULTS", "results": []}')
+        self.assertEquals('ZERO_RESULTS', result.status)
+        self.assertTrue(result.expires < datetime.utcnow() +
+                        geocoding.NEGATIVE_TTL + timedelta(minutes=1))
+        result = self.fetch('{"status": "OVER_QUERY_LIMIT"}')
+        self.assertEquals(geocoding.OVER_QUERY_LIMIT, result.status)
+        self.assertEquals(None, result.expires)
+
+    def test_failures(self):
+        result = geocoding._fetch_result(FakeRPC(urlfetch.DownloadError()))
+        self.assertEquals(geocoding.UNAVAILABLE, result.status)
+        result = self.fetch(OK_RESPONSE, status_code=500)
+        self.assertEquals(geocoding.UNAVAILABLE, result.status)
+
+    def test_malformed(self):
+        for content in ['<html>Bad gateway</html>', '', '[]', '{}',
+                        '{"status": "OK"}',
+                        '{"status": "OK", "results": []}',
+                        '{"status": "OK", "results": [{"types": []}]}',
+                        OK_RESPONSE.replace('44.97', 'null')]:
+            result = self.fetch(content)
+            self.assertEquals(geocoding.UNAVAILABLE, result.status, content)
+            self.assertEquals(None, result.expires)
+
+
+class NormalizeAddressTests(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEquals('1129 university ave se minneapolis mn',
+                          geocoding.normalize_address(
+                              '  1129 University Ave SE,\tMinneapolis;  MN.'))
+
+    def test_city_and_state(self):
+        self.assertEquals('como park minneapolis mn',
+                          geocoding.normalize_address('Como Park',
+                                                      'Minneapolis', 'MN'))
+        # Not appended to addresses that already name the city or state.
+        self.assertEquals('uptown minneapolis',
+                          geocoding.normalize_address('Uptown, Minneapolis',
+                                                      'minneapolis', 'mn'))
+        self.assertEquals('lake st mn', geocoding.normalize_address(
+            'Lake St MN', 'Minneapolis', 'MN'))
+        self.assertEquals('lake st minneapolis', geocoding.normalize_address(
+            'Lake St', 'Minneapolis'))
+        self.assertEquals('lake st', geocoding.normalize_address('Lake St'))
+
+
+class GeocodeTests(unittest.TestCase):
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        geocoding._cache.clear()
+        self.limiter, geocoding.limiter = geocoding.limiter, FakeLimiter()
+        self.start_fetch = geocoding._start_fetch
+        geocoding._start_fetch = self.fake_start_fetch
+        self.fetched = []
+        self.responses = {}
+
+    def tearDown(self):
+        geocoding.limiter = self.limiter
+        geocoding._start_fetch = self.start_fetch
+        geocoding._cache.clear()
+        self.testbed.deactivate()
+
+    def fake_start_fetch(self, address):
+        self.fetched.append(address)
+        return FakeRPC(FakeResult(self.responses.get(address, OK_RESPONSE)))
+
+    def test_cache_tiers(self):
+        result = geocoding.geocode('1129 University Ave SE')
+        self.assertEquals('OK', result.status)
+        self.assertEquals(['1129 university ave se'], self.fetched)
+        self.assertEquals(['succeeded'], geocoding.limiter.calls)
+        entity = GeocodedAddress.get_by_key_name(
+            geocoding._cache_key_name('1129 university ave se'))
+        self.assertEquals(db.GeoPt(44.97, -93.26), entity.location)
+
+        # From the instance cache.
+        self.assertEquals(result, geocoding.geocode('1129 University Ave SE'))
+        # From the datastore, as on another instance.
+        geocoding._cache.clear()
+        result = geocoding.geocode('1129 University Ave SE')
+        self.assertEquals(db.GeoPt(44.97, -93.26), result.location)
+        self.assertEquals(1, len(self.fetched))
+        self.assertTrue('1129 university ave se' in geocoding._cache)
+
+    def test_expired(self):
+        address = 'lake st'
+        GeocodedAddress(key_name=geocoding._cache_key_name(address),
+                        address=address, status='ZERO_RESULTS',
+                        expires=datetime.utcnow() - timedelta(minutes=1)).put()
+        geocoding._cache.put(address, geocoding.GeocodeResult(
+            'ZERO_RESULTS', expires=datetime.utcnow() - timedelta(minutes=1)))
+        self.assertEquals('OK', geocoding.geocode('Lake St').status)
+        self.assertEquals([address], self.fetched)
+
+    def test_transient_failures_not_cached(self):
+        self.responses['lake st'] = '{"status": "OVER_QUERY_LIMIT"}'
+        self.responses['hennepin ave'] = 'Bad gateway'
+        results = geocoding.geocode_many(['lake st', 'hennepin ave'])
+        self.assertEquals(geocoding.OVER_QUERY_LIMIT,
+                          results['lake st'].status)
+        self.assertEquals(geocoding.UNAVAILABLE,
+                          results['hennepin ave'].status)
+        self.assertEquals(['throttled'], geocoding.limiter.calls)
+        self.assertEquals(0, GeocodedAddress.all().count())
+        self.assertEquals(0, len(geocoding._cache))
+
+    def test_deferred(self):
+        geocoding.limiter.tokens = 1
+        results = geocoding.geocode_many(['a', 'b', 'b'])
+        self.assertEquals(1, len(self.fetched))
+        self.assertEquals(sorted(['OK', geocoding.DEFERRED]),
+                          sorted([result.status for result in
+                                  results.values()]))
+
+    def test_inflight_coalescing(self):
+        # Another thread is fetching the address.
+        event = threading.Event()
+        geocoding._inflight['lake st'] = event
+        result = geocoding.GeocodeResult('OK', db.GeoPt(44.95, -93.3),
+                                         expires=datetime.utcnow() +
+                                         geocoding.POSITIVE_TTL)
+
+        def fetched():
+            geocoding._cache.put('lake st', result)
+            del geocoding._inflight['lake st']
+            event.set()
+        timer = threading.Timer(0.1, fetched)
+        timer.start()
+        try:
+            results = geocoding.geocode_many(['lake st', 'hennepin ave'])
+        finally:
+            timer.join()
+        # Only the other address is fetched; this one is waited for.
+        self.assertEquals(['hennepin ave'], self.fetched)
+        self.assertTrue(results['lake st'] is result)
+        self.assertEquals({}, geocoding._inflight)
+
+    def test_inflight_timeout(self):
+        timeout = geocoding.COALESCE_TIMEOUT
+        geocoding.COALESCE_TIMEOUT = 0.01
+        geocoding._inflight['lake st'] = threading.Event()
+        try:
+            result = geocoding.geocode('Lake St')
+        finally:
+            geocoding.COALESCE_TIMEOUT = timeout
+            del geocoding._inflight['lake st']
+        self.assertEquals(geocoding.DEFERRED, result.status)
+        self.assertEquals([], self.fetched)
+
+    def test_inflight_while_fetching(self):
+        def start_fetch(address):
+            # Registered while fetched, so that other threads wait.
+            self.assertTrue(address in geocoding._inflight)
+            self.assertFalse(geocoding._inflight[address].isSet())
+            return self.fake_start_fetch(address)
+        geocoding._start_fetch = start_fetch
+        geocoding.geocode('Lake St')
+        self.assertEquals(['lake st'], self.fetched)
+        self.assertEquals({}, geocoding._inflight)
+
+
+if __name__ == '__main__':
+    unittest.main()
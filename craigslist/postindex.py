@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+"""In-process spatial index of the recent posts of each List.
+
+A List only holds POST_RETENTION_DAYS days of posts, so the lat/lon, price,
+creation time and title of all of them fit in memory. Each instance builds the
+index of a List the first time it is searched, from the List's snapshot (see
+craigslist.snapshot) when it has one, keeps it up to date with the
+posts stored by PostTaskHandler, and catches up with posts stored by other
+instances, by the time they were stored, when the List's version counter in
+memcache changes. Posts older than the retention period expire from the index
+the same way CleanupTaskHandler deletes them from the datastore.
+
+Searches served from an index never touch the datastore; if a List can't be
+indexed, or is still being indexed by another request, get() returns None
+and callers fall back to datastore queries. Each index has its own lock,
+held only while it is read or changed in memory, so that loading or
+syncing one List doesn't hold up searches of the others.
+"""
+
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+from craigslist import ListSnapshot, Post, snapshot
+from geo import geoquery, geotypes, storage
+
+# Posts older than this many days are deleted by CleanupTaskHandler.
+POST_RETENTION_DAYS = 7
+
+# Lists with more posts than this are not indexed.
+MAX_INDEXED_POSTS = 20000
+
+# Minimum seconds between checks for posts stored by other instances.
+SYNC_INTERVAL = 5
+
+# Minimum seconds between expiries of posts older than the retention period.
+EXPIRE_INTERVAL = 600
+
+# Number of posts fetched per datastore round trip when loading an index.
+LOAD_BATCH_SIZE = 500
+
+# Catching up starts this long before the last catch-up started, for the
+# clock skew between instances and posts not yet visible to queries.
+STORE_SKEW = timedelta(seconds=60)
+
+# Guards _indexes and _loading, not the indexes themselves.
+_lock = threading.RLock()
+_indexes = {}
+_loading = set()
+
+
+def retention_cutoff():
+    """Returns the creation time before which posts are expired."""
+    return datetime.utcnow() - timedelta(days=POST_RETENTION_DAYS)
+
+
+class IndexedPost(object):
+    """The searchable fields of a Post, with the same attribute names."""
+    __slots__ = ('_key', 'location', 'title', 'price', 'created',
+                 'approx_geolocation')
+
+    def __init__(self, key, lat, lon, title, price, created,
+                 approx_geolocation):
+        self._key = key
+        self.location = geotypes.Point(lat, lon)
+        self.title = title
+        self.price = price
+        self.created = created
+        self.approx_geolocation = bool(approx_geolocation)
+
+    def key(self):
+        return self._key
+
+    latitude = property(lambda self: self.location.lat)
+    longitude = property(lambda self: self.location.lon)
+
+
+def _post_key(id_or_name):
+    if id_or_name.isdigit():
+        return db.Key.from_path('Post', int(id_or_name))
+    return db.Key.from_path('Post', id_or_name)
+
+
+def _indexed_posts(posts):
+    cutoff = retention_cutoff()
+    return [IndexedPost(post.key(), post.location.lat, post.location.lon,
+                        post.title, post.price, post.created,
+                        post.approx_geolocation)
+            for post in posts
+            if post.location and post.created and post.created >= cutoff]
+
+
+def _indexed_rows(columns):
+    cutoff = retention_cutoff()
+    entries = []
+    for i in xrange(len(columns['key'])):
+        created = snapshot.to_datetime(columns['created'][i])
+        if created >= cutoff:
+            entries.append(IndexedPost(
+                _post_key(columns['key'][i]), columns['lat'][i],
+                columns['lon'][i], columns['title'][i], columns['price'][i],
+                created, columns['approx'][i]))
+    return entries
+
+
+class PostIndex(object):
+    """The spatial index of the recent posts of a single List."""
+
+    def __init__(self, list_key):
+        self.list_key = list_key
+        self.backend = storage.MemoryBackend()
+        self.stored_since = None
+        self.version = None
+        self.last_sync = 0
+        self.last_expire = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.backend)
+
+    def add(self, posts):
+        """Indexes the given Posts, replacing any already indexed."""
+        self._put(_indexed_posts(posts))
+
+    def _put(self, entries):
+        self._lock.acquire()
+        try:
+            self.backend.put(entries)
+        finally:
+            self._lock.release()
+
+    def _add_query(self, query):
+        # Datastore round trips are made without holding the lock.
+        while True:
+            batch = query.fetch(LOAD_BATCH_SIZE)
+            self.add(batch)
+            if len(self.backend) > MAX_INDEXED_POSTS:
+                return False
+            if len(batch) < LOAD_BATCH_SIZE:
+                return True
+            query.with_cursor(query.cursor())
+
+    def load(self):
+        """Indexes the live posts of the List, from its snapshot and the
+        posts stored since if it has one, or else from the datastore.
+        Returns False if the List has too many posts to index."""
+        loaded = ListSnapshot.load(self.list_key.id())
+        if loaded is not None and snapshot.is_current(loaded[0]):
+            data, self.stored_since = loaded
+            self._put(_indexed_rows(snapshot.from_string(data)))
+            if len(self.backend) > MAX_INDEXED_POSTS:
+                return False
+            return self.catch_up()
+
+        self.stored_since = datetime.utcnow()
+        return self._add_query(
+            Post.all().filter('posted_list =', self.list_key).filter(
+                'created >=', retention_cutoff()).order('created'))
+
+    def catch_up(self):
+        """Indexes the posts of the List stored since the last load or
+        catch-up started, whatever their creation times. Returns False if
+        the List has too many posts to index."""
+        since = self.stored_since - STORE_SKEW
+        self.stored_since = datetime.utcnow()
+        return self._add_query(
+            Post.all().filter('posted_list =', self.list_key).filter(
+                'stored >=', since).order('stored'))
+
+    def expire(self, cutoff=None):
+        """Removes the posts created before the given time, by default the
+        retention cutoff."""
+        cutoff = cutoff or retention_cutoff()
+        self._lock.acquire()
+        try:
+            self.backend.delete([entry.key() for entry in self.backend
+                                 if entry.created < cutoff])
+        finally:
+            self._lock.release()
+
+    def _due(self, now):
+        # Claims the sync and the expiry that are due, so that concurrent
+        # requests don't repeat them.
+        self._lock.acquire()
+        try:
+            sync = now - self.last_sync >= SYNC_INTERVAL
+            if sync:
+                self.last_sync = now
+            expire = now - self.last_expire >= EXPIRE_INTERVAL
+            if expire:
+                self.last_expire = now
+            return sync, expire
+        finally:
+            self._lock.release()
+
+    def sync(self, now=None):
+        """Catches up with posts stored by other instances, and expires old
+        posts, if due."""
+        sync, expire = self._due(now or time.time())
+        if sync:
+            version = memcache.get(_version_key(self.list_key))
+            if version is None or version != self.version:
+                self.version = version
+                self.catch_up()
+        if expire:
+            self.expire()
+
+    def _backend(self, approx=True, since=None):
+        if approx and since is None:
+            return self.backend
+        return storage.FilteredBackend(
+            self.backend, lambda entry:
+                (approx or not entry.approx_geolocation) and
+                (since is None or entry.created > since))
+
+    def proximity_fetch(self, center, max_results=10, max_distance=0,
+                        approx=True):
+        """Returns the posts closest to center, like Post.proximity_fetch().
+        Posts with approximate locations are left out unless approx is
+        True."""
+        self._lock.acquire()
+        try:
+            return geoquery.proximity_fetch(self._backend(approx), center,
+                                            max_results=max_results,
+                                            max_distance=max_distance)
+        finally:
+            self._lock.release()
+
+    def bounding_box_fetch(self, bbox, max_results=1000, approx=True,
+                           since=None):
+        """Returns the newest posts inside bbox, like Post.bounding_box_fetch()
+        on a query ordered by '-created'. Posts with approximate locations are
+        left out unless approx is True, and posts created at or before since
+        are left out if it is given."""
+        self._lock.acquire()
+        try:
+            posts = geoquery.bounding_box_fetch(self._backend(approx, since),
+                                                bbox, max_results=len(self))
+        finally:
+            self._lock.release()
+        posts.sort(key=lambda entry: entry.created, reverse=True)
+        return posts[:max_results]
+
+
+def _version_key(list_key):
+    return 'postindex:%d' % list_key.id()
+
+
+def _load(list_key):
+    """Returns the new PostIndex of a List, None if it has too many posts,
+    or raises db.Error."""
+    index = PostIndex(list_key)
+    index.version = memcache.get(_version_key(list_key))
+    index.last_sync = index.last_expire = time.time()
+    if not index.load():
+        logging.warning('List %d has too many posts to index' %
+                        list_key.id())
+        return None
+    return index
+
+
+def get(list_id):
+    """Returns the up to date PostIndex of the List with the given id, or
+    None if the List can't be indexed or is being indexed."""
+    list_key = db.Key.from_path('List', list_id)
+    _lock.acquire()
+    try:
+        if list_key in _loading:
+            return None
+        if list_key not in _indexes:
+            _loading.add(list_key)
+            loading = True
+        else:
+            index = _indexes[list_key]
+            loading = False
+    finally:
+        _lock.release()
+
+    if loading:
+        # Loaded without holding the lock; searches of this List go to the
+        # datastore meanwhile.
+        index = None
+        loaded = False
+        try:
+            try:
+                index = _load(list_key)
+                loaded = True
+            except db.Error, e:
+                logging.warning('Failed to index list %d: %s' % (list_id, e))
+        finally:
+            _lock.acquire()
+            try:
+                _loading.discard(list_key)
+                if loaded:
+                    _indexes[list_key] = index
+            finally:
+                _lock.release()
+        return index
+
+    if index is not None:
+        try:
+            index.sync()
+        except db.Error, e:
+            logging.warning('Failed to sync index of list %d: %s' %
+                            (list_id, e))
+    return index
+
+
+def posts_stored(posts):
+    """Adds newly stored Posts to the indexes of this instance, and signals
+    the other instances to catch up with them."""
+    posts_by_list = {}
+    for post in posts:
+        list_key = Post.posted_list.get_value_for_datastore(post)
+        posts_by_list.setdefault(list_key, []).append(post)
+
+    for list_key, list_posts in posts_by_list.iteritems():
+        _lock.acquire()
+        try:
+            index = _indexes.get(list_key)
+        finally:
+            _lock.release()
+        if index is not None:
+            index.add(list_posts)
+        if memcache.incr(_version_key(list_key)) is None:
+            memcache.add(_version_key(list_key), 1)
+
+
+def posts_expired(cutoff=None):
+    """Removes posts created before the given time, by default the retention
+    cutoff, from the indexes of this instance."""
+    _lock.acquire()
+    try:
+        indexes = [index for index in _indexes.itervalues()
+                   if index is not None]
+    finally:
+        _lock.release()
+    for index in indexes:
+        index.expire(cutoff)
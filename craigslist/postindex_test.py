@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+"""Unit tests for postindex.py.
+
+Needs the App Engine SDK and the application directory on the path.
+"""
+
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from google.appengine.api import memcache
+from google.appengine.ext import db
+from google.appengine.ext import testbed
+
+from craigslist import List, ListSnapshot, Post
+import postindex
+import snapshot
+from geo import geomath, geotypes
+
+
+class PostIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.list_key = List(city='minneapolis', category='apa').put()
+        self.now = datetime.utcnow()
+        postindex._indexes.clear()
+        postindex._loading.clear()
+
+    def tearDown(self):
+        postindex._indexes.clear()
+        postindex._loading.clear()
+        self.testbed.deactivate()
+
+    def make_post(self, name, lat=44.97, lon=-93.26, price=900,
+                  age=timedelta(hours=1), approx=False, put=True):
+        post = Post(key_name=name, title=u'Room %s' % name,
+                    link='http://example.com/%s' % name,
+                    description=u'Description', price=price,
+                    created=self.now - age, approx_geolocation=approx,
+                    posted_list=self.list_key,
+                    location=db.GeoPt(lat, lon))
+        post.update_location()
+        if put:
+            post.put()
+        return post
+
+    def keys(self, posts):
+        return sorted([post.key().name() for post in posts])
+
+    def index_keys(self, index):
+        return self.keys(index.backend)
+
+
+class FetchTests(PostIndexTestCase):
+    def setUp(self):
+        PostIndexTestCase.setUp(self)
+        rand = random.Random(0)
+        self.posts = [self.make_post('p%d' % i, lat=rand.gauss(44.97, 0.05),
+                                     lon=rand.gauss(-93.26, 0.05),
+                                     age=timedelta(minutes=rand.randint(
+                                         1, 60 * 24 * 6)),
+                                     approx=rand.random() < 0.3, put=False)
+                      for i in range(300)]
+        db.put(self.posts)
+        self.index = postindex.PostIndex(self.list_key)
+        self.assertTrue(self.index.load())
+
+    def test_bounding_box_fetch(self):
+        bbox = geotypes.Box(45.0, -93.2, 44.93, -93.3)
+        since = self.now - timedelta(days=2)
+        for approx in [True, False]:
+            for since in [None, since]:
+                expected = [post for post in self.posts
+                            if bbox.contains(post.location) and
+                            (approx or not post.approx_geolocation) and
+                            (since is None or post.created > since)]
+                expected.sort(key=lambda post: post.created, reverse=True)
+                self.assertTrue(expected)
+                results = self.index.bounding_box_fetch(bbox, approx=approx,
+                                                        since=since)
+                self.assertEquals([post.key() for post in expected],
+                                  [post.key() for post in results])
+                results = self.index.bounding_box_fetch(
+                    bbox, max_results=5, approx=approx, since=since)
+                self.assertEquals([post.key() for post in expected[:5]],
+                                  [post.key() for post in results])
+
+    def test_proximity_fetch(self):
+        center = geotypes.Point(44.98, -93.25)
+        for approx in [True, False]:
+            by_distance = sorted([
+                (geomath.haversine(center, post.location), post.key())
+                for post in self.posts
+                if approx or not post.approx_geolocation])
+            for max_results, max_distance in [(1, 0), (10, 0), (50, 3000)]:
+                expected = [key for distance, key in by_distance
+                            if not max_distance or
+                            distance < max_distance][:max_results]
+                results = self.index.proximity_fetch(
+                    center, max_results=max_results,
+                    max_distance=max_distance, approx=approx)
+                self.assertEquals(expected,
+                                  [post.key() for post in results])
+
+    def test_indexed_fields(self):
+        post = self.posts[0]
+        indexed = self.index.backend.get(post.key())
+        self.assertEquals(post.title, indexed.title)
+        self.assertEquals(post.price, indexed.price)
+        self.assertEquals(post.created, indexed.created)
+        self.assertEquals(post.approx_geolocation,
+                          indexed.approx_geolocation)
+        self.assertEquals((post.latitude, post.longitude),
+                          (indexed.latitude, indexed.longitude))
+
+
+class LoadTests(PostIndexTestCase):
+    def test_load_from_datastore(self):
+        self.make_post('new')
+        self.make_post('old', age=timedelta(days=8))
+        other = self.make_post('other')
+        other.posted_list = List(city='stpaul', category='apa').put()
+        other.put()
+
+        index = postindex.PostIndex(self.list_key)
+        self.assertTrue(index.load())
+        self.assertEquals(['new'], self.index_keys(index))
+
+    def test_load_from_snapshot(self):
+        # Not in the datastore, so only found in the snapshot.
+        posts = [self.make_post('a', put=False),
+                 self.make_post('old', age=timedelta(days=8), put=False)]
+        ListSnapshot.store(self.list_key.id(), snapshot.update(None, posts),
+                           self.now + postindex.STORE_SKEW)
+
+        index = postindex.PostIndex(self.list_key)
+        self.assertTrue(index.load())
+        self.assertEquals(['a'], self.index_keys(index))
+        self.assertEquals(u'Room a', index.backend.get(posts[0].key()).title)
+
+        # Posts stored after the snapshot are caught up with.
+        self.make_post('b')
+        index = postindex.PostIndex(self.list_key)
+        self.assertTrue(index.load())
+        self.assertEquals(['a', 'b'], self.index_keys(index))
+
+    def test_snapshot_post_ids(self):
+        post = Post(title=u'Room', link='http://example.com/id',
+                    description=u'Description', created=self.now,
+                    posted_list=self.list_key,
+                    location=db.GeoPt(44.97, -93.26))
+        post.put()
+        # Indexed once, with the same key from the snapshot as from the
+        # catch-up.
+        ListSnapshot.store(self.list_key.id(), snapshot.update(None, [post]),
+                           self.now + postindex.STORE_SKEW)
+        index = postindex.PostIndex(self.list_key)
+        index.load()
+        self.assertEquals([post.key()], [entry.key() for entry in
+                                         index.backend])
+
+    def test_older_snapshot_format(self):
+        data = snapshot.update(None, [self.make_post('a', put=False)])
+        ListSnapshot.store(self.list_key.id(), 'PSNAP002' + data[8:],
+                           self.now)
+        self.make_post('b')
+        index = postindex.PostIndex(self.list_key)
+        self.assertTrue(index.load())
+        self.assertEquals(['b'], self.index_keys(index))
+
+    def test_too_many_posts(self):
+        max_posts = postindex.MAX_INDEXED_POSTS
+        postindex.MAX_INDEXED_POSTS = 2
+        try:
+            for name in ['a', 'b', 'c']:
+                self.make_post(name)
+            self.assertFalse(postindex.PostIndex(self.list_key).load())
+            self.assertEquals(None, postindex.get(self.list_key.id()))
+            self.assertEquals(None, postindex._indexes[self.list_key])
+        finally:
+            postindex.MAX_INDEXED_POSTS = max_posts
+
+
+class CatchUpTests(PostIndexTestCase):
+    def test_catch_up(self):
+        self.make_post('a')
+        index = postindex.PostIndex(self.list_key)
+        index.load()
+        # Stored by another instance, whatever its creation time.
+        self.make_post('b', age=timedelta(days=3))
+        self.assertTrue(index.catch_up())
+        self.assertEquals(['a', 'b'], self.index_keys(index))
+
+    def test_catch_up_with_skew(self):
+        index = postindex.PostIndex(self.list_key)
+        index.load()
+        # Stored just before the load started, by a skewed clock.
+        post = self.make_post('a')
+        post.stored = index.stored_since - postindex.STORE_SKEW / 2
+        post.put()
+        index.catch_up()
+        self.assertEquals(['a'], self.index_keys(index))
+
+    def test_sync_on_version_change(self):
+        self.make_post('a')
+        index = postindex.get(self.list_key.id())
+        self.assertEquals(['a'], self.index_keys(index))
+
+        # Another instance stores a post.
+        self.make_post('b')
+        memcache.set(postindex._version_key(self.list_key), 1)
+        self.assertTrue(postindex.get(self.list_key.id()) is index)
+        self.assertEquals(['a'], self.index_keys(index))
+        index.last_sync = 0
+        postindex.get(self.list_key.id())
+        self.assertEquals(['a', 'b'], self.index_keys(index))
+
+    def test_posts_stored(self):
+        index = postindex.get(self.list_key.id())
+        post = self.make_post('a')
+        postindex.posts_stored([post])
+        self.assertEquals(['a'], self.index_keys(index))
+        self.assertEquals(1, memcache.get(
+            postindex._version_key(self.list_key)))
+
+
+class ExpireTests(PostIndexTestCase):
+    def test_expire(self):
+        self.make_post('a', age=timedelta(days=1))
+        self.make_post('b', age=timedelta(days=5))
+        index = postindex.get(self.list_key.id())
+        index.expire(self.now - timedelta(days=2))
+        self.assertEquals(['a'], self.index_keys(index))
+        postindex.posts_expired(self.now)
+        self.assertEquals([], self.index_keys(index))
+
+
+class GetTests(PostIndexTestCase):
+    def test_get(self):
+        self.make_post('a')
+        index = postindex.get(self.list_key.id())
+        self.assertEquals(['a'], self.index_keys(index))
+        self.assertTrue(postindex.get(self.list_key.id()) is index)
+
+    def test_loading(self):
+        # Searches fall back to the datastore while another request loads
+        # the index.
+        postindex._loading.add(self.list_key)
+        self.assertEquals(None, postindex.get(self.list_key.id()))
+        self.assertFalse(self.list_key in postindex._indexes)
+
+        postindex._loading.discard(self.list_key)
+        self.assertNotEquals(None, postindex.get(self.list_key.id()))
+        self.assertEquals(set(), postindex._loading)
+
+    def test_load_failure(self):
+        def fail(list_key):
+            raise db.Timeout()
+        load, postindex._load = postindex._load, fail
+        try:
+            self.assertEquals(None, postindex.get(self.list_key.id()))
+        finally:
+            postindex._load = load
+        # Not cached, so the next request tries again.
+        self.assertEquals(set(), postindex._loading)
+        self.assertFalse(self.list_key in postindex._indexes)
+        self.assertNotEquals(None, postindex.get(self.list_key.id()))
+
+
+if __name__ == '__main__':
+    unittest.main()
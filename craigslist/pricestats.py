@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+"""Price statistics of the live posts of each List, from quantile sketches.
+
+The prices of a List's posts are added, as they are synced, to a KLL sketch
+(see craigslist.quantiles) per day of creation, stored as a PriceSketch. The
+sketches of the days within the retention period are merged into the List's
+price_sketch, from which its quantiles and price histogram are read, so the
+stats cover all live posts without rescanning them. Sketches of days past the
+retention period are deleted as posts expire; the stats are therefore those
+of the posts of the last POST_RETENTION_DAYS days, to within a day.
+"""
+
+import hashlib
+from datetime import timedelta
+
+from google.appengine.ext import db
+
+from craigslist import List, PriceSketch
+from craigslist.postindex import POST_RETENTION_DAYS, retention_cutoff
+from craigslist.quantiles import KLLSketch, merged
+
+SKETCH_K = 200
+
+EXPIRE_BATCH_SIZE = 500
+
+# The number of batch digests kept per PriceSketch; a day of a List gets at
+# most one batch per sync.
+MAX_BATCHES = 500
+
+# The fractions of List.aggregated_prices, and of the quantiles of summary().
+AGGREGATED_QUANTILES = [0.25, 0.5, 0.75]
+SUMMARY_QUANTILES = [i / 20.0 for i in range(21)]
+
+# The number of equal-width buckets of summary() histograms, up to the 99th
+# percentile so that outliers don't squash the others into one bucket.
+HISTOGRAM_BUCKETS = 20
+HISTOGRAM_MAX_QUANTILE = 0.99
+
+
+def _key_name(list_id, day):
+    return '%d:%s' % (list_id, day.isoformat())
+
+
+def _batch_digest(prices):
+    return hashlib.md5(repr(sorted(prices))).hexdigest()
+
+
+def _add_to_day(list_id, day, prices):
+    key_name = _key_name(list_id, day)
+    batch = _batch_digest(prices)
+    price_sketch = PriceSketch.get_by_key_name(key_name)
+    if price_sketch is None:
+        price_sketch = PriceSketch(key_name=key_name,
+                                   sublist=db.Key.from_path('List', list_id),
+                                   day=day)
+        sketch = KLLSketch(SKETCH_K)
+    elif batch in price_sketch.batches:
+        return
+    else:
+        sketch = KLLSketch.from_string(price_sketch.data)
+    sketch.update([price for created, price in prices])
+    price_sketch.data = db.Blob(sketch.to_string())
+    price_sketch.batches = (price_sketch.batches + [batch])[-MAX_BATCHES:]
+    price_sketch.put()
+
+
+def add_prices(list_id, prices):
+    """Adds the prices of new posts of a List to the sketches of their days,
+    and refreshes the List's stats. Adding the same prices again, as a
+    retried task does, changes nothing.
+
+    Args:
+      list_id: The id of the List.
+      prices: A sequence of the (creation datetime, price) of the posts.
+    """
+    by_day = {}
+    for created, price in prices:
+        by_day.setdefault(created.date(), []).append((created, price))
+    for day, day_prices in by_day.iteritems():
+        db.run_in_transaction(_add_to_day, list_id, day, day_prices)
+    refresh(list_id)
+
+
+def live_sketch(list_id, cutoff=None):
+    """Returns the merged sketch of the days of a List since a cutoff, by
+    default the retention cutoff."""
+    cutoff = cutoff or retention_cutoff()
+    first_day = cutoff.date()
+    days = [first_day + timedelta(days=i)
+            for i in range(POST_RETENTION_DAYS + 2)]
+    price_sketches = PriceSketch.get_by_key_name(
+        [_key_name(list_id, day) for day in days])
+    return merged([KLLSketch.from_string(price_sketch.data)
+                   for price_sketch in price_sketches
+                   if price_sketch is not None and price_sketch.data],
+                  SKETCH_K)
+
+
+def _store_stats(list_id, sketch):
+    # In a transaction, so as not to revert the sync state that SyncHandler
+    # stores in the List meanwhile.
+    post_list = List.get_by_id(list_id)
+    if post_list is None:
+        return
+    post_list.price_sketch = db.Blob(sketch.to_string())
+    if sketch.count:
+        post_list.aggregated_prices = sketch.quantiles(AGGREGATED_QUANTILES)
+    else:
+        post_list.aggregated_prices = [0] * len(AGGREGATED_QUANTILES)
+    post_list.put()
+
+
+def refresh(list_id, cutoff=None):
+    """Stores the merged sketch of the live days of a List, and the
+    quantiles of AGGREGATED_QUANTILES, in the List."""
+    db.run_in_transaction(_store_stats, list_id, live_sketch(list_id, cutoff))
+
+
+def expire(cutoff):
+    """Deletes the sketches of the days before a cutoff's, and refreshes the
+    stats of the Lists they belonged to."""
+    list_ids = set()
+    query = PriceSketch.all(keys_only=True).filter('day <', cutoff.date())
+    while True:
+        keys = query.fetch(EXPIRE_BATCH_SIZE)
+        if not keys:
+            break
+        db.delete(keys)
+        list_ids.update([int(key.name().split(':')[0]) for key in keys])
+    for list_id in list_ids:
+        refresh(list_id, cutoff)
+
+
+def summary(data):
+    """Returns a dict of the count, quantiles and histogram of a serialized
+    sketch, as packed for the UI, or None if it holds no prices."""
+    if not data:
+        return None
+    sketch = KLLSketch.from_string(data)
+    if not sketch.count:
+        return None
+
+    top = max(sketch.min + 1, sketch.quantile(HISTOGRAM_MAX_QUANTILE))
+    width = max(1, (top - sketch.min + HISTOGRAM_BUCKETS - 1) //
+                HISTOGRAM_BUCKETS)
+    edges = [sketch.min + i * width for i in range(HISTOGRAM_BUCKETS + 1)]
+    return {'count': sketch.count,
+            'quantiles': zip(SUMMARY_QUANTILES,
+                             sketch.quantiles(SUMMARY_QUANTILES)),
+            'histogram': {'edges': edges,
+                          'counts': sketch.histogram(edges)}}
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+
+"""Unit tests for pricestats.py.
+
+Needs the App Engine SDK and the application directory on the path.
+"""
+
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from google.appengine.ext import testbed
+
+from craigslist import List, PriceSketch
+import pricestats
+from quantiles import KLLSketch
+
+
+def sketch_data(values):
+    sketch = KLLSketch(pricestats.SKETCH_K)
+    sketch.update(values)
+    return sketch.to_string()
+
+
+class SummaryTests(unittest.TestCase):
+    def test_no_prices(self):
+        self.assertEquals(None, pricestats.summary(None))
+        self.assertEquals(None, pricestats.summary(''))
+        self.assertEquals(None, pricestats.summary(sketch_data([])))
+
+    def test_summary(self):
+        summary = pricestats.summary(sketch_data(range(1, 1001)))
+        self.assertEquals(1000, summary['count'])
+
+        fractions = [fraction for fraction, value in summary['quantiles']]
+        values = [value for fraction, value in summary['quantiles']]
+        self.assertEquals(pricestats.SUMMARY_QUANTILES, fractions)
+        self.assertEquals(1, values[0])
+        self.assertEquals(1000, values[-1])
+        self.assertEquals(sorted(values), values)
+
+        edges = summary['histogram']['edges']
+        counts = summary['histogram']['counts']
+        self.assertEquals(pricestats.HISTOGRAM_BUCKETS + 1, len(edges))
+        self.assertEquals(pricestats.HISTOGRAM_BUCKETS, len(counts))
+        self.assertEquals(1, edges[0])
+        self.assertEquals(1000, sum(counts))
+
+    def test_outliers_share_the_last_bucket(self):
+        random.seed(1234)
+        prices = [random.randint(500, 1500) for i in range(5000)]
+        summary = pricestats.summary(sketch_data(prices + [10 ** 7] * 5))
+        edges = summary['histogram']['edges']
+        counts = summary['histogram']['counts']
+        # The buckets span up to the 99th percentile, not the outliers.
+        self.assertTrue(edges[-1] < 2000, edges)
+        self.assertEquals(5005, sum(counts))
+        self.assertTrue(max(counts) < 1000, counts)
+
+    def test_single_price(self):
+        summary = pricestats.summary(sketch_data([700] * 10))
+        self.assertEquals(10, summary['count'])
+        self.assertEquals([700], list(set(
+            [value for fraction, value in summary['quantiles']])))
+        self.assertEquals(10, summary['histogram']['counts'][0])
+
+
+class AddPricesTests(unittest.TestCase):
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+        self.list_id = List(city='minneapolis', category='apa').put().id()
+        self.now = datetime.utcnow()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def stats_count(self):
+        post_list = List.get_by_id(self.list_id)
+        return pricestats.summary(post_list.price_sketch)['count']
+
+    def test_add_prices(self):
+        yesterday = self.now - timedelta(days=1)
+        pricestats.add_prices(self.list_id, [(self.now, 1000),
+                                             (self.now, 1200),
+                                             (yesterday, 800)])
+        self.assertEquals(2, PriceSketch.all().count())
+        self.assertEquals(3, self.stats_count())
+        self.assertEquals([800, 1000, 1200],
+                          List.get_by_id(self.list_id).aggregated_prices)
+
+    def test_added_again(self):
+        prices = [(self.now, 1000), (self.now - timedelta(days=1), 800)]
+        pricestats.add_prices(self.list_id, prices)
+        # A retried task adds the same prices again.
+        pricestats.add_prices(self.list_id, list(reversed(prices)))
+        self.assertEquals(2, self.stats_count())
+
+        # Prices of other posts of the same day are still added.
+        pricestats.add_prices(self.list_id,
+                              [(self.now - timedelta(seconds=1), 1000)])
+        self.assertEquals(3, self.stats_count())
+
+    def test_refresh_keeps_sync_state(self):
+        pricestats.add_prices(self.list_id, [(self.now, 1000)])
+        # Stored by a sync while the stats were computed.
+        post_list = List.get_by_id(self.list_id)
+        post_list.feed_etag = 'etag'
+        post_list.next_sync = self.now
+        post_list.put()
+        pricestats.refresh(self.list_id)
+        post_list = List.get_by_id(self.list_id)
+        self.assertEquals('etag', post_list.feed_etag)
+        self.assertEquals(self.now, post_list.next_sync)
+
+    def test_expire(self):
+        old = self.now - timedelta(days=pricestats.POST_RETENTION_DAYS + 2)
+        pricestats.add_prices(self.list_id, [(old, 500), (self.now, 1000)])
+        pricestats.expire(pricestats.retention_cutoff())
+        self.assertEquals(1, PriceSketch.all().count())
+        self.assertEquals(1, self.stats_count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""A mergeable streaming quantile sketch (KLL) of integer values.
+
+KLLSketch keeps a hierarchy of compactors: level h holds values that each
+stand for 2 ** h of the values added. When a level fills up, it is sorted
+and every other value, starting at a random offset, is promoted to the next
+level, so the sketch stays around 3 * k values whatever the number of values
+added, with a rank error of about 1.7 / k. Sketches of disjoint sets of
+values merge into a sketch of their union, which is what makes per-window
+sketches that can be rolled up and dropped as windows expire possible.
+
+Doesn't need App Engine.
+"""
+
+import random
+import struct
+from array import array
+
+# Format version of to_string().
+MAGIC = 'KLL1'
+
+_HEADER = struct.Struct('<4sIIIii')
+_LEVEL = struct.Struct('<I')
+
+# Values are stored as 32-bit integers, and clamped to this range.
+MIN_VALUE = -2 ** 31
+MAX_VALUE = 2 ** 31 - 1
+
+
+class KLLSketch(object):
+    """A KLL quantile sketch of integer values."""
+
+    def __init__(self, k=200):
+        """Creates an empty sketch.
+
+        Args:
+          k: The capacity of the top level; the rank error is about 1.7 / k.
+        """
+        self.k = k
+        self.count = 0
+        self.min = None
+        self.max = None
+        self._levels = [array('i')]
+        self._size = 0
+
+    def __len__(self):
+        return self.count
+
+    def _capacity(self, level):
+        depth = len(self._levels) - level - 1
+        return max(2, int(self.k * (2.0 / 3) ** depth) + 1)
+
+    def _max_size(self):
+        return sum([self._capacity(level)
+                    for level in range(len(self._levels))])
+
+    def add(self, value):
+        """Adds a value."""
+        value = min(MAX_VALUE, max(MIN_VALUE, int(value)))
+        self._levels[0].append(value)
+        self._size += 1
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if self._size >= self._max_size():
+            self._compress()
+
+    def update(self, values):
+        """Adds each of a sequence of values."""
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """Adds the values of another sketch, with the same k."""
+        if not other.count:
+            return
+        while len(self._levels) < len(other._levels):
+            self._levels.append(array('i'))
+        for level, items in enumerate(other._levels):
+            self._levels[level].extend(items)
+        self._size += other._size
+        self.count += other.count
+        if self.min is None or other.min < self.min:
+            self.min = other.min
+        if self.max is None or other.max > self.max:
+            self.max = other.max
+        while self._size >= self._max_size():
+            self._compress()
+
+    def _compress(self):
+        for level in range(len(self._levels)):
+            items = self._levels[level]
+            if len(items) < self._capacity(level):
+                continue
+            if level + 1 == len(self._levels):
+                self._levels.append(array('i'))
+
+            items = sorted(items)
+            # An odd value out stays at this level.
+            kept = array('i', items[len(items) & ~1:])
+            promoted = items[random.randint(0, 1):len(items) & ~1:2]
+            self._levels[level] = kept
+            self._levels[level + 1].extend(promoted)
+            self._size -= len(items) - len(kept) - len(promoted)
+            return
+
+    def _weighted(self):
+        weighted = []
+        for level, items in enumerate(self._levels):
+            weight = 1 << level
+            weighted.extend([(value, weight) for value in items])
+        weighted.sort()
+        return weighted
+
+    def quantiles(self, fractions):
+        """Returns the estimated values at each of a sequence of fractions
+        between 0 and 1 of the values added, or Nones if there are none."""
+        if not self.count:
+            return [None] * len(fractions)
+        # Compaction promotes half of an even number of values, each with
+        # twice the weight, so the weights always add up to count.
+        weighted = self._weighted()
+        total = self.count
+
+        results = []
+        for fraction in fractions:
+            if fraction <= 0:
+                results.append(self.min)
+                continue
+            if fraction >= 1:
+                results.append(self.max)
+                continue
+            target = fraction * total
+            rank = 0
+            result = self.max
+            for value, weight in weighted:
+                rank += weight
+                if rank > target:
+                    result = value
+                    break
+            results.append(result)
+        return results
+
+    def quantile(self, fraction):
+        """Returns the estimated value at a fraction of the values added."""
+        return self.quantiles([fraction])[0]
+
+    def histogram(self, edges):
+        """Returns the estimated numbers of values in each bucket between a
+        sorted sequence of edges, lower edge included; values outside the
+        edges are counted in the first and last buckets."""
+        counts = [0] * (len(edges) - 1)
+        if not counts:
+            return counts
+        bucket = 0
+        for value, weight in self._weighted():
+            while bucket < len(counts) - 1 and value >= edges[bucket + 1]:
+                bucket += 1
+            counts[bucket] += weight
+        return counts
+
+    def to_string(self):
+        """Returns the sketch as a string."""
+        parts = [_HEADER.pack(MAGIC, self.k, self.count, len(self._levels),
+                              self.min or 0, self.max or 0)]
+        for items in self._levels:
+            parts.append(_LEVEL.pack(len(items)))
+            parts.append(items.tostring())
+        return ''.join(parts)
+
+    @classmethod
+    def from_string(cls, data):
+        """Returns the sketch of a string returned by to_string()."""
+        magic, k, count, num_levels, min_value, max_value = \
+            _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('Not a quantile sketch')
+
+        sketch = cls(k)
+        sketch.count = count
+        if count:
+            sketch.min, sketch.max = min_value, max_value
+        sketch._levels = []
+        offset = _HEADER.size
+        for level in range(num_levels):
+            (size,) = _LEVEL.unpack_from(data, offset)
+            offset += _LEVEL.size
+            items = array('i')
+            items.fromstring(data[offset:offset + size * items.itemsize])
+            offset += size * items.itemsize
+            sketch._levels.append(items)
+        sketch._size = sum([len(items) for items in sketch._levels])
+        return sketch
+
+
+def merged(sketches, k=200):
+    """Returns a new sketch of the values of all the given sketches."""
+    result = KLLSketch(k)
+    for sketch in sketches:
+        result.merge(sketch)
+    return result
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""Unit tests for quantiles.py."""
+
+import random
+import unittest
+
+import quantiles
+from quantiles import KLLSketch
+
+
+def rank_error(values, fraction, estimate):
+    """Returns the distance, as a fraction of len(values), between the rank
+    of an estimate and the target rank of a fraction."""
+    below = len([value for value in values if value < estimate])
+    at_most = len([value for value in values if value <= estimate])
+    target = fraction * len(values)
+    if below <= target <= at_most:
+        return 0.0
+    return min(abs(below - target), abs(at_most - target)) / len(values)
+
+
+class KLLSketchTests(unittest.TestCase):
+    def setUp(self):
+        random.seed(1234)
+
+    def assertRankErrors(self, sketch, values, max_error):
+        for fraction in [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]:
+            estimate = sketch.quantile(fraction)
+            error = rank_error(values, fraction, estimate)
+            self.assertTrue(error <= max_error,
+                            'quantile %s: %s' % (fraction, estimate))
+
+    def test_empty(self):
+        sketch = KLLSketch()
+        self.assertEquals(0, len(sketch))
+        self.assertEquals([None, None], sketch.quantiles([0.5, 0.9]))
+        self.assertEquals([0, 0], sketch.histogram([0, 10, 20]))
+
+    def test_exact_when_small(self):
+        sketch = KLLSketch(k=200)
+        sketch.update(range(100, 0, -1))
+        self.assertEquals(100, len(sketch))
+        self.assertEquals(1, sketch.min)
+        self.assertEquals(100, sketch.max)
+        self.assertEquals([1, 51, 100], sketch.quantiles([0, 0.5, 1]))
+        self.assertEquals([9, 91], sketch.histogram([0, 10, 1000]))
+
+    def test_rank_error(self):
+        values = [int(random.lognormvariate(7, 0.5)) for i in range(50000)]
+        sketch = KLLSketch(k=200)
+        sketch.update(values)
+        self.assertEquals(len(values), len(sketch))
+        self.assertEquals(min(values), sketch.min)
+        self.assertEquals(max(values), sketch.max)
+        # A generous multiple of the expected error of about 1.7 / k.
+        self.assertRankErrors(sketch, values, 3 * 1.7 / 200)
+        # The sketch stays small.
+        self.assertTrue(len(sketch.to_string()) < 4 * 3 * 200 + 100)
+
+    def test_histogram_adds_up(self):
+        values = [random.randint(0, 5000) for i in range(20000)]
+        sketch = KLLSketch()
+        sketch.update(values)
+        counts = sketch.histogram(range(0, 5001, 500))
+        self.assertEquals(len(values), sum(counts))
+        for count in counts:
+            self.assertTrue(abs(count - 2000) < 200, counts)
+
+    def test_merge(self):
+        values = [random.randint(0, 10000) for i in range(30000)]
+        sketches = []
+        for i in range(0, len(values), 3000):
+            sketch = KLLSketch()
+            sketch.update(values[i:i + 3000])
+            sketches.append(sketch)
+        merged = quantiles.merged(sketches)
+        self.assertEquals(len(values), len(merged))
+        self.assertEquals(min(values), merged.min)
+        self.assertEquals(max(values), merged.max)
+        self.assertRankErrors(merged, values, 3 * 1.7 / 200)
+
+        # Merging an empty sketch, or into one, changes nothing.
+        count = len(merged)
+        merged.merge(KLLSketch())
+        self.assertEquals(count, len(merged))
+        empty = KLLSketch()
+        empty.merge(sketches[0])
+        self.assertEquals(sketches[0].quantiles([0.1, 0.5, 0.9]),
+                          empty.quantiles([0.1, 0.5, 0.9]))
+
+    def test_clamping(self):
+        sketch = KLLSketch()
+        sketch.update([-2 ** 40, 2 ** 40])
+        self.assertEquals(quantiles.MIN_VALUE, sketch.min)
+        self.assertEquals(quantiles.MAX_VALUE, sketch.max)
+
+    def test_string_round_trip(self):
+        for size in [0, 1, 150, 10000]:
+            sketch = KLLSketch(k=100)
+            sketch.update([random.randint(-500, 500) for i in range(size)])
+            copy = KLLSketch.from_string(sketch.to_string())
+            self.assertEquals(sketch.k, copy.k)
+            self.assertEquals(len(sketch), len(copy))
+            self.assertEquals(sketch.min, copy.min)
+            self.assertEquals(sketch.max, copy.max)
+            self.assertEquals(sketch.quantiles([0.1, 0.5, 0.9]),
+                              copy.quantiles([0.1, 0.5, 0.9]))
+            self.assertEquals(sketch.to_string(), copy.to_string())
+
+            # A copy keeps working like the original.
+            copy.update(range(100))
+            self.assertEquals(len(sketch) + 100, len(copy))
+
+    def test_from_string_rejects_other_data(self):
+        data = 'XXXX' + KLLSketch().to_string()[4:]
+        self.assertRaises(ValueError, KLLSketch.from_string, data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""Client-side rate limiting of calls to an external service, shared by all
+instances through memcache.
+
+A RateLimiter hands out tokens from a bucket holding rate * WINDOW tokens,
+refilled at the start of every WINDOW second window; the bucket is a
+memcache counter per window, so that concurrent acquire() calls on any
+instance never grant more than the bucket holds. The rate adapts to the
+service's quota responses by additive increase, multiplicative decrease
+(AIMD): every window in which calls succeeded raises it by a fixed step, and
+a quota error halves it, at most once per cooldown period.
+
+Work that doesn't get tokens should be deferred and retried after
+retry_after() seconds rather than failed; deferred() and resumed() keep
+track of the backlog of deferred calls for stats().
+"""
+
+import time
+
+from google.appengine.api import memcache
+
+# Seconds per token bucket refill.
+WINDOW = 10
+
+
+class RateLimiter(object):
+    """An adaptive, memcache-backed token bucket rate limiter."""
+
+    def __init__(self, name, initial_rate, min_rate, max_rate,
+                 increase=0.1, decrease=0.5, cooldown=30):
+        """Creates a rate limiter; limiters with the same name share state.
+
+        Args:
+          name: The name of the limited service.
+          initial_rate: The rate to start at, in calls per second.
+          min_rate, max_rate: The bounds of the rate.
+          increase: The rate added after each window with successful calls.
+          decrease: The factor the rate is multiplied by on quota errors.
+          cooldown: The minimum seconds between two rate decreases.
+        """
+        self.name = name
+        self.initial_rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+
+    def _key(self, *parts):
+        return ':'.join(['ratelimit', self.name] + map(str, parts))
+
+    def _incr(self, key, delta=1, expires=0):
+        value = memcache.incr(key, delta)
+        if value is None:
+            # Missing; another instance may be adding it at the same time.
+            if memcache.add(key, delta, time=expires):
+                return delta
+            value = memcache.incr(key, delta)
+        return value
+
+    def rate(self):
+        """Returns the current rate, in calls per second."""
+        milli_rate = memcache.get(self._key('rate'))
+        if milli_rate is None:
+            milli_rate = int(self.initial_rate * 1000)
+            memcache.add(self._key('rate'), milli_rate)
+        return milli_rate / 1000.0
+
+    def _set_rate(self, rate):
+        rate = min(self.max_rate, max(self.min_rate, rate))
+        memcache.set(self._key('rate'), int(rate * 1000))
+        return rate
+
+    def acquire(self, count=1):
+        """Takes up to count tokens, and returns how many were granted."""
+        if count <= 0:
+            return 0
+        capacity = max(1, int(self.rate() * WINDOW))
+        window = int(time.time() / WINDOW)
+        used = self._incr(self._key('window', window), count,
+                          expires=2 * WINDOW)
+        if used is None:
+            # Memcache is unavailable; don't stall all work.
+            return count
+
+        granted = max(0, min(count, capacity - (used - count)))
+        if granted:
+            self._incr(self._key('granted'), granted)
+        if granted < count:
+            self._incr(self._key('denied'), count - granted)
+        return granted
+
+    def succeeded(self):
+        """Records successful calls, increasing the rate once per window."""
+        window = int(time.time() / WINDOW)
+        if memcache.add(self._key('increased', window), 1, time=2 * WINDOW):
+            self._set_rate(self.rate() + self.increase)
+
+    def throttled(self):
+        """Records a quota error, decreasing the rate unless it was decreased
+        within the cooldown period."""
+        self._incr(self._key('throttled'))
+        if memcache.add(self._key('cooldown'), 1, time=self.cooldown):
+            self._set_rate(self.rate() * self.decrease)
+
+    def retry_after(self, count=1):
+        """Returns the seconds after which count deferred calls, queued behind
+        the current backlog, are expected to get tokens."""
+        backlog = memcache.get(self._key('backlog')) or 0
+        return max(WINDOW, int((backlog + count) / self.rate()))
+
+    def deferred(self, count):
+        """Records calls added to the backlog."""
+        self._incr(self._key('backlog'), count)
+
+    def resumed(self, count):
+        """Records backlogged calls being tried again."""
+        memcache.decr(self._key('backlog'), count)
+
+    def stats(self):
+        """Returns a dict of the current rate and backlog, and the numbers of
+        tokens granted and denied and of quota errors so far."""
+        counters = memcache.get_multi(
+            ['backlog', 'granted', 'denied', 'throttled'],
+            key_prefix=self._key(''))
+        stats = {'rate': self.rate()}
+        for name in ['backlog', 'granted', 'denied', 'throttled']:
+            stats[name] = counters.get(name, 0)
+        return stats
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""Unit tests for ratelimit.py.
+
+Needs the App Engine SDK on the path. Memcache and the clock are replaced by
+fakes, so that windows and expirations can be stepped through.
+"""
+
+import unittest
+
+import ratelimit
+
+
+class FakeClock(object):
+    def __init__(self, now=1000000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeMemcache(object):
+    """The memcache calls RateLimiter makes, on a dict, with expirations
+    against a FakeClock."""
+    def __init__(self, clock):
+        self.clock = clock
+        self.values = {}
+        self.expires = {}
+        self.down = False
+
+    def _live(self, key):
+        expires = self.expires.get(key)
+        if expires and expires <= self.clock.now:
+            del self.values[key]
+            del self.expires[key]
+        return key in self.values
+
+    def get(self, key):
+        if self.down or not self._live(key):
+            return None
+        return self.values[key]
+
+    def get_multi(self, keys, key_prefix=''):
+        values = {}
+        for key in keys:
+            value = self.get(key_prefix + key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    def set(self, key, value, time=0):
+        if self.down:
+            return False
+        self.values[key] = value
+        self.expires[key] = time and self.clock.now + time
+        return True
+
+    def add(self, key, value, time=0):
+        if self.down or self._live(key):
+            return False
+        return self.set(key, value, time)
+
+    def incr(self, key, delta=1):
+        if self.down or not self._live(key):
+            return None
+        self.values[key] += delta
+        return self.values[key]
+
+    def decr(self, key, delta=1):
+        if self.down or not self._live(key):
+            return None
+        self.values[key] = max(0, self.values[key] - delta)
+        return self.values[key]
+
+
+class RateLimiterTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.memcache = FakeMemcache(self.clock)
+        self.real_memcache, ratelimit.memcache = ratelimit.memcache, \
+            self.memcache
+        self.real_time, ratelimit.time = ratelimit.time, self.clock
+        self.limiter = ratelimit.RateLimiter('test', initial_rate=2,
+                                             min_rate=0.5, max_rate=3)
+
+    def tearDown(self):
+        ratelimit.memcache = self.real_memcache
+        ratelimit.time = self.real_time
+
+    def next_window(self):
+        self.clock.now += ratelimit.WINDOW
+
+    def test_acquire_up_to_capacity(self):
+        self.assertEquals(2.0, self.limiter.rate())
+        self.assertEquals(0, self.limiter.acquire(0))
+        self.assertEquals(15, self.limiter.acquire(15))
+        self.assertEquals(5, self.limiter.acquire(15))
+        self.assertEquals(0, self.limiter.acquire(1))
+
+        # The bucket is refilled in the next window.
+        self.next_window()
+        self.assertEquals(20, self.limiter.acquire(25))
+
+        stats = self.limiter.stats()
+        self.assertEquals(40, stats['granted'])
+        self.assertEquals(16, stats['denied'])
+
+    def test_shared_by_name(self):
+        other = ratelimit.RateLimiter('test', initial_rate=2, min_rate=0.5,
+                                      max_rate=3)
+        self.assertEquals(12, self.limiter.acquire(12))
+        self.assertEquals(8, other.acquire(12))
+        unrelated = ratelimit.RateLimiter('other', initial_rate=2,
+                                          min_rate=0.5, max_rate=3)
+        self.assertEquals(12, unrelated.acquire(12))
+
+    def test_memcache_down(self):
+        self.memcache.down = True
+        self.assertEquals(100, self.limiter.acquire(100))
+
+    def test_increase_once_per_window(self):
+        self.limiter.succeeded()
+        self.limiter.succeeded()
+        self.assertAlmostEquals(2.1, self.limiter.rate())
+        for i in range(20):
+            self.next_window()
+            self.limiter.succeeded()
+        self.assertEquals(3.0, self.limiter.rate())
+
+    def test_decrease_with_cooldown(self):
+        self.limiter.throttled()
+        self.limiter.throttled()
+        self.assertEquals(1.0, self.limiter.rate())
+        self.clock.now += self.limiter.cooldown
+        self.limiter.throttled()
+        self.assertEquals(0.5, self.limiter.rate())
+        self.clock.now += self.limiter.cooldown
+        self.limiter.throttled()
+        self.assertEquals(0.5, self.limiter.rate())
+        self.assertEquals(4, self.limiter.stats()['throttled'])
+
+        # A smaller rate means a smaller bucket.
+        self.next_window()
+        self.assertEquals(5, self.limiter.acquire(10))
+
+    def test_retry_after(self):
+        self.assertEquals(ratelimit.WINDOW, self.limiter.retry_after(1))
+        self.limiter.deferred(100)
+        self.assertEquals(100, self.limiter.stats()['backlog'])
+        self.assertEquals(55, self.limiter.retry_after(10))
+        self.limiter.resumed(60)
+        self.assertEquals(25, self.limiter.retry_after(10))
+        self.limiter.resumed(60)
+        self.assertEquals(0, self.limiter.stats()['backlog'])
+
+
+if __name__ == '__main__':
+    unittest.main()
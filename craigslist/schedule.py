@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Adaptive scheduling of the syncs of each List.
+
+Each List is polled on its own interval, chosen so that about TARGET_NEW_POSTS
+new posts are expected per poll given the List's post arrival rate: busy
+Lists are polled before their feed's window of FEED_WINDOW posts overflows,
+quiet ones rarely. The arrival rate is an exponentially weighted moving
+average of the rates observed by successive polls. Intervals are halved
+right away when a poll finds the whole feed new, spread by +/- JITTER so that
+Lists don't stay in lockstep, and bounded by MIN_INTERVAL and MAX_INTERVAL.
+
+ScheduleHandler in handlers/tasks.py, run by cron, queues a sync task for each
+List whose next_sync has passed, named after task_time().
+"""
+
+import calendar
+import random
+from datetime import datetime, timedelta
+
+# Bounds of the polling interval, and the interval of Lists never polled.
+MIN_INTERVAL = timedelta(minutes=5)
+MAX_INTERVAL = timedelta(hours=6)
+DEFAULT_INTERVAL = timedelta(minutes=30)
+
+# The number of posts in a Craigslist feed, and the number of new posts a
+# poll aims at, leaving room for bursts.
+FEED_WINDOW = 100
+TARGET_NEW_POSTS = 25
+
+# The weight of the latest observed rate in the moving average.
+RATE_WEIGHT = 0.3
+
+# The maximum relative change of an interval by jitter.
+JITTER = 0.1
+
+
+def _seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1e6
+
+
+def interval(arrival_rate):
+    """Returns the polling interval, as a timedelta, of a List with the
+    given arrival rate in posts per second; the rate is None if unknown."""
+    if arrival_rate is None:
+        return DEFAULT_INTERVAL
+    # Clamped before making a timedelta, which overflows for tiny rates.
+    if arrival_rate <= TARGET_NEW_POSTS / _seconds(MAX_INTERVAL):
+        return MAX_INTERVAL
+    seconds = TARGET_NEW_POSTS / arrival_rate
+    return max(MIN_INTERVAL, timedelta(seconds=seconds))
+
+
+def polled(sync_list, new_posts, now=None):
+    """Updates the arrival rate and the next sync time of a List after a
+    poll, without storing it.
+
+    Args:
+      sync_list: The polled List.
+      new_posts: The number of new posts found, or None if the poll failed.
+      now: The time of the poll, by default the current time.
+    """
+    now = now or datetime.utcnow()
+    if new_posts is not None and sync_list.last_polled is not None:
+        elapsed = _seconds(now - sync_list.last_polled)
+        if elapsed > 0:
+            rate = new_posts / elapsed
+            if sync_list.arrival_rate is None:
+                sync_list.arrival_rate = rate
+            else:
+                sync_list.arrival_rate = (RATE_WEIGHT * rate +
+                                          (1 - RATE_WEIGHT) *
+                                          sync_list.arrival_rate)
+
+    next_interval = interval(sync_list.arrival_rate)
+    if new_posts is not None and new_posts >= FEED_WINDOW:
+        # Posts were probably missed; catch up before the average does.
+        next_interval = next_interval // 2
+    next_interval = timedelta(seconds=_seconds(next_interval) *
+                              random.uniform(1 - JITTER, 1 + JITTER))
+    next_interval = min(MAX_INTERVAL, max(MIN_INTERVAL, next_interval))
+
+    if new_posts is not None:
+        sync_list.last_polled = now
+    sync_list.next_sync = now + next_interval
+
+
+def task_time(next_sync, now):
+    """Returns the time, in seconds since the epoch, after which the sync task
+    of a List due at next_sync is named: next_sync, or the epoch if the List
+    was never scheduled, moved on by whole MAX_INTERVALs while it is overdue.
+
+    A sync moves next_sync on even when it fails, but a task that fails for
+    good before it does is dropped by the queue; its List is then queued
+    again, under a new name, once per MAX_INTERVAL.
+    """
+    due = 0
+    if next_sync is not None:
+        due = calendar.timegm(next_sync.utctimetuple())
+    overdue = calendar.timegm(now.utctimetuple()) - due
+    if overdue > 0:
+        due += overdue - overdue % int(_seconds(MAX_INTERVAL))
+    return due
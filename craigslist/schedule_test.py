@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""Unit tests for schedule.py."""
+
+import calendar
+import unittest
+from datetime import datetime, timedelta
+
+import schedule
+
+
+def seconds(delta):
+    return schedule._seconds(delta)
+
+
+def timestamp(when):
+    return calendar.timegm(when.utctimetuple())
+
+
+class FakeList(object):
+    def __init__(self, arrival_rate=None, last_polled=None):
+        self.arrival_rate = arrival_rate
+        self.last_polled = last_polled
+        self.next_sync = None
+
+
+class IntervalTests(unittest.TestCase):
+    def test_unknown_rate(self):
+        self.assertEquals(schedule.DEFAULT_INTERVAL, schedule.interval(None))
+
+    def test_bounds(self):
+        self.assertEquals(schedule.MAX_INTERVAL, schedule.interval(0))
+        self.assertEquals(schedule.MAX_INTERVAL, schedule.interval(-1.0))
+        self.assertEquals(schedule.MIN_INTERVAL, schedule.interval(1000.0))
+        for rate in [1e-6, 1e-3, 0.01, 0.1, 1.0]:
+            interval = schedule.interval(rate)
+            self.assertTrue(schedule.MIN_INTERVAL <= interval <=
+                            schedule.MAX_INTERVAL)
+
+    def test_target(self):
+        # 25 posts at one post a minute.
+        self.assertEquals(timedelta(minutes=25), schedule.interval(1 / 60.0))
+
+    def test_tiny_rates(self):
+        # Would overflow a timedelta if not clamped first.
+        for rate in [1e-300, 5e-324, 1e-12]:
+            self.assertEquals(schedule.MAX_INTERVAL, schedule.interval(rate))
+
+    def test_decaying_rate(self):
+        # A List that stops getting posts keeps being polled at the longest
+        # interval as its average rate decays towards zero.
+        now = datetime(2010, 1, 1)
+        sync_list = FakeList(arrival_rate=1.0, last_polled=now)
+        for i in range(3000):
+            now = sync_list.next_sync or now + schedule.MIN_INTERVAL
+            schedule.polled(sync_list, 0, now)
+        self.assertEquals(now, sync_list.last_polled)
+        self.assertTrue(sync_list.next_sync - now <= schedule.MAX_INTERVAL)
+
+
+class PolledTests(unittest.TestCase):
+    def test_first_poll(self):
+        now = datetime(2010, 1, 1)
+        sync_list = FakeList()
+        schedule.polled(sync_list, 40, now)
+        self.assertEquals(None, sync_list.arrival_rate)
+        self.assertEquals(now, sync_list.last_polled)
+        self.assertTrue(abs(seconds(sync_list.next_sync - now) -
+                            seconds(schedule.DEFAULT_INTERVAL)) <=
+                        seconds(schedule.DEFAULT_INTERVAL) * schedule.JITTER)
+
+    def test_moving_average(self):
+        now = datetime(2010, 1, 1)
+        sync_list = FakeList(arrival_rate=0.01,
+                             last_polled=now - timedelta(seconds=1000))
+        schedule.polled(sync_list, 20, now)
+        self.assertAlmostEquals(0.3 * 0.02 + 0.7 * 0.01,
+                                sync_list.arrival_rate)
+
+    def test_failed_poll(self):
+        now = datetime(2010, 1, 1)
+        last_polled = now - timedelta(hours=1)
+        sync_list = FakeList(arrival_rate=0.01, last_polled=last_polled)
+        schedule.polled(sync_list, None, now)
+        self.assertEquals(0.01, sync_list.arrival_rate)
+        self.assertEquals(last_polled, sync_list.last_polled)
+        self.assertTrue(sync_list.next_sync > now)
+
+    def test_full_feed(self):
+        now = datetime(2010, 1, 1)
+        sync_list = FakeList(arrival_rate=0.001,
+                             last_polled=now - timedelta(hours=6))
+        schedule.polled(sync_list, schedule.FEED_WINDOW, now)
+        expected = schedule.interval(sync_list.arrival_rate) // 2
+        self.assertTrue(seconds(sync_list.next_sync - now) <=
+                        seconds(expected) * (1 + schedule.JITTER))
+
+    def test_jitter_within_bounds(self):
+        now = datetime(2010, 1, 1)
+        for i in range(200):
+            # At the shortest interval, and halved below it by a full feed.
+            sync_list = FakeList(arrival_rate=1.0,
+                                 last_polled=now - timedelta(minutes=5))
+            schedule.polled(sync_list, schedule.FEED_WINDOW, now)
+            self.assertEquals(now + schedule.MIN_INTERVAL,
+                              sync_list.next_sync)
+
+            sync_list = FakeList(arrival_rate=0.0,
+                                 last_polled=now - timedelta(hours=6))
+            schedule.polled(sync_list, 0, now)
+            self.assertTrue(sync_list.next_sync - now <=
+                            schedule.MAX_INTERVAL)
+
+
+class TaskTimeTests(unittest.TestCase):
+    def test_not_overdue(self):
+        now = datetime(2010, 1, 1, 12)
+        self.assertEquals(timestamp(now), schedule.task_time(now, now))
+        later = now + timedelta(minutes=5)
+        self.assertEquals(timestamp(later), schedule.task_time(later, now))
+
+    def test_overdue(self):
+        next_sync = datetime(2010, 1, 1, 12)
+        # The same name until MAX_INTERVAL has passed, then a new one.
+        for minutes in [5, 60, 359]:
+            now = next_sync + timedelta(minutes=minutes)
+            self.assertEquals(timestamp(next_sync),
+                              schedule.task_time(next_sync, now))
+        now = next_sync + schedule.MAX_INTERVAL
+        self.assertEquals(timestamp(now), schedule.task_time(next_sync, now))
+        self.assertEquals(timestamp(now), schedule.task_time(
+            next_sync, now + timedelta(minutes=30)))
+
+    def test_never_scheduled(self):
+        now = datetime(2010, 1, 1, 13)
+        self.assertEquals(timestamp(datetime(2010, 1, 1, 12)),
+                          schedule.task_time(None, now))
+        self.assertEquals(timestamp(datetime(2010, 1, 1, 12)),
+                          schedule.task_time(None, now + timedelta(hours=4)))
+
+
+if __name__ == '__main__':
+    unittest.main()
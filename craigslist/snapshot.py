@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+
+"""Columnar snapshots of the posts of a List.
+
+A snapshot holds one array per column (lat, lon, created, price, approx
+flag, key, title) of every post of a List, without the descriptions that
+make Post entities heavy, so that all posts can be scanned and filtered at
+once, and a cold instance can index a List without paging through its
+entities.
+
+The binary layout is fixed and memory-mappable: an 8 byte magic string and
+the number of rows as a little-endian uint64, followed by each fixed-width
+column in COLUMNS order, then each string column in STRING_COLUMNS order as
+the count + 1 uint32 offsets of its UTF-8 values followed by the values
+themselves, everything padded to a multiple of 8 bytes. Keys are the ids or
+key names of the posts, as strings. Snapshots are built and updated with the
+struct module alone; reading them into a PostSnapshot for vectorized
+filtering requires NumPy.
+
+On App Engine a List's snapshot is stored across the shards of a
+ListSnapshot, rebuilt incrementally by SnapshotTaskHandler with the posts
+stored since its last update, and read by postindex to load the index of a
+List. Elsewhere it can be written to a file with write_file() and opened
+with PostSnapshot.open(), which memory-maps it.
+"""
+
+import calendar
+import os
+import struct
+import tempfile
+from datetime import datetime
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from geo import geomath
+
+MAGIC = 'PSNAP003'
+
+# (name, struct format, NumPy dtype) of each fixed-width column, in file
+# order.
+COLUMNS = [('lat', 'd', '<f8'),
+           ('lon', 'd', '<f8'),
+           ('created', 'd', '<f8'),
+           ('price', 'q', '<i8'),
+           ('approx', 'B', '|u1')]
+
+# The names of the string columns, in file order after the others.
+STRING_COLUMNS = ['key', 'title']
+
+_HEADER = struct.Struct('<8sQ')
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('NumPy is required to read post snapshots.')
+
+
+def _padding(size):
+    return -size % 8
+
+
+def _timestamp(dt):
+    return calendar.timegm(dt.utctimetuple()) + dt.microsecond / 1e6
+
+
+def to_datetime(timestamp):
+    """Returns the naive UTC datetime of a created column value."""
+    return datetime.utcfromtimestamp(timestamp)
+
+
+def empty_columns():
+    """Returns a dict of empty column lists."""
+    return dict([(name, []) for name in _column_names()])
+
+
+def _column_names():
+    return [name for name, fmt, dtype in COLUMNS] + STRING_COLUMNS
+
+
+def post_columns(posts):
+    """Returns a dict of column lists with a row for each located Post."""
+    columns = empty_columns()
+    for post in posts:
+        if not post.location or not post.created:
+            continue
+        columns['lat'].append(post.location.lat)
+        columns['lon'].append(post.location.lon)
+        columns['created'].append(_timestamp(post.created))
+        columns['price'].append(post.price or 0)
+        columns['approx'].append(int(bool(post.approx_geolocation)))
+        columns['key'].append(unicode(post.key().id_or_name()))
+        columns['title'].append(post.title or u'')
+    return columns
+
+
+def to_string(columns):
+    """Serializes a dict of column lists into a snapshot."""
+    count = len(columns['key'])
+    parts = [_HEADER.pack(MAGIC, count)]
+
+    def append(data):
+        parts.append(data)
+        parts.append('\0' * _padding(len(data)))
+
+    for name, fmt, dtype in COLUMNS:
+        append(struct.pack('<%d%s' % (count, fmt), *columns[name]))
+    for name in STRING_COLUMNS:
+        values = [value.encode('utf-8') for value in columns[name]]
+        offsets = [0]
+        for value in values:
+            offsets.append(offsets[-1] + len(value))
+        append(struct.pack('<%dI' % (count + 1), *offsets))
+        append(''.join(values))
+    return ''.join(parts)
+
+
+def _column_offsets(count):
+    """Yields the (name, struct format, dtype, offset) of each fixed-width
+    column, then (None, None, None, offset) of the first string column."""
+    offset = _HEADER.size
+    for name, fmt, dtype in COLUMNS:
+        yield name, fmt, dtype, offset
+        size = struct.calcsize('<' + fmt) * count
+        offset += size + _padding(size)
+    yield None, None, None, offset
+
+
+def _string_offsets(data, count, offset):
+    """Yields the (name, value offsets, offset of the values) of each string
+    column, given the offset of the first."""
+    for name in STRING_COLUMNS:
+        offsets = struct.unpack_from('<%dI' % (count + 1), data, offset)
+        size = 4 * (count + 1)
+        offset += size + _padding(size)
+        yield name, offsets, offset
+        offset += offsets[-1] + _padding(offsets[-1])
+
+
+def is_current(data):
+    """Returns whether data is a snapshot in the current format; snapshots
+    in older formats have to be rebuilt."""
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _read_count(data):
+    magic, count = _HEADER.unpack(data[:_HEADER.size])
+    if magic != MAGIC:
+        raise ValueError('Not a post snapshot.')
+    return count
+
+
+def from_string(data):
+    """Deserializes a snapshot into a dict of column lists."""
+    count = _read_count(data)
+    columns = {}
+    for name, fmt, dtype, offset in _column_offsets(count):
+        if name is None:
+            break
+        columns[name] = list(struct.unpack_from('<%d%s' % (count, fmt),
+                                                data, offset))
+    for name, offsets, start in _string_offsets(data, count, offset):
+        columns[name] = [data[start + offsets[i]:start + offsets[i + 1]]
+                         .decode('utf-8') for i in xrange(count)]
+    return columns
+
+
+def update(data, posts, cutoff=None):
+    """Returns a snapshot updated with new or changed posts.
+
+    Args:
+      data: The current snapshot, or None to start a new one.
+      posts: The Posts to add; rows with the same keys are replaced.
+      cutoff: An optional datetime; rows of posts created before it are
+          dropped, the way CleanupTaskHandler deletes old posts.
+    """
+    columns = data and from_string(data) or empty_columns()
+    new_columns = post_columns(posts)
+    replaced = set(new_columns['key'])
+    cutoff = cutoff and _timestamp(cutoff)
+
+    merged = empty_columns()
+    for source, skip_replaced in [(columns, True), (new_columns, False)]:
+        for i in xrange(len(source['key'])):
+            if skip_replaced and source['key'][i] in replaced:
+                continue
+            if cutoff and source['created'][i] < cutoff:
+                continue
+            for name in merged:
+                merged[name].append(source[name][i])
+    return to_string(merged)
+
+
+def write_file(path, data):
+    """Writes a snapshot to a file atomically, replacing any existing one."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                     prefix='.snapshot')
+    try:
+        os.write(fd, data)
+        os.close(fd)
+        os.rename(temp_path, path)
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class PostSnapshot(object):
+    """A read-only snapshot of the posts of a List, as NumPy arrays.
+
+    Attributes:
+      lat, lon, created, price, approx: The fixed-width columns; created is
+          in seconds since the epoch.
+    """
+
+    def __init__(self, buf):
+        _require_numpy()
+        self._buf = buf
+        count = _read_count(self._bytes(0, _HEADER.size))
+        self._count = count
+        for name, fmt, dtype, offset in _column_offsets(count):
+            if name is None:
+                break
+            setattr(self, name, numpy.frombuffer(
+                buf, dtype=numpy.dtype(dtype), count=count, offset=offset))
+
+        self._strings = {}
+        for name in STRING_COLUMNS:
+            offsets = numpy.frombuffer(buf, dtype=numpy.dtype('<u4'),
+                                       count=count + 1, offset=offset)
+            size = 4 * (count + 1)
+            offset += size + _padding(size)
+            self._strings[name] = (offsets, offset)
+            size = int(offsets[-1])
+            offset += size + _padding(size)
+
+    def _bytes(self, start, end):
+        data = self._buf[start:end]
+        if isinstance(data, numpy.ndarray):
+            return data.tostring()
+        return data
+
+    @classmethod
+    def open(cls, path):
+        """Memory-maps the snapshot in the given file."""
+        _require_numpy()
+        return cls(numpy.memmap(path, dtype=numpy.uint8, mode='r'))
+
+    def __len__(self):
+        return self._count
+
+    def mask(self, bbox=None, center=None, radius=None, min_price=None,
+             max_price=None, since=None, until=None, approx=True):
+        """Returns a boolean array selecting the posts matching all the given
+        filters.
+
+        Args:
+          bbox: A geotypes.Box the posts must be in.
+          center, radius: A geotypes.Point and a distance in meters the posts
+              must be within.
+          min_price, max_price: Inclusive price bounds.
+          since, until: Exclusive datetime bounds on creation time.
+          approx: Whether to include posts with approximate locations.
+        """
+        mask = numpy.ones(self._count, dtype=bool)
+        if bbox is not None:
+            mask &= ((self.lat >= bbox.south) & (self.lat <= bbox.north) &
+                     (self.lon >= bbox.west) & (self.lon <= bbox.east))
+        if center is not None and radius is not None:
+            mask &= geomath.distance_array(center, self.lat,
+                                           self.lon) <= radius
+        if min_price is not None:
+            mask &= self.price >= min_price
+        if max_price is not None:
+            mask &= self.price <= max_price
+        if since is not None:
+            mask &= self.created > _timestamp(since)
+        if until is not None:
+            mask &= self.created < _timestamp(until)
+        if not approx:
+            mask &= self.approx == 0
+        return mask
+
+    def strings(self, name, indices):
+        """Returns the values of a string column at the given row indices."""
+        offsets, start = self._strings[name]
+        return [self._bytes(start + offsets[i],
+                            start + offsets[i + 1]).decode('utf-8')
+                for i in indices]
+
+    def filter(self, **kwargs):
+        """Returns the keys of the posts matching the filters of mask()."""
+        return self.strings('key', numpy.flatnonzero(self.mask(**kwargs)))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""Unit tests for snapshot.py and the ListSnapshot model.
+
+Needs the App Engine SDK and the application directory on the path.
+"""
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from google.appengine.ext import db
+from google.appengine.ext import testbed
+
+from craigslist import ListSnapshot, ListSnapshotShard, Post
+import snapshot
+from geo import geotypes
+
+NOW = datetime(2010, 11, 21, 12, 0, 0)
+
+
+def make_post(name, lat=44.97, lon=-93.26, price=900, created=NOW,
+              title=u'Room', approx=False):
+    return Post(key_name=name, title=title,
+                link='http://example.com/%s' % name,
+                description=u'Description', price=price, created=created,
+                location=db.GeoPt(lat, lon), approx_geolocation=approx)
+
+
+class DatastoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub()
+        self.testbed.init_memcache_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+
+class FormatTests(DatastoreTestCase):
+    def test_layout(self):
+        data = snapshot.update(None, [make_post('a', price=5),
+                                      make_post('bc', title=u'Caf\xe9')])
+        self.assertTrue(snapshot.is_current(data))
+        self.assertEquals(0, len(data) % 8)
+        magic, count = struct.unpack_from('<8sQ', data)
+        self.assertEquals(snapshot.MAGIC, magic)
+        self.assertEquals(2, count)
+        # The first column follows the header.
+        self.assertEquals((44.97, 44.97), struct.unpack_from('<2d', data, 16))
+
+    def test_empty(self):
+        columns = snapshot.from_string(snapshot.update(None, []))
+        self.assertEquals(snapshot.empty_columns(), columns)
+
+    def test_round_trip(self):
+        posts = [make_post('a', price=0, title=u'a'),
+                 make_post('b', lat=-33.9, lon=151.2, price=2 ** 40,
+                           title=u'Caf\xe9 \u2013 2br', approx=True,
+                           created=NOW.replace(microsecond=250000)),
+                 make_post('c', price=30000000000)]
+        columns = snapshot.post_columns(posts)
+        self.assertEquals(columns,
+                          snapshot.from_string(snapshot.to_string(columns)))
+        self.assertEquals([u'a', u'b', u'c'], columns['key'])
+        self.assertEquals([0, 2 ** 40, 30000000000], columns['price'])
+        self.assertEquals([0, 1, 0], columns['approx'])
+        self.assertEquals(NOW.replace(microsecond=250000),
+                          snapshot.to_datetime(columns['created'][1]))
+
+    def test_ids_and_unlocated_posts(self):
+        post = make_post(None)
+        post.put()
+        unlocated = make_post('x')
+        unlocated.location = None
+        columns = snapshot.post_columns([post, unlocated])
+        self.assertEquals([unicode(post.key().id())], columns['key'])
+
+    def test_older_format(self):
+        data = snapshot.update(None, [make_post('a')])
+        old = 'PSNAP002' + data[8:]
+        self.assertFalse(snapshot.is_current(old))
+        self.assertRaises(ValueError, snapshot.from_string, old)
+
+    def test_update(self):
+        data = snapshot.update(None, [make_post('a', price=1),
+                                      make_post('b', price=2)])
+        # Rows with the same keys are replaced, new ones appended.
+        data = snapshot.update(data, [make_post('a', price=3),
+                                      make_post('c', price=4)])
+        columns = snapshot.from_string(data)
+        self.assertEquals([u'b', u'a', u'c'], columns['key'])
+        self.assertEquals([2, 3, 4], columns['price'])
+
+        # Rows created before the cutoff are dropped, old and new.
+        data = snapshot.update(data, [
+            make_post('d', created=NOW - timedelta(days=8)),
+            make_post('b', created=NOW - timedelta(days=8))],
+            cutoff=NOW - timedelta(days=7))
+        self.assertEquals([u'a', u'c'], snapshot.from_string(data)['key'])
+
+
+class PostSnapshotTests(DatastoreTestCase):
+    def setUp(self):
+        DatastoreTestCase.setUp(self)
+        self.data = snapshot.update(None, [
+            make_post('lake', lat=44.95, lon=-93.30, price=800,
+                      created=NOW - timedelta(hours=3)),
+            make_post('loop', lat=44.98, lon=-93.27, price=1500,
+                      created=NOW - timedelta(hours=2), title=u'Loft'),
+            make_post('far', lat=45.50, lon=-94.00, price=600,
+                      created=NOW - timedelta(hours=1), approx=True),
+            make_post('huge', lat=44.97, lon=-93.26, price=30000000000,
+                      created=NOW)])
+
+    def assertFilter(self, expected, post_snapshot, **kwargs):
+        self.assertEquals(sorted(expected),
+                          sorted(post_snapshot.filter(**kwargs)))
+
+    def check_filters(self, post_snapshot):
+        self.assertEquals(4, len(post_snapshot))
+        self.assertFilter(['lake', 'loop', 'far', 'huge'], post_snapshot)
+        self.assertFilter(['lake', 'loop', 'huge'], post_snapshot,
+                          bbox=geotypes.Box(45.0, -93.2, 44.9, -93.4))
+        self.assertFilter(['loop', 'huge'], post_snapshot,
+                          center=geotypes.Point(44.975, -93.265),
+                          radius=1000)
+        self.assertFilter(['lake', 'far'], post_snapshot, max_price=1000)
+        self.assertFilter(['loop', 'huge'], post_snapshot, min_price=1000)
+        self.assertFilter(['huge'], post_snapshot, min_price=2 ** 32)
+        self.assertFilter(['far', 'huge'], post_snapshot,
+                          since=NOW - timedelta(hours=2))
+        self.assertFilter(['lake'], post_snapshot,
+                          until=NOW - timedelta(hours=2))
+        self.assertFilter(['lake', 'loop', 'huge'], post_snapshot,
+                          approx=False)
+        self.assertFilter([], post_snapshot, max_price=1000, approx=False,
+                          since=NOW - timedelta(hours=3))
+        self.assertEquals([u'Room', u'Loft'],
+                          post_snapshot.strings('title', [0, 1]))
+
+    def test_from_string(self):
+        self.check_filters(snapshot.PostSnapshot(self.data))
+
+    def test_open(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'list.snapshot')
+            snapshot.write_file(path, self.data)
+            # Replaced atomically.
+            snapshot.write_file(path, self.data)
+            self.assertEquals(['list.snapshot'], os.listdir(directory))
+            self.check_filters(snapshot.PostSnapshot.open(path))
+        finally:
+            shutil.rmtree(directory)
+
+
+class ListSnapshotTests(DatastoreTestCase):
+    def setUp(self):
+        DatastoreTestCase.setUp(self)
+        self.shard_size = ListSnapshot.SHARD_SIZE
+        ListSnapshot.SHARD_SIZE = 100
+
+    def tearDown(self):
+        ListSnapshot.SHARD_SIZE = self.shard_size
+        DatastoreTestCase.tearDown(self)
+
+    def shard_names(self):
+        return sorted([key.name() for key in
+                       ListSnapshotShard.all(keys_only=True)])
+
+    def test_load_missing(self):
+        self.assertEquals(None, ListSnapshot.load(1))
+
+    def test_store_and_replace(self):
+        data = 'x' * 250
+        self.assertTrue(ListSnapshot.store(1, data, NOW))
+        self.assertEquals((data, NOW), ListSnapshot.load(1))
+        self.assertEquals(['1:1:0', '1:1:1', '1:1:2'], self.shard_names())
+
+        # A newer snapshot replaces the shards of the previous generation.
+        data = 'y' * 120
+        later = NOW + timedelta(minutes=5)
+        self.assertTrue(ListSnapshot.store(1, data, later))
+        self.assertEquals((data, later), ListSnapshot.load(1))
+        self.assertEquals(['1:2:0', '1:2:1'], self.shard_names())
+
+    def test_older_snapshot_not_stored(self):
+        self.assertTrue(ListSnapshot.store(1, 'new', NOW))
+        self.assertFalse(ListSnapshot.store(1, 'old',
+                                            NOW - timedelta(minutes=5)))
+        self.assertEquals(('new', NOW), ListSnapshot.load(1))
+        self.assertEquals(['1:1:0'], self.shard_names())
+
+    def test_too_large(self):
+        data = 'x' * (ListSnapshot.SHARD_SIZE * ListSnapshot.MAX_SHARDS + 1)
+        self.assertFalse(ListSnapshot.store(1, data, NOW))
+        self.assertEquals(None, ListSnapshot.load(1))
+        self.assertEquals([], self.shard_names())
+
+    def test_missing_shard(self):
+        ListSnapshot.store(1, 'x' * 150, NOW)
+        db.delete(db.Key.from_path('ListSnapshotShard', '1:1:1'))
+        self.assertEquals(None, ListSnapshot.load(1))
+
+    def test_lists_are_separate(self):
+        ListSnapshot.store(1, 'one', NOW)
+        ListSnapshot.store(2, 'two', NOW)
+        self.assertEquals(('one', NOW), ListSnapshot.load(1))
+        self.assertEquals(('two', NOW), ListSnapshot.load(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
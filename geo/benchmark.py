@@ -0,0 +1,338 @@
+#!/usr/bin/python2.5
+
+"""Micro-benchmarks for the geocell/GeoModel library.
+
+Times the core geocell, geomath and util functions, and full proximity and
+bounding box fetches against the in-memory and SQLite storage backends, on
+synthetic city-scale datasets. Results are printed as JSON, and can be
+compared against (or saved as) a stored baseline:
+
+  python benchmark.py --sizes=10000,100000 --output=results.json
+  python benchmark.py --save-baseline
+  python benchmark.py --compare
+
+Loading 1M points takes about a GB of RAM.
+"""
+
+import optparse
+import os.path
+import platform
+import random
+import sys
+import time
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+import geocell
+import geomath
+import geoquery
+import geotypes
+import storage
+import util
+
+# Default dataset sizes, in number of points.
+DEFAULT_SIZES = [10000]
+
+# The default baseline file, next to this script.
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'benchmark_baseline.json')
+
+# A result slower than baseline by more than this factor is a regression.
+DEFAULT_TOLERANCE = 1.25
+
+# Number of distinct inputs each micro-benchmark cycles through.
+_NUM_INPUTS = 1000
+
+# Synthetic city: (lat, lon, standard deviation in degrees, weight) of
+# neighborhood clusters around Minneapolis.
+_CITY_CLUSTERS = [(44.977, -93.265, 0.02, 4),
+                  (44.948, -93.236, 0.03, 3),
+                  (44.985, -93.180, 0.04, 2),
+                  (45.020, -93.300, 0.05, 1),
+                  (44.900, -93.350, 0.08, 1)]
+
+
+def make_dataset(size, seed=0):
+  """Returns a geotypes.PointArray of size points clustered like a city."""
+  rand = random.Random(seed)
+  clusters = []
+  for lat, lon, spread, weight in _CITY_CLUSTERS:
+    clusters.extend([(lat, lon, spread)] * weight)
+
+  points = geotypes.PointArray()
+  for i in xrange(size):
+    lat, lon, spread = rand.choice(clusters)
+    points.append(geotypes.Point.unchecked(rand.gauss(lat, spread),
+                                           rand.gauss(lon, spread)))
+  return points
+
+
+def make_records(points):
+  """Returns a storage.GeoRecord for each point of a geotypes.PointArray."""
+  return [storage.GeoRecord(id + 1, point) for id, point in enumerate(points)]
+
+
+def _sample(points, count, seed=1):
+  rand = random.Random(seed)
+  return [points[rand.randrange(len(points))] for i in range(count)]
+
+
+def _bench_compute(points):
+  sample = _sample(points, _NUM_INPUTS)
+  def run():
+    for point in sample:
+      geocell.compute(point)
+  return run, len(sample)
+
+
+# The memoized functions are timed uncached: the sampled cells would all be
+# cache hits after the first run.
+def _bench_compute_box(points):
+  cells = [geocell.compute(point) for point in _sample(points, _NUM_INPUTS)]
+  def run():
+    for cell in cells:
+      geocell.compute_box.uncached(cell)
+  return run, len(cells)
+
+
+def _bench_adjacent(points):
+  cells = [geocell.compute(point) for point in _sample(points, _NUM_INPUTS)]
+  def run():
+    for cell in cells:
+      geocell._adjacent.uncached(cell, 1, 1)
+  return run, len(cells)
+
+
+def _bench_interpolate(points):
+  pairs = []
+  for point in _sample(points, _NUM_INPUTS / 10):
+    cell = geocell.compute(point, 10)
+    pairs.append((cell, geocell.adjacent(geocell.adjacent(
+        geocell.adjacent(cell, geocell.SOUTHWEST), geocell.SOUTHWEST),
+        geocell.SOUTHWEST)))
+  def run():
+    for cell_ne, cell_sw in pairs:
+      geocell.interpolate(cell_ne, cell_sw)
+  return run, len(pairs)
+
+
+def _viewports(points, count):
+  """Returns count map-viewport-sized boxes around points of the dataset."""
+  rand = random.Random(2)
+  boxes = []
+  for point in _sample(points, count):
+    half_height = rand.uniform(0.01, 0.05)
+    half_width = half_height * 1.6
+    boxes.append(geotypes.Box(point.lat + half_height, point.lon + half_width,
+                              point.lat - half_height, point.lon - half_width))
+  return boxes
+
+
+def _bench_best_bbox_search_cells(points):
+  boxes = _viewports(points, _NUM_INPUTS / 10)
+  cost_function = lambda num_cells, resolution: (
+      1e10000 if num_cells > pow(geocell._GEOCELL_GRID_SIZE, 2) else 0)
+  def run():
+    for bbox in boxes:
+      geocell.best_bbox_search_cells(bbox, cost_function)
+  return run, len(boxes)
+
+
+def _bench_merge_in_place(points):
+  rand = random.Random(3)
+  lists = [sorted([rand.random() for i in range(100)]) for j in range(4)]
+  def run():
+    util.merge_in_place(*[list(l) for l in lists])
+  return run, 1
+
+
+def _bench_distance(points):
+  sample = _sample(points, _NUM_INPUTS)
+  center = sample[0]
+  def run():
+    for point in sample:
+      geomath.distance(center, point)
+  return run, len(sample)
+
+
+def _bench_proximity_fetch(backend_class):
+  def setup(points):
+    backend = backend_class()
+    backend.put(make_records(points))
+    centers = _sample(points, 20)
+    def run():
+      for center in centers:
+        geoquery.proximity_fetch(backend, center, max_results=100,
+                                 max_distance=5000)
+    return run, len(centers)
+  return setup
+
+
+def _bench_bounding_box_fetch(backend_class):
+  def setup(points):
+    backend = backend_class()
+    backend.put(make_records(points))
+    boxes = _viewports(points, 20)
+    def run():
+      for bbox in boxes:
+        geoquery.bounding_box_fetch(backend, bbox, max_results=100)
+    return run, len(boxes)
+  return setup
+
+
+# (name, setup function) pairs. A setup function takes the dataset and
+# returns a (run function, number of operations per run) tuple, or None if
+# the benchmark can't run in this environment.
+BENCHMARKS = [
+  ('geocell.compute', _bench_compute),
+  ('geocell.compute_box', _bench_compute_box),
+  ('geocell.adjacent', _bench_adjacent),
+  ('geocell.interpolate', _bench_interpolate),
+  ('geocell.best_bbox_search_cells', _bench_best_bbox_search_cells),
+  ('util.merge_in_place', _bench_merge_in_place),
+  ('geomath.distance', _bench_distance),
+  ('geoquery.proximity_fetch.memory',
+   _bench_proximity_fetch(storage.MemoryBackend)),
+  ('geoquery.proximity_fetch.sqlite',
+   _bench_proximity_fetch(storage.SQLiteBackend)),
+  ('geoquery.bounding_box_fetch.memory',
+   _bench_bounding_box_fetch(storage.MemoryBackend)),
+  ('geoquery.bounding_box_fetch.sqlite',
+   _bench_bounding_box_fetch(storage.SQLiteBackend)),
+]
+
+
+def time_run(run, min_time=0.2, repeat=3):
+  """Returns the best time in seconds of a single call to run().
+
+  Calls run() as many times as fit in min_time, repeat times over, and
+  returns the best average.
+  """
+  best = None
+  for i in range(repeat):
+    calls = 0
+    start = time.time()
+    elapsed = 0
+    while calls == 0 or elapsed < min_time:
+      run()
+      calls += 1
+      elapsed = time.time() - start
+    average = elapsed / calls
+    if best is None or average < best:
+      best = average
+  return best
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, names=None, min_time=0.2, repeat=3):
+  """Runs the benchmarks on datasets of the given sizes.
+
+  Args:
+    sizes: A list of dataset sizes, in number of points.
+    names: An optional list of benchmark names to run; defaults to all.
+    min_time: The minimum time to spend on each timing, in seconds.
+    repeat: The number of timings to take the best of.
+
+  Returns:
+    A dict from result name, of the form 'benchmark[size]', to a dict with
+    the seconds per operation ('seconds'), or 'skipped': True.
+  """
+  results = {}
+  for size in sizes:
+    points = make_dataset(size)
+    for name, setup in BENCHMARKS:
+      if names and name not in names:
+        continue
+      geocell.clear_caches()
+      result_name = '%s[%d]' % (name, size)
+      benchmark = setup(points)
+      if benchmark is None:
+        results[result_name] = {'skipped': True}
+        continue
+      run, num_ops = benchmark
+      results[result_name] = {
+          'seconds': time_run(run, min_time=min_time, repeat=repeat) / num_ops}
+  return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+  """Compares benchmark results against a baseline.
+
+  Args:
+    results: A dict of results, as returned by run_benchmarks().
+    baseline: A dict of baseline results, in the same format.
+    tolerance: The slowdown factor above which a result is a regression.
+
+  Returns:
+    A sorted list of (result name, baseline seconds, seconds, ratio,
+    is_regression) tuples for the results present and not skipped in both.
+  """
+  comparison = []
+  for name in sorted(results):
+    result = results[name]
+    base = baseline.get(name)
+    if not base or result.get('skipped') or base.get('skipped'):
+      continue
+    ratio = result['seconds'] / base['seconds']
+    comparison.append((name, base['seconds'], result['seconds'], ratio,
+                       ratio > tolerance))
+  return comparison
+
+
+def _environment():
+  # Informational only; --compare goes by the results alone.
+  return {'python': platform.python_version(),
+          'numpy': geocell.numpy is not None}
+
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                    help='comma-separated dataset sizes [default: %default]')
+  parser.add_option('--only', default='',
+                    help='comma-separated benchmark names to run')
+  parser.add_option('--min-time', type='float', default=0.2,
+                    help='minimum seconds per timing [default: %default]')
+  parser.add_option('--output', help='write JSON results to this file')
+  parser.add_option('--baseline', default=DEFAULT_BASELINE,
+                    help='baseline JSON file [default: %default]')
+  parser.add_option('--save-baseline', action='store_true',
+                    help='save the results as the new baseline')
+  parser.add_option('--compare', action='store_true',
+                    help='compare against the baseline, exiting with status '
+                         '1 on regressions')
+  parser.add_option('--tolerance', type='float', default=DEFAULT_TOLERANCE,
+                    help='slowdown factor counted as a regression '
+                         '[default: %default]')
+  options, args = parser.parse_args(argv[1:])
+
+  sizes = [int(size) for size in options.sizes.split(',') if size]
+  names = [name for name in options.only.split(',') if name]
+  results = run_benchmarks(sizes, names=names, min_time=options.min_time)
+  report = {'environment': _environment(), 'results': results}
+
+  output = json.dumps(report, indent=2, sort_keys=True)
+  print output
+  if options.output:
+    open(options.output, 'w').write(output + '\n')
+  if options.save_baseline:
+    open(options.baseline, 'w').write(output + '\n')
+
+  if options.compare:
+    baseline = json.load(open(options.baseline))['results']
+    regressions = 0
+    for name, base, seconds, ratio, is_regression in compare(
+        results, baseline, options.tolerance):
+      print >>sys.stderr, '%-45s %12.3fus %12.3fus %6.2fx%s' % (
+          name, base * 1e6, seconds * 1e6, ratio,
+          is_regression and '  REGRESSION' or '')
+      regressions += is_regression
+    if regressions:
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
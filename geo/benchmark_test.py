@@ -0,0 +1,48 @@
+#!/usr/bin/python2.5
+
+"""Unit tests for benchmark.py."""
+
+import unittest
+
+import benchmark
+
+
+class BenchmarkTests(unittest.TestCase):
+  def test_make_dataset(self):
+    points = benchmark.make_dataset(100, seed=5)
+    self.assertEquals(100, len(points))
+    self.assertEquals(list(points), list(benchmark.make_dataset(100, seed=5)))
+    for point in points:
+      self.assertTrue(44 < point.lat < 46)
+      self.assertTrue(-94 < point.lon < -92)
+
+  def test_make_records(self):
+    points = benchmark.make_dataset(10)
+    records = benchmark.make_records(points)
+    self.assertEquals(list(points), [record.location for record in records])
+    self.assertEquals(10, len(set([record.key() for record in records])))
+
+  def test_run_benchmarks(self):
+    names = ['geocell.compute', 'geoquery.proximity_fetch.sqlite']
+    results = benchmark.run_benchmarks(sizes=[20], names=names, min_time=0,
+                                       repeat=1)
+    self.assertEquals(['%s[20]' % name for name in names],
+                      sorted(results.keys()))
+    for result in results.values():
+      self.assertTrue(result['seconds'] > 0)
+
+  def test_compare(self):
+    baseline = {'a[1]': {'seconds': 1.0},
+                'b[1]': {'seconds': 1.0},
+                'c[1]': {'skipped': True}}
+    results = {'a[1]': {'seconds': 1.1},
+               'b[1]': {'seconds': 2.0},
+               'c[1]': {'seconds': 1.0},
+               'd[1]': {'seconds': 1.0}}
+    self.assertEquals([('a[1]', 1.0, 1.1, 1.1, False),
+                       ('b[1]', 1.0, 2.0, 2.0, True)],
+                      benchmark.compare(results, baseline, tolerance=1.25))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -67,11 +67,18 @@ region for the geocell.
 
 __author__ = 'api.roman.public@gmail.com (Roman Nurik)'
 
+import heapq
 import os.path
 import sys
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
 import geomath
 import geotypes
+import lru
 
 # Geocell algorithm constants.
 _GEOCELL_GRID_SIZE = 4
@@ -83,6 +90,19 @@ MAX_GEOCELL_RESOLUTION = 13
 # The maximum number of geocells to consider for a bounding box search.
 MAX_FEASIBLE_BBOX_SEARCH_CELLS = 300
 
+# The default maximum number of geocells in a mixed-resolution region cover.
+MAX_BBOX_COVER_CELLS = 16
+
+# The minimum fraction of a region's bounding box area that each additional
+# cell in its cover must save from the search.
+MIN_BBOX_COVER_CELL_GAIN = 0.1
+
+# The maximum number of results cached by compute_box(), adjacent() and
+# all_adjacents().
+COMPUTE_BOX_CACHE_SIZE = 10000
+ADJACENT_CACHE_SIZE = 10000
+ALL_ADJACENTS_CACHE_SIZE = 2000
+
 # Direction enumerations.
 NORTHWEST = (-1, 1)
 NORTH = (0, 1)
@@ -151,6 +171,149 @@ def best_bbox_search_cells(bbox, cost_function):
   return min_cost_cell_set
 
 
+def best_bbox_cover(bbox, max_cells=MAX_BBOX_COVER_CELLS):
+  """Returns a small set of mixed-resolution geocells covering a bounding box.
+
+  Unlike best_bbox_search_cells(), the returned cells may have different
+  resolutions: cells entirely inside the box are kept as coarse as possible,
+  and only cells straddling the box's edges are subdivided. See
+  region_cover().
+
+  Args:
+    bbox: A geotypes.Box indicating the bounding box being searched.
+    max_cells: The maximum number of cells to return. The cover of the
+        coarsest starting resolution is returned even if it is larger.
+
+  Returns:
+    A sorted list of geocell strings that together contain the given box.
+  """
+  return region_cover(bbox, max_cells=max_cells)
+
+
+def circle_cover(center, radius, max_cells=MAX_BBOX_COVER_CELLS):
+  """Returns a small set of mixed-resolution geocells covering a circle.
+
+  Args:
+    center: A geotypes.Point or db.GeoPt indicating the circle's center.
+    radius: The circle's radius, in meters.
+    max_cells: The maximum number of cells to return, as for region_cover().
+
+  Returns:
+    A sorted list of geocell strings that together contain the given circle.
+  """
+  return region_cover(geotypes.Circle(center, radius), max_cells=max_cells)
+
+
+def polygon_cover(vertices, max_cells=MAX_BBOX_COVER_CELLS):
+  """Returns a small set of mixed-resolution geocells covering a polygon.
+
+  Args:
+    vertices: A list of geotypes.Point indicating the polygon's vertices.
+    max_cells: The maximum number of cells to return, as for region_cover().
+
+  Returns:
+    A sorted list of geocell strings that together contain the given polygon.
+  """
+  return region_cover(geotypes.Polygon(vertices), max_cells=max_cells)
+
+
+def region_cover(region, max_cells=MAX_BBOX_COVER_CELLS):
+  """Returns a small set of mixed-resolution geocells covering a region.
+
+  The returned cells may have different resolutions: cells entirely inside the
+  region are kept as coarse as possible, and only cells straddling the
+  region's boundary are subdivided. The returned cells never overlap, so a
+  'location_geocells IN' query against them returns each entity at most once.
+
+  The cover starts from the finest single-resolution grid of cells within the
+  budget covering the region's bounding box, merges complete groups of sibling
+  cells into their parents, then repeatedly subdivides the cell that discards
+  the most area outside the region per additional cell, for as long as the
+  cell budget allows and each additional cell discards at least
+  MIN_BBOX_COVER_CELL_GAIN of the bounding box's area.
+
+  Args:
+    region: A geotypes.Box, geotypes.Circle or geotypes.Polygon, or any object
+        with bounding_box() and intersects(box) methods.
+    max_cells: The maximum number of cells to return. The cover of the
+        coarsest starting resolution is returned even if it is larger.
+
+  Returns:
+    A sorted list of geocell strings that together contain the given region.
+  """
+  bbox = region.bounding_box()
+  code_ne = compute_int(bbox.north_east, MAX_GEOCELL_RESOLUTION)
+  code_sw = compute_int(bbox.south_west, MAX_GEOCELL_RESOLUTION)
+
+  # Start from the finest single-resolution grid of cells within the budget.
+  while (int_resolution(code_sw) > 1 and
+         _interpolation_count_int(code_ne, code_sw) > max_cells):
+    code_ne = parent_int(code_ne)
+    code_sw = parent_int(code_sw)
+  cover = set([code for code in interpolate_int(code_ne, code_sw)
+               if region.intersects(compute_box_int(code))])
+
+  # Merge complete groups of 16 siblings into their parents, freeing budget
+  # for subdividing cells along the region's boundary.
+  merged = True
+  while merged:
+    merged = False
+    for parent in set([parent_int(code) for code in cover]):
+      if int_resolution(parent) >= 1:
+        siblings = children_int(parent)
+        if cover.issuperset(siblings):
+          cover.difference_update(siblings)
+          cover.add(parent)
+          merged = True
+
+  # Max-heap (via negated gains) of cells worth subdividing, along with the
+  # children each would be replaced by.
+  min_gain = MIN_BBOX_COVER_CELL_GAIN * _box_area(bbox)
+  candidates = []
+  for code in cover:
+    _push_cover_candidate(candidates, code, region, min_gain)
+
+  while candidates and len(cover) < max_cells:
+    gain, code, cell_children = heapq.heappop(candidates)
+    if len(cover) + len(cell_children) - 1 > max_cells:
+      continue
+
+    cover.remove(code)
+    cover.update(cell_children)
+    for child in cell_children:
+      _push_cover_candidate(candidates, child, region, min_gain)
+
+  return sorted([from_int(code) for code in cover])
+
+
+def _push_cover_candidate(candidates, code, region, min_gain):
+  """Queues the given cell for subdivision in region_cover(), if useful.
+
+  The gain of subdividing a cell is the area of its children that don't
+  intersect the region, per additional cell.
+  """
+  if int_resolution(code) >= MAX_GEOCELL_RESOLUTION:
+    return
+
+  cell_children = []
+  dropped_area = 0
+  for child in children_int(code):
+    child_box = compute_box_int(child)
+    if region.intersects(child_box):
+      cell_children.append(child)
+    else:
+      dropped_area += _box_area(child_box)
+
+  gain = dropped_area / max(1, len(cell_children) - 1)
+  if gain > 0 and gain >= min_gain:
+    heapq.heappush(candidates, (-gain, code, cell_children))
+
+
+def _box_area(box):
+  """Returns the area of a box in square degrees."""
+  return (box.north - box.south) * (box.east - box.west)
+
+
 def collinear(cell1, cell2, column_test):
   """Determines whether the given cells are collinear along a dimension.
 
@@ -195,28 +358,12 @@ def interpolate(cell_ne, cell_sw):
     cell_sw: The Southwest geocell string.
 
   Returns:
-    A list of geocell strings in the interpolation.
+    A list of geocell strings in the interpolation, row by row from south to
+    north, each row from west to east.
   """
-  # 2D array, will later be flattened.
-  cell_set = [[cell_sw]]
-
-  # First get adjacent geocells across until Southeast--collinearity with
-  # Northeast in vertical direction (0) means we're at Southeast.
-  while not collinear(cell_set[0][-1], cell_ne, True):
-    cell_tmp = adjacent(cell_set[0][-1], (1, 0))
-    if cell_tmp is None:
-      break
-    cell_set[0].append(cell_tmp)
-
-  # Then get adjacent geocells upwards.
-  while cell_set[-1][-1] != cell_ne:
-    cell_tmp_row = [adjacent(g, (0, 1)) for g in cell_set[-1]]
-    if cell_tmp_row[0] is None:
-      break
-    cell_set.append(cell_tmp_row)
-
-  # Flatten cell_set, since it's currently a 2D array.
-  return [g for inner in cell_set for g in inner]
+  # Enumerate rows and columns directly instead of walking adjacent cells.
+  return [from_int(code)
+          for code in interpolate_int(to_int(cell_ne), to_int(cell_sw))]
 
 
 def interpolation_count(cell_ne, cell_sw):
@@ -233,16 +380,7 @@ def interpolation_count(cell_ne, cell_sw):
   Returns:
     An int, indicating the number of geocells in the interpolation.
   """
-  bbox_ne = compute_box(cell_ne)
-  bbox_sw = compute_box(cell_sw)
-
-  cell_lat_span = bbox_sw.north - bbox_sw.south
-  cell_lon_span = bbox_sw.east - bbox_sw.west
-
-  num_cols = int((bbox_ne.east - bbox_sw.west) / cell_lon_span)
-  num_rows = int((bbox_ne.north - bbox_sw.south) / cell_lat_span)
-
-  return num_cols * num_rows
+  return _interpolation_count_int(to_int(cell_ne), to_int(cell_sw))
 
 
 def all_adjacents(cell):
@@ -254,8 +392,14 @@ def all_adjacents(cell):
   Returns:
     A list of 8 geocell strings and/or None values indicating adjacent cells.
   """
-  return [adjacent(cell, d) for d in [NORTHWEST, NORTH, NORTHEAST, EAST,
-                                      SOUTHEAST, SOUTH, SOUTHWEST, WEST]]
+  return list(_all_adjacents(cell))
+
+
+@lru.memoize(ALL_ADJACENTS_CACHE_SIZE)
+def _all_adjacents(cell):
+  """Memoized all_adjacents(), returning a tuple."""
+  return tuple([adjacent(cell, d) for d in [NORTHWEST, NORTH, NORTHEAST, EAST,
+                                            SOUTHEAST, SOUTH, SOUTHWEST, WEST]])
 
 
 def adjacent(cell, dir):
@@ -275,10 +419,12 @@ def adjacent(cell, dir):
   """
   if cell is None:
     return None
+  return _adjacent(cell, dir[0], dir[1])
 
-  dx = dir[0]
-  dy = dir[1]
 
+@lru.memoize(ADJACENT_CACHE_SIZE)
+def _adjacent(cell, dx, dy):
+  """Memoized adjacent(), taking the direction as separate arguments."""
   cell_adj_arr = list(cell)  # Split the geocell string characters into a list.
   i = len(cell_adj_arr) - 1
 
@@ -325,6 +471,25 @@ def adjacent(cell, dir):
   return ''.join(cell_adj_arr)
 
 
+def cache_stats():
+  """Returns the hit/miss statistics of the memoized geocell functions.
+
+  Returns:
+    A dict from function name to a dict with the cache's hits, misses, size
+    and max_size.
+  """
+  return {'compute_box': compute_box.cache.stats(),
+          'adjacent': _adjacent.cache.stats(),
+          'all_adjacents': _all_adjacents.cache.stats()}
+
+
+def clear_caches():
+  """Empties the caches of the memoized geocell functions."""
+  compute_box.cache.clear()
+  _adjacent.cache.clear()
+  _all_adjacents.cache.clear()
+
+
 def contains_point(cell, point):
   """Returns whether or not the given cell contains the given point."""
   return compute(point, len(cell)) == cell
@@ -345,26 +510,31 @@ def point_distance(cell, point):
   between_w_e = bbox.west <= point.lon and point.lon <= bbox.east
   between_n_s = bbox.south <= point.lat and point.lat <= bbox.north
 
+  # NOTE: haversine is used since the law of cosines in geomath.distance is
+  # unstable (and can fail in acos) for points on or very near the edges.
+  distance = lambda lat, lon: geomath.haversine(
+      point, geotypes.Point.unchecked(lat, lon))
+
   if between_w_e:
     if between_n_s:
       # Inside the geocell.
-      return min(geomath.distance(point, (bbox.south, point.lon)),
-                 geomath.distance(point, (bbox.north, point.lon)),
-                 geomath.distance(point, (point.lat, bbox.east)),
-                 geomath.distance(point, (point.lat, bbox.west)))
+      return min(distance(bbox.south, point.lon),
+                 distance(bbox.north, point.lon),
+                 distance(point.lat, bbox.east),
+                 distance(point.lat, bbox.west))
     else:
-      return min(geomath.distance(point, (bbox.south, point.lon)),
-                 geomath.distance(point, (bbox.north, point.lon)))
+      return min(distance(bbox.south, point.lon),
+                 distance(bbox.north, point.lon))
   else:
     if between_n_s:
-      return min(geomath.distance(point, (point.lat, bbox.east)),
-                 geomath.distance(point, (point.lat, bbox.west)))
+      return min(distance(point.lat, bbox.east),
+                 distance(point.lat, bbox.west))
     else:
       # TODO(romannurik): optimize
-      return min(geomath.distance(point, (bbox.south, bbox.east)),
-                 geomath.distance(point, (bbox.north, bbox.east)),
-                 geomath.distance(point, (bbox.south, bbox.west)),
-                 geomath.distance(point, (bbox.north, bbox.west)))
+      return min(distance(bbox.south, bbox.east),
+                 distance(bbox.north, bbox.east),
+                 distance(bbox.south, bbox.west),
+                 distance(bbox.north, bbox.west))
 
 
 def compute(point, resolution=MAX_GEOCELL_RESOLUTION):
@@ -405,6 +575,7 @@ def compute(point, resolution=MAX_GEOCELL_RESOLUTION):
   return cell
 
 
+@lru.memoize(COMPUTE_BOX_CACHE_SIZE)
 def compute_box(cell):
   """Computes the rectangular boundaries (bounding box) of the given geocell.
 
@@ -412,27 +583,29 @@ def compute_box(cell):
     cell: The geocell string whose boundaries are to be computed.
 
   Returns:
-    A geotypes.Box corresponding to the rectangular boundaries of the geocell.
+    A geotypes.FrozenBox corresponding to the rectangular boundaries of the
+    geocell.
   """
   if cell is None:
     return None
 
-  bbox = geotypes.Box(90.0, 180.0, -90.0, -180.0)
-
-  while len(cell) > 0:
-    subcell_lon_span = (bbox.east - bbox.west) / _GEOCELL_GRID_SIZE
-    subcell_lat_span = (bbox.north - bbox.south) / _GEOCELL_GRID_SIZE
+  north = 90.0
+  east = 180.0
+  south = -90.0
+  west = -180.0
 
-    x, y = _subdiv_xy(cell[0])
+  for char in cell:
+    subcell_lon_span = (east - west) / _GEOCELL_GRID_SIZE
+    subcell_lat_span = (north - south) / _GEOCELL_GRID_SIZE
 
-    bbox = geotypes.Box(bbox.south + subcell_lat_span * (y + 1),
-                        bbox.west  + subcell_lon_span * (x + 1),
-                        bbox.south + subcell_lat_span * y,
-                        bbox.west  + subcell_lon_span * x)
+    x, y = _subdiv_xy(char)
 
-    cell = cell[1:]
+    north = south + subcell_lat_span * (y + 1)
+    east = west + subcell_lon_span * (x + 1)
+    south = south + subcell_lat_span * y
+    west = west + subcell_lon_span * x
 
-  return bbox
+  return geotypes.FrozenBox.unchecked(north, east, south, west)
 
 
 def is_valid(cell):
@@ -451,17 +624,412 @@ def children(cell):
 
 def _subdiv_xy(char):
   """Returns the (x, y) of the geocell character in the 4x4 alphabet grid."""
-  # NOTE: This only works for grid size 4.
-  char = _GEOCELL_ALPHABET.index(char)
-  return ((char & 4) >> 1 | (char & 1) >> 0,
-          (char & 8) >> 2 | (char & 2) >> 1)
+  return _SUBDIV_XY[char]
 
 
 def _subdiv_char(pos):
   """Returns the geocell character in the 4x4 alphabet grid at pos. (x, y)."""
+  return _SUBDIV_CHAR[pos[0]][pos[1]]
+
+
+def _build_subdiv_tables():
+  """Builds the lookup tables behind _subdiv_xy() and _subdiv_char()."""
   # NOTE: This only works for grid size 4.
-  return _GEOCELL_ALPHABET[
-      (pos[1] & 2) << 2 |
-      (pos[0] & 2) << 1 |
-      (pos[1] & 1) << 1 |
-      (pos[0] & 1) << 0]
+  subdiv_xy = {}
+  subdiv_char = [[None] * _GEOCELL_GRID_SIZE
+                 for x in range(_GEOCELL_GRID_SIZE)]
+  for i, char in enumerate(_GEOCELL_ALPHABET):
+    x = (i & 4) >> 1 | (i & 1) >> 0
+    y = (i & 8) >> 2 | (i & 2) >> 1
+    subdiv_xy[char] = (x, y)
+    subdiv_char[x][y] = char
+  return subdiv_xy, subdiv_char
+
+
+_SUBDIV_XY, _SUBDIV_CHAR = _build_subdiv_tables()
+
+
+# Integer geocell codes.
+#
+# A geocell string of resolution r is a 4r-bit hexadecimal number, and because
+# of the layout of the 4x4 alphabet grid (see _subdiv_char) that number is
+# exactly the Morton (bit-interleaved) code of the cell's column and row, with
+# column bits in the even positions and row bits in the odd positions. An
+# integer geocell code stores that Morton code left-aligned in the upper 60
+# bits of a 64-bit word and the resolution in the low 4 bits:
+#
+#   63                                            4 3      0
+#   +----------------------------------------------+--------+
+#   | morton code, padded with zeros to 15 levels   | resol. |
+#   +----------------------------------------------+--------+
+#
+# Left-aligning the Morton code means that integer codes sort in the same order
+# as their geocell strings, and that a cell's descendants all fall between the
+# cell's own code and the code of its last maximal-resolution descendant.
+
+# The maximum resolution representable by an integer geocell code.
+MAX_INT_GEOCELL_RESOLUTION = 15
+
+_INT_RESOLUTION_BITS = 4
+_INT_RESOLUTION_MASK = (1 << _INT_RESOLUTION_BITS) - 1
+_EVEN_BITS = 0x5555555555555555
+
+
+def to_int(cell):
+  """Converts a geocell string to its integer geocell code.
+
+  Args:
+    cell: The geocell string to convert, of length at most
+        MAX_INT_GEOCELL_RESOLUTION. The empty string denotes the whole world.
+
+  Returns:
+    The integer geocell code for the given cell.
+
+  Raises:
+    ValueError: If the cell is too long or not a valid geocell string.
+  """
+  resolution = len(cell)
+  if resolution > MAX_INT_GEOCELL_RESOLUTION:
+    raise ValueError('Geocell resolution must be at most %d but was %d' %
+                     (MAX_INT_GEOCELL_RESOLUTION, resolution))
+  if not resolution:
+    return 0
+  if not is_valid(cell):
+    raise ValueError('Invalid geocell: %r' % (cell,))
+  return _pack_int(int(cell, 16), resolution)
+
+
+def from_int(code):
+  """Converts an integer geocell code back to its geocell string."""
+  resolution = int(code & _INT_RESOLUTION_MASK)
+  if not resolution:
+    return ''
+  return '%0*x' % (resolution, _morton_int(code))
+
+
+def int_resolution(code):
+  """Returns the resolution of the given integer geocell code."""
+  return int(code & _INT_RESOLUTION_MASK)
+
+
+def compute_int(point, resolution=MAX_GEOCELL_RESOLUTION):
+  """Computes the integer code of the geocell containing the given point.
+
+  This is the integer counterpart of compute(); from_int() of the result is
+  the same string compute() returns.
+
+  Args:
+    point: The geotypes.Point to compute the cell for.
+    resolution: An int indicating the resolution of the cell to compute.
+
+  Returns:
+    The integer geocell code of the cell containing the given point.
+  """
+  return _pack_xy(_lon_to_x(point.lon, resolution),
+                  _lat_to_y(point.lat, resolution), resolution)
+
+
+def compute_box_int(code):
+  """Computes the bounding box of the given integer geocell code.
+
+  Args:
+    code: The integer geocell code whose boundaries are to be computed.
+
+  Returns:
+    A geotypes.FrozenBox corresponding to the rectangular boundaries of the
+    geocell.
+  """
+  if code is None:
+    return None
+
+  resolution = code & _INT_RESOLUTION_MASK
+  x, y = _unpack_xy(code)
+  lon_span = 360.0 / (1 << (2 * resolution))
+  lat_span = 180.0 / (1 << (2 * resolution))
+
+  return geotypes.FrozenBox.unchecked(-90.0 + lat_span * (y + 1),
+                                      -180.0 + lon_span * (x + 1),
+                                      -90.0 + lat_span * y,
+                                      -180.0 + lon_span * x)
+
+
+def parent_int(code):
+  """Returns the integer code of the given cell's immediate parent.
+
+  Returns None if the given code is the whole-world (resolution 0) cell.
+  """
+  resolution = code & _INT_RESOLUTION_MASK
+  if not resolution:
+    return None
+  return _pack_int(_morton_int(code) >> 4, resolution - 1)
+
+
+def children_int(code):
+  """Returns the integer codes of the given cell's 16 immediate children.
+
+  The children are returned in the same order as children() returns them.
+
+  Raises:
+    ValueError: If the given cell is already at MAX_INT_GEOCELL_RESOLUTION.
+  """
+  resolution = code & _INT_RESOLUTION_MASK
+  if resolution >= MAX_INT_GEOCELL_RESOLUTION:
+    raise ValueError('Cannot subdivide a cell at resolution %d' % resolution)
+  base = _morton_int(code) << 4
+  return [_pack_int(base | i, resolution + 1)
+          for i in range(len(_GEOCELL_ALPHABET))]
+
+
+def adjacent_int(code, dir):
+  """Calculates the integer code of the cell adjacent in the given direction.
+
+  This is the integer counterpart of adjacent().
+
+  Args:
+    code: The integer geocell code whose neighbor is being calculated.
+    dir: An (x, y) tuple indicating direction, as for adjacent().
+
+  Returns:
+    The adjacent integer geocell code, or None if there is no such cell.
+  """
+  if code is None:
+    return None
+
+  resolution = code & _INT_RESOLUTION_MASK
+  morton = _morton_int(code)
+
+  # Step the interleaved column and row directly using dilated-integer
+  # arithmetic; x_mask and y_mask select the column and row bits.
+  x_mask = _EVEN_BITS >> (64 - 4 * resolution)
+  y_mask = x_mask << 1
+  x_bits = morton & x_mask
+  y_bits = morton & y_mask
+
+  if dir[1] == 1:
+    if y_bits == y_mask:
+      return None
+    y_bits = ((y_bits | x_mask) + 1) & y_mask
+  elif dir[1] == -1:
+    if not y_bits:
+      return None
+    y_bits = (y_bits - 1) & y_mask
+
+  # Horizontal wrapping across the antimeridian is inherent, as in adjacent().
+  if dir[0] == 1:
+    x_bits = ((x_bits | y_mask) + 1) & x_mask
+  elif dir[0] == -1:
+    x_bits = (x_bits - 1) & x_mask
+
+  return _pack_int(x_bits | y_bits, resolution)
+
+
+def interpolate_int(code_ne, code_sw):
+  """Calculates the grid of cells formed between two given integer codes.
+
+  This is the integer counterpart of interpolate(), and returns the cells in
+  the same order: row by row from south to north, each row from west to east.
+
+  Arguments:
+    code_ne: The Northeast integer geocell code.
+    code_sw: The Southwest integer geocell code, of the same resolution.
+
+  Returns:
+    A list of integer geocell codes in the interpolation.
+  """
+  resolution = code_sw & _INT_RESOLUTION_MASK
+  size = 1 << (2 * resolution)
+  x_ne, y_ne = _unpack_xy(code_ne)
+  x_sw, y_sw = _unpack_xy(code_sw)
+
+  num_cols = (x_ne - x_sw) % size + 1
+  columns = [_spread_bits((x_sw + i) % size) for i in range(num_cols)]
+  shift = _INT_RESOLUTION_BITS + 4 * (MAX_INT_GEOCELL_RESOLUTION - resolution)
+
+  return [((column | (_spread_bits(y) << 1)) << shift) | resolution
+          for y in range(y_sw, y_ne + 1)
+          for column in columns]
+
+
+def _interpolation_count_int(code_ne, code_sw):
+  """Returns the number of cells interpolate_int() would return."""
+  size = 1 << (2 * int_resolution(code_sw))
+  x_ne, y_ne = _unpack_xy(code_ne)
+  x_sw, y_sw = _unpack_xy(code_sw)
+  return int(((x_ne - x_sw) % size + 1) * (y_ne - y_sw + 1))
+
+
+def _lon_to_x(lon, resolution):
+  """Returns the column of the cell containing lon at the given resolution."""
+  size = 1 << (2 * resolution)
+  return min(int((lon + 180.0) * size / 360.0), size - 1)
+
+
+def _lat_to_y(lat, resolution):
+  """Returns the row of the cell containing lat at the given resolution."""
+  size = 1 << (2 * resolution)
+  return min(int((lat + 90.0) * size / 180.0), size - 1)
+
+
+def _pack_int(morton, resolution):
+  """Packs a Morton code of the given resolution into an integer code."""
+  return ((morton << (_INT_RESOLUTION_BITS +
+                      4 * (MAX_INT_GEOCELL_RESOLUTION - resolution))) |
+          resolution)
+
+
+def _morton_int(code):
+  """Returns the Morton code stored in the given integer code."""
+  return code >> (_INT_RESOLUTION_BITS +
+                  4 * (MAX_INT_GEOCELL_RESOLUTION -
+                       (code & _INT_RESOLUTION_MASK)))
+
+
+def _pack_xy(x, y, resolution):
+  """Returns the integer code of the cell at column x, row y."""
+  return _pack_int(_spread_bits(x) | (_spread_bits(y) << 1), resolution)
+
+
+def _unpack_xy(code):
+  """Returns the (column, row) of the given integer code."""
+  morton = _morton_int(code)
+  return _compact_bits(morton), _compact_bits(morton >> 1)
+
+
+def _spread_bits(v):
+  """Spreads the low 32 bits of v out to the even bits of a 64-bit word."""
+  v &= 0x00000000FFFFFFFF
+  v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+  v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+  v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+  v = (v | (v << 2)) & 0x3333333333333333
+  v = (v | (v << 1)) & _EVEN_BITS
+  return v
+
+
+def _compact_bits(v):
+  """Gathers the even bits of a 64-bit word into its low 32 bits."""
+  v &= _EVEN_BITS
+  v = (v | (v >> 1)) & 0x3333333333333333
+  v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
+  v = (v | (v >> 4)) & 0x00FF00FF00FF00FF
+  v = (v | (v >> 8)) & 0x0000FFFF0000FFFF
+  v = (v | (v >> 16)) & 0x00000000FFFFFFFF
+  return v
+
+
+# Batch geocell computation. These require NumPy.
+
+# (shift, mask) steps of the bit spreading in _spread_bits(), and of the
+# gathering in _compact_bits() in reverse order.
+_SPREAD_STEPS = [(16, 0x0000FFFF0000FFFF),
+                 (8, 0x00FF00FF00FF00FF),
+                 (4, 0x0F0F0F0F0F0F0F0F),
+                 (2, 0x3333333333333333),
+                 (1, _EVEN_BITS)]
+_COMPACT_STEPS = [(16, 0x00000000FFFFFFFF),
+                  (8, 0x0000FFFF0000FFFF),
+                  (4, 0x00FF00FF00FF00FF),
+                  (2, 0x0F0F0F0F0F0F0F0F),
+                  (1, 0x3333333333333333)]
+
+
+def compute_many(lats, lons, resolution=MAX_GEOCELL_RESOLUTION,
+                 as_strings=False):
+  """Computes the geocells containing many points in one vectorized pass.
+
+  This is the batch counterpart of compute_int(), and agrees with it (and
+  therefore with compute()) for every point.
+
+  Args:
+    lats: A sequence or NumPy array of latitudes.
+    lons: A sequence or NumPy array of longitudes, of the same length.
+    resolution: An int indicating the resolution of the cells to compute, at
+        most MAX_INT_GEOCELL_RESOLUTION.
+    as_strings: If True, return geocell strings instead of integer codes.
+
+  Returns:
+    A NumPy uint64 array of integer geocell codes, or a list of geocell strings
+    if as_strings is True.
+
+  Raises:
+    ImportError: If NumPy is not available.
+    ValueError: If the resolution is out of range.
+  """
+  _require_numpy()
+  if resolution < 0 or resolution > MAX_INT_GEOCELL_RESOLUTION:
+    raise ValueError('Geocell resolution must be in [0, %d] but was %d' %
+                     (MAX_INT_GEOCELL_RESOLUTION, resolution))
+
+  lats = numpy.asarray(lats, dtype=numpy.float64)
+  lons = numpy.asarray(lons, dtype=numpy.float64)
+
+  size = 1 << (2 * resolution)
+  x = numpy.minimum((lons + 180.0) * size / 360.0, size - 1).astype(
+      numpy.uint64)
+  y = numpy.minimum((lats + 90.0) * size / 180.0, size - 1).astype(
+      numpy.uint64)
+
+  morton = _spread_bits_many(x) | (_spread_bits_many(y) << numpy.uint64(1))
+  if as_strings:
+    return ['%0*x' % (resolution, m) if resolution else ''
+            for m in morton.tolist()]
+
+  shift = numpy.uint64(_INT_RESOLUTION_BITS +
+                       4 * (MAX_INT_GEOCELL_RESOLUTION - resolution))
+  return (morton << shift) | numpy.uint64(resolution)
+
+
+def compute_box_many(codes):
+  """Computes the bounding boxes of many integer geocell codes at once.
+
+  Args:
+    codes: A sequence or NumPy array of integer geocell codes, possibly of
+        mixed resolutions.
+
+  Returns:
+    A (north, east, south, west) tuple of NumPy float64 arrays.
+
+  Raises:
+    ImportError: If NumPy is not available.
+  """
+  _require_numpy()
+  codes = numpy.asarray(codes, dtype=numpy.uint64)
+
+  resolution = codes & numpy.uint64(_INT_RESOLUTION_MASK)
+  shift = (numpy.uint64(_INT_RESOLUTION_BITS +
+                        4 * MAX_INT_GEOCELL_RESOLUTION) -
+           numpy.uint64(4) * resolution)
+  morton = codes >> shift
+  x = _compact_bits_many(morton).astype(numpy.float64)
+  y = _compact_bits_many(morton >> numpy.uint64(1)).astype(numpy.float64)
+
+  size = numpy.ldexp(1.0, (2 * resolution).astype(numpy.int32))
+  lon_span = 360.0 / size
+  lat_span = 180.0 / size
+
+  return (-90.0 + lat_span * (y + 1),
+          -180.0 + lon_span * (x + 1),
+          -90.0 + lat_span * y,
+          -180.0 + lon_span * x)
+
+
+def _require_numpy():
+  """Raises ImportError if NumPy is not available."""
+  if numpy is None:
+    raise ImportError('NumPy is required for batch geocell computation')
+
+
+def _spread_bits_many(v):
+  """Vectorized _spread_bits() over a NumPy uint64 array."""
+  v = v & numpy.uint64(0x00000000FFFFFFFF)
+  for shift, mask in _SPREAD_STEPS:
+    v = (v | (v << numpy.uint64(shift))) & numpy.uint64(mask)
+  return v
+
+
+def _compact_bits_many(v):
+  """Vectorized _compact_bits() over a NumPy uint64 array."""
+  v = v & numpy.uint64(_EVEN_BITS)
+  for shift, mask in reversed(_COMPACT_STEPS):
+    v = (v | (v >> numpy.uint64(shift))) & numpy.uint64(mask)
+  return v
@@ -92,6 +92,180 @@ class GeocellTests(unittest.TestCase):
     self.assertEquals(9, len(geocell.interpolate(cell, sw_adjacent2)))
     self.assertEquals(9, geocell.interpolation_count(cell, sw_adjacent2))
 
+  def test_point_distance(self):
+    cell = geocell.compute(geotypes.Point(37, -122), 8)
+    box = geocell.compute_box(cell)
+
+    # points on the box's edges and corners
+    self.assertAlmostEquals(0, geocell.point_distance(
+        cell, geotypes.Point(box.north, -122)), 3)
+    self.assertAlmostEquals(0, geocell.point_distance(
+        cell, geotypes.Point(box.south, box.west)), 3)
+
+    # a point north of the cell, and a point to its north-east
+    self.assertAlmostEquals(111319, geocell.point_distance(
+        cell, geotypes.Point(box.north + 1, -122)), -2)
+    self.assertTrue(geocell.point_distance(
+        cell, geotypes.Point(box.north + 1, box.east + 1)) > 111319)
+
+  def test_best_bbox_cover(self):
+    bbox = geotypes.Box(37.1, -121.8, 36.9, -122.2)
+    cover = geocell.best_bbox_cover(bbox)
+    self.assertTrue(len(cover) <= geocell.MAX_BBOX_COVER_CELLS)
+    self.assertEquals(sorted(cover), cover)
+
+    # mixed resolutions, no cell contains another
+    self.assertTrue(len(set([len(cell) for cell in cover])) > 1)
+    for cell in cover:
+      for other_cell in cover:
+        self.assertTrue(cell == other_cell or not other_cell.startswith(cell))
+
+    # every point in the box is in exactly one cell of the cover
+    for lat in [36.9, 36.95, 37.0, 37.05, 37.1]:
+      for lon in [-122.2, -122.1, -122.0, -121.9, -121.8]:
+        point_cell = geocell.compute(geotypes.Point(lat, lon))
+        self.assertEquals(1, len([cell for cell in cover
+                                  if point_cell.startswith(cell)]))
+
+    # a tighter budget still covers the box
+    cover = geocell.best_bbox_cover(bbox, max_cells=4)
+    self.assertTrue(len(cover) <= 4)
+    for lat in [36.9, 37.1]:
+      for lon in [-122.2, -121.8]:
+        point_cell = geocell.compute(geotypes.Point(lat, lon))
+        self.assertTrue([cell for cell in cover
+                         if point_cell.startswith(cell)])
+
+  def test_region_covers(self):
+    center = geotypes.Point(37, -122)
+    circle_cover = geocell.circle_cover(center, 5000)
+    self.assertTrue(len(circle_cover) <= geocell.MAX_BBOX_COVER_CELLS)
+
+    bbox_cover = geocell.best_bbox_cover(
+        geotypes.Circle(center, 5000).bounding_box())
+    self.assertTrue(
+        sum([geocell._box_area(geocell.compute_box(cell))
+             for cell in circle_cover]) <=
+        sum([geocell._box_area(geocell.compute_box(cell))
+             for cell in bbox_cover]))
+
+    vertices = [geotypes.Point(37, -122), geotypes.Point(37.1, -122),
+                geotypes.Point(37, -121.9)]
+    polygon_cover = geocell.polygon_cover(vertices)
+    self.assertTrue(len(polygon_cover) <= geocell.MAX_BBOX_COVER_CELLS)
+
+    for cover, points in [
+        (circle_cover, [center, geotypes.Point(37.04, -122),
+                        geotypes.Point(37, -121.95)]),
+        (polygon_cover, vertices + [geotypes.Point(37.03, -121.97)])]:
+      for point in points:
+        point_cell = geocell.compute(point)
+        self.assertEquals(1, len([cell for cell in cover
+                                  if point_cell.startswith(cell)]))
+
+  def test_caches(self):
+    geocell.clear_caches()
+    cell = geocell.compute(geotypes.Point(37, -122), 13)
+
+    box = geocell.compute_box(cell)
+    self.assertTrue(box is geocell.compute_box(cell))
+    self.assertEquals(geocell.compute_box.uncached(cell), box)
+
+    adjacents = geocell.all_adjacents(cell)
+    adjacents.append('mutated')
+    self.assertEquals(8, len(geocell.all_adjacents(cell)))
+    self.assertEquals(geocell.adjacent(cell, [1, 0]),
+                      geocell.adjacent(cell, geocell.EAST))
+
+    stats = geocell.cache_stats()
+    self.assertEquals(1, stats['compute_box']['hits'])
+    self.assertEquals(1, stats['all_adjacents']['hits'])
+    self.assertTrue(stats['adjacent']['hits'] >= 1)
+
+    geocell.clear_caches()
+    self.assertEquals(0, geocell.cache_stats()['compute_box']['size'])
+
+  def test_int_conversion(self):
+    cell = geocell.compute(geotypes.Point(37, -122), 14)
+    code = geocell.to_int(cell)
+    self.assertEquals(14, geocell.int_resolution(code))
+    self.assertEquals(cell, geocell.from_int(code))
+    self.assertEquals('', geocell.from_int(geocell.to_int('')))
+
+    # integer codes sort like their geocell strings
+    cells = ['0', '00', '0f', '1', 'a', 'a0', 'af', 'f', 'ff']
+    self.assertEquals(cells, sorted(cells, key=geocell.to_int))
+
+    self.assertRaises(ValueError, geocell.to_int, 'x')
+    self.assertRaises(ValueError, geocell.to_int, '0' * 16)
+
+  def test_compute_int(self):
+    for point in [geotypes.Point(37, -122), geotypes.Point(0, 0),
+                  geotypes.Point(-90, -180), geotypes.Point(90, 180),
+                  geotypes.Point(-33.8675, 151.207)]:
+      for resolution in [1, 8, 13, 15]:
+        cell = geocell.compute(point, resolution)
+        code = geocell.compute_int(point, resolution)
+        self.assertEquals(cell, geocell.from_int(code))
+        self.assertEquals(geocell.compute_box(cell),
+                          geocell.compute_box_int(code))
+
+  def test_hierarchy_int(self):
+    code = geocell.to_int('78a')
+    self.assertEquals('78', geocell.from_int(geocell.parent_int(code)))
+    self.assertEquals(None, geocell.parent_int(geocell.to_int('')))
+    self.assertEquals(geocell.children('78a'),
+                      [geocell.from_int(c) for c in geocell.children_int(code)])
+
+  def test_adjacent_int(self):
+    cell = geocell.compute(geotypes.Point(37, -122), 14)
+    code = geocell.to_int(cell)
+    for dir in [geocell.NORTHWEST, geocell.NORTH, geocell.NORTHEAST,
+                geocell.EAST, geocell.SOUTHEAST, geocell.SOUTH,
+                geocell.SOUTHWEST, geocell.WEST]:
+      self.assertEquals(geocell.adjacent(cell, dir),
+                        geocell.from_int(geocell.adjacent_int(code, dir)))
+
+    # no wrapping across the poles, but wrapping across the antimeridian
+    self.assertEquals(None, geocell.adjacent_int(geocell.to_int('f'), (0, 1)))
+    self.assertEquals(geocell.adjacent('f', (1, 0)),
+                      geocell.from_int(geocell.adjacent_int(
+                          geocell.to_int('f'), (1, 0))))
+
+  def test_interpolation_int(self):
+    cell = geocell.compute(geotypes.Point(37, -122), 14)
+    sw_adjacent2 = geocell.adjacent(geocell.adjacent(cell, (-1, -1)), (-1, -1))
+    self.assertEquals(
+        geocell.interpolate(cell, sw_adjacent2),
+        [geocell.from_int(c) for c in geocell.interpolate_int(
+            geocell.to_int(cell), geocell.to_int(sw_adjacent2))])
+
+  def test_compute_many(self):
+    if geocell.numpy is None:
+      return
+
+    points = [geotypes.Point(37, -122), geotypes.Point(0, 0),
+              geotypes.Point(-90, -180), geotypes.Point(90, 180),
+              geotypes.Point(-33.8675, 151.207)]
+    lats = [p.lat for p in points]
+    lons = [p.lon for p in points]
+
+    for resolution in [0, 1, 8, 13, 15]:
+      codes = geocell.compute_many(lats, lons, resolution)
+      self.assertEquals([geocell.compute_int(p, resolution) for p in points],
+                        codes.tolist())
+      self.assertEquals([geocell.compute(p, resolution) for p in points],
+                        geocell.compute_many(lats, lons, resolution,
+                                             as_strings=True))
+
+      north, east, south, west = geocell.compute_box_many(codes)
+      for i, code in enumerate(codes.tolist()):
+        box = geocell.compute_box_int(code)
+        self.assertEquals((box.north, box.east, box.south, box.west),
+                          (north[i], east[i], south[i], west[i]))
+
+    self.assertRaises(ValueError, geocell.compute_many, lats, lons, 16)
+
 
 if __name__ == '__main__':
   unittest.main()
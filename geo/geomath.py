@@ -20,10 +20,19 @@ __author__ = 'api.roman.public@gmail.com (Roman Nurik)'
 
 import math
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
 import geotypes
 
 RADIUS = 6378135
 
+# Distance formulations accepted by the batch distance functions.
+HAVERSINE = 'haversine'
+EQUIRECTANGULAR = 'equirectangular'
+
 
 def distance(p1, p2):
   """Calculates the great circle distance between two points (law of cosines).
@@ -39,3 +48,158 @@ def distance(p1, p2):
   p2lat, p2lon = math.radians(p2.lat), math.radians(p2.lon)
   return RADIUS * math.acos(math.sin(p1lat) * math.sin(p2lat) +
       math.cos(p1lat) * math.cos(p2lat) * math.cos(p2lon - p1lon))
+
+
+def haversine(p1, p2):
+  """Calculates the great circle distance between two points (haversine).
+
+  Unlike distance(), this stays accurate for points that are very close
+  together, where the law of cosines loses precision to acos rounding.
+
+  Args:
+    p1: A geotypes.Point or db.GeoPt indicating the first point.
+    p2: A geotypes.Point or db.GeoPt indicating the second point.
+
+  Returns:
+    The 2D great-circle distance between the two given points, in meters.
+  """
+  p1lat, p2lat = math.radians(p1.lat), math.radians(p2.lat)
+  sin_dlat = math.sin((p2lat - p1lat) / 2)
+  sin_dlon = math.sin(math.radians(p2.lon - p1.lon) / 2)
+  a = sin_dlat * sin_dlat + (math.cos(p1lat) * math.cos(p2lat) *
+                             sin_dlon * sin_dlon)
+  return 2 * RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def equirectangular(p1, p2):
+  """Approximates the distance between two points on a flat projection.
+
+  Projects both points onto a plane tangent at their mean latitude. This is
+  much cheaper than the great circle formulations, and for separations of up
+  to 50km below 70 degrees of latitude its relative error is under 0.01%, which
+  is good enough for ranking at city scale. Do not use it across the
+  antimeridian or for long distances.
+
+  Args:
+    p1: A geotypes.Point or db.GeoPt indicating the first point.
+    p2: A geotypes.Point or db.GeoPt indicating the second point.
+
+  Returns:
+    The approximate distance between the two given points, in meters.
+  """
+  x = math.radians(p2.lon - p1.lon) * math.cos(
+      math.radians((p1.lat + p2.lat) / 2.0))
+  y = math.radians(p2.lat - p1.lat)
+  return RADIUS * math.sqrt(x * x + y * y)
+
+
+def distances(center, points, method=HAVERSINE):
+  """Calculates the distances from a center point to each of many points.
+
+  Uses a single vectorized call to distance_array() when NumPy is available,
+  and falls back to per-point scalar calls otherwise.
+
+  Args:
+    center: A geotypes.Point or db.GeoPt indicating the center point.
+    points: A list of geotypes.Point or db.GeoPt objects, or a
+        geotypes.PointArray.
+    method: HAVERSINE or EQUIRECTANGULAR.
+
+  Returns:
+    A list of distances in meters, in the same order as points.
+  """
+  if not points:
+    return []
+
+  if numpy is None:
+    distance_fn = _SCALAR_METHODS[method]
+    return [distance_fn(center, point) for point in points]
+
+  if isinstance(points, geotypes.PointArray):
+    lats, lons = points.as_numpy()
+    return distance_array(center, lats, lons, method=method).tolist()
+
+  return distance_array(center,
+                        [point.lat for point in points],
+                        [point.lon for point in points],
+                        method=method).tolist()
+
+
+def distance_array(center, lats, lons, method=HAVERSINE):
+  """Calculates the distances from a center point to arrays of coordinates.
+
+  Args:
+    center: A geotypes.Point or db.GeoPt indicating the center point.
+    lats: A sequence or NumPy array of latitudes.
+    lons: A sequence or NumPy array of longitudes, of the same length.
+    method: HAVERSINE or EQUIRECTANGULAR.
+
+  Returns:
+    A NumPy float64 array of distances, in meters.
+
+  Raises:
+    ImportError: If NumPy is not available.
+  """
+  _require_numpy()
+  return _distance_kernel(center.lat, center.lon,
+                          numpy.asarray(lats, dtype=numpy.float64),
+                          numpy.asarray(lons, dtype=numpy.float64),
+                          method)
+
+
+def distance_matrix(lats1, lons1, lats2, lons2, method=HAVERSINE):
+  """Calculates the distances between every pair of points in two sets.
+
+  Args:
+    lats1: A sequence or NumPy array of latitudes of the first set of points.
+    lons1: The longitudes of the first set of points.
+    lats2: A sequence or NumPy array of latitudes of the second set of points.
+    lons2: The longitudes of the second set of points.
+    method: HAVERSINE or EQUIRECTANGULAR.
+
+  Returns:
+    A NumPy float64 array of shape (len(lats1), len(lats2)), in meters, whose
+    [i, j] element is the distance between point i of the first set and point
+    j of the second.
+
+  Raises:
+    ImportError: If NumPy is not available.
+  """
+  _require_numpy()
+  return _distance_kernel(
+      numpy.asarray(lats1, dtype=numpy.float64)[:, numpy.newaxis],
+      numpy.asarray(lons1, dtype=numpy.float64)[:, numpy.newaxis],
+      numpy.asarray(lats2, dtype=numpy.float64)[numpy.newaxis, :],
+      numpy.asarray(lons2, dtype=numpy.float64)[numpy.newaxis, :],
+      method)
+
+
+def _distance_kernel(lat1, lon1, lat2, lon2, method):
+  """Broadcasting distance computation over NumPy arrays of degrees."""
+  if method == HAVERSINE:
+    lat1 = numpy.radians(lat1)
+    lat2 = numpy.radians(lat2)
+    sin_dlat = numpy.sin((lat2 - lat1) / 2)
+    sin_dlon = numpy.sin(numpy.radians(lon2 - lon1) / 2)
+    a = sin_dlat * sin_dlat + (numpy.cos(lat1) * numpy.cos(lat2) *
+                               sin_dlon * sin_dlon)
+    return 2 * RADIUS * numpy.arcsin(numpy.minimum(1.0, numpy.sqrt(a)))
+  elif method == EQUIRECTANGULAR:
+    x = numpy.radians(lon2 - lon1) * numpy.cos(
+        numpy.radians((lat1 + lat2) / 2.0))
+    y = numpy.radians(lat2 - lat1)
+    return RADIUS * numpy.sqrt(x * x + y * y)
+  else:
+    raise ValueError('Unknown distance method: %r' % (method,))
+
+
+def _require_numpy():
+  """Raises ImportError if NumPy is not available."""
+  if numpy is None:
+    raise ImportError('NumPy is required for batch distance computation')
+
+
+_SCALAR_METHODS = {
+  HAVERSINE: haversine,
+  EQUIRECTANGULAR: equirectangular,
+}
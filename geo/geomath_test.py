@@ -34,6 +34,58 @@ class GeomathTests(unittest.TestCase):
     # make sure the calculated distance is within +/- 1% of known distance
     self.assertTrue(abs((calc_dist - known_dist) / known_dist) <= 0.01)
 
+  def test_haversine(self):
+    calc_dist = geomath.haversine(geotypes.Point(37, -122),
+                                  geotypes.Point(42, -75))
+    known_dist = 4024365
+    self.assertTrue(abs((calc_dist - known_dist) / known_dist) <= 0.01)
+
+    # stays accurate where the law of cosines degrades
+    self.assertEquals(0, geomath.haversine(geotypes.Point(37, -122),
+                                           geotypes.Point(37, -122)))
+    calc_dist = geomath.haversine(geotypes.Point(37, -122),
+                                  geotypes.Point(37.00001, -122))
+    self.assertTrue(abs(calc_dist - 1.1132) < 0.001)
+
+  def test_equirectangular(self):
+    p1 = geotypes.Point(37.77, -122.42)
+    p2 = geotypes.Point(37.87, -122.27)
+    exact = geomath.haversine(p1, p2)
+    self.assertTrue(abs(geomath.equirectangular(p1, p2) - exact) / exact
+                    <= 0.0001)
+
+  def test_distances(self):
+    center = geotypes.Point(37, -122)
+    points = [geotypes.Point(37, -122), geotypes.Point(42, -75),
+              geotypes.Point(37.1, -122.1)]
+    self.assertEquals([], geomath.distances(center, []))
+
+    for method, distance_fn in [(geomath.HAVERSINE, geomath.haversine),
+                                (geomath.EQUIRECTANGULAR,
+                                 geomath.equirectangular)]:
+      calc_dists = geomath.distances(center, points, method=method)
+      self.assertEquals(len(points), len(calc_dists))
+      for point, calc_dist in zip(points, calc_dists):
+        self.assertAlmostEquals(distance_fn(center, point), calc_dist, 3)
+
+  def test_distance_matrix(self):
+    if geomath.numpy is None:
+      return
+
+    points = [geotypes.Point(37, -122), geotypes.Point(42, -75),
+              geotypes.Point(37.1, -122.1)]
+    lats = [p.lat for p in points]
+    lons = [p.lon for p in points]
+    matrix = geomath.distance_matrix(lats[:2], lons[:2], lats, lons)
+    self.assertEquals((2, 3), matrix.shape)
+    for i in range(2):
+      for j in range(3):
+        self.assertAlmostEquals(geomath.haversine(points[i], points[j]),
+                                matrix[i, j], 3)
+
+    self.assertRaises(ValueError, geomath.distance_array, points[0],
+                      lats, lons, 'manhattan')
+
 
 if __name__ == '__main__':
   unittest.main()
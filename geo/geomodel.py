@@ -17,24 +17,30 @@
 """Defines the GeoModel class for running basic geospatial queries on
 single-point geographic entities in Google App Engine.
 
+The queries themselves are run by geoquery on a storage.DatastoreBackend.
+
 TODO(romannurik): document how bounding box and proximity queries work.
 """
 
 __author__ = 'api.roman.public@gmail.com (Roman Nurik)'
 
-import copy
-import logging
-import math
-import sys
-
 from google.appengine.ext import db
 
 import geocell
-import geomath
-import geotypes
-import util
+import geoquery
+import storage
+
+# The maximum number of values in a single datastore IN filter.
+MAX_QUERY_CELLS = storage.DatastoreBackend.max_query_cells
+
+# The maximum number of entities fetched by a single query.
+MAX_FETCH_RESULTS = storage.DatastoreBackend.max_fetch_results
 
-DEBUG = False
+
+def _geocell_prefixes(max_res_geocell):
+  """Returns the list of all non-empty prefixes of the given geocell."""
+  return [max_res_geocell[:res]
+          for res in range(1, geocell.MAX_GEOCELL_RESOLUTION + 1)]
 
 
 def default_cost_function(num_cells, resolution):
@@ -59,21 +65,53 @@ class GeoModel(db.Model):
     entity's location property. A put() must occur after this call to save
     the changes to App Engine."""
     if self.location:
-      max_res_geocell = geocell.compute(self.location)
-      self.location_geocells = [max_res_geocell[:res]
-                                for res in
-                                range(1, geocell.MAX_GEOCELL_RESOLUTION + 1)]
+      self.location_geocells = _geocell_prefixes(
+          geocell.from_int(geocell.compute_int(self.location)))
     else:
       self.location_geocells = []
 
+  @staticmethod
+  def update_locations(entities):
+    """Syncs underlying geocell properties for a batch of entities.
+
+    Equivalent to calling update_location() on each entity, but computes the
+    geocells of all located entities in a single vectorized pass when NumPy is
+    available. Use this for bulk ingestion and re-indexing. A put() must occur
+    after this call to save the changes to App Engine.
+
+    Args:
+      entities: A list of GeoModel entities to update.
+    """
+    located = []
+    for entity in entities:
+      if entity.location:
+        located.append(entity)
+      else:
+        entity.location_geocells = []
+
+    if not located:
+      return
+
+    if geocell.numpy is None:
+      for entity in located:
+        entity.update_location()
+      return
+
+    cells = geocell.compute_many([entity.location.lat for entity in located],
+                                 [entity.location.lon for entity in located],
+                                 as_strings=True)
+    for entity, max_res_geocell in zip(located, cells):
+      entity.location_geocells = _geocell_prefixes(max_res_geocell)
+
   @staticmethod
   def bounding_box_fetch(query, bbox, max_results=1000,
-                         cost_function=None):
+                         cost_function=None,
+                         max_cells=geocell.MAX_BBOX_COVER_CELLS):
     """Performs a bounding box fetch on the given query.
 
     Fetches entities matching the given query with an additional filter
     matching only those entities that are inside of the given rectangular
-    bounding box.
+    bounding box. See geoquery.bounding_box_fetch().
 
     Args:
       query: A db.Query on entities of this kind that should be additionally
@@ -85,7 +123,11 @@ class GeoModel(db.Model):
           * num_cells: the number of cells to search
           * resolution: the resolution of each cell to search
           and returns the 'cost' of querying against this number of cells
-          at the given resolution.
+          at the given resolution. If given, the box is searched with a set of
+          same-resolution cells chosen by this function instead of a
+          mixed-resolution cover.
+      max_cells: An optional int indicating the maximum number of geocells to
+          search when no cost_function is given; at most MAX_QUERY_CELLS.
 
     Returns:
       The fetched entities.
@@ -93,27 +135,38 @@ class GeoModel(db.Model):
     Raises:
       Any exceptions that google.appengine.ext.db.Query.fetch() can raise.
     """
-    # TODO(romannurik): Check for GqlQuery.
-    results = []
+    return geoquery.bounding_box_fetch(
+        storage.DatastoreBackend(query), bbox, max_results=max_results,
+        cost_function=cost_function, max_cells=max_cells)
 
-    if cost_function is None:
-      cost_function = default_cost_function
-    query_geocells = geocell.best_bbox_search_cells(bbox, cost_function)
+  @staticmethod
+  def region_fetch(query, region, max_results=1000,
+                   max_cells=geocell.MAX_BBOX_COVER_CELLS):
+    """Performs a region fetch on the given query.
 
-    if query_geocells:
-      for entity in query.filter('location_geocells IN', query_geocells):
-        if len(results) == max_results:
-          break
-        if (entity.location.lat >= bbox.south and
-            entity.location.lat <= bbox.north and
-            entity.location.lon >= bbox.west and
-            entity.location.lon <= bbox.east):
-          results.append(entity)
+    Fetches entities matching the given query that are inside the given
+    region, such as a radius around a point or a user-drawn polygon. See
+    geoquery.region_fetch().
 
-    if DEBUG:
-      logging.info('bbox query looked in %d geocells' % len(query_geocells))
+    Args:
+      query: A db.Query on entities of this kind that should be additionally
+          filtered by region and subsequently fetched.
+      region: A geotypes.Box, geotypes.Circle or geotypes.Polygon indicating
+          the region to filter entities by.
+      max_results: An optional int indicating the maximum number of desired
+          results.
+      max_cells: An optional int indicating the maximum number of geocells to
+          search; at most MAX_QUERY_CELLS.
 
-    return results
+    Returns:
+      The fetched entities, in the query's order.
+
+    Raises:
+      Any exceptions that google.appengine.ext.db.Query.fetch() can raise.
+    """
+    return geoquery.region_fetch(
+        storage.DatastoreBackend(query), region, max_results=max_results,
+        max_cells=max_cells)
 
   @staticmethod
   def proximity_fetch(query, center, max_results=10, max_distance=0):
@@ -121,12 +174,7 @@ class GeoModel(db.Model):
 
     Fetches at most <max_results> entities matching the given query,
     ordered by ascending distance from the given center point, and optionally
-    limited by the given maximum distance.
-
-    This method uses a greedy algorithm that starts by searching high-resolution
-    geocells near the center point and gradually looking in lower and lower
-    resolution cells until max_results entities have been found matching the
-    given query and no closer possible entities can be found.
+    limited by the given maximum distance. See geoquery.proximity_fetch().
 
     Args:
       query: A db.Query on entities of this kind.
@@ -145,137 +193,6 @@ class GeoModel(db.Model):
     Raises:
       Any exceptions that google.appengine.ext.db.Query.fetch() can raise.
     """
-    # TODO(romannurik): check for GqlQuery
-    results = []
-
-    searched_cells = set()
-
-    # The current search geocell containing the lat,lon.
-    cur_containing_geocell = geocell.compute(center)
-
-    # The currently-being-searched geocells.
-    # NOTES:
-    #     * Start with max possible.
-    #     * Must always be of the same resolution.
-    #     * Must always form a rectangular region.
-    #     * One of these must be equal to the cur_containing_geocell.
-    cur_geocells = [cur_containing_geocell]
-
-    closest_possible_next_result_dist = 0
-
-    # Assumes both a and b are lists of (entity, dist) tuples, *sorted by dist*.
-    # NOTE: This is an in-place merge, and there are guaranteed
-    # no duplicates in the resulting list.
-    def _merge_results_in_place(a, b):
-      util.merge_in_place(a, b,
-                        cmp_fn=lambda x, y: cmp(x[1], y[1]),
-                        dup_fn=lambda x, y: x[0].key() == y[0].key())
-
-    sorted_edges = [(0,0)]
-    sorted_edge_distances = [0]
-
-    while cur_geocells:
-      closest_possible_next_result_dist = sorted_edge_distances[0]
-      if max_distance and closest_possible_next_result_dist > max_distance:
-        break
-
-      cur_geocells_unique = list(set(cur_geocells).difference(searched_cells))
-
-      # Run query on the next set of geocells.
-      cur_resolution = len(cur_geocells[0])
-      temp_query = copy.deepcopy(query)  # TODO(romannurik): is this safe?
-      temp_query.filter('location_geocells IN', cur_geocells_unique)
-
-      # Update results and sort.
-      new_results = temp_query.fetch(1000)
-      if DEBUG:
-        logging.info('fetch complete for %s' % (','.join(cur_geocells_unique),))
-
-      searched_cells.update(cur_geocells)
-
-      # Begin storing distance from the search result entity to the
-      # search center along with the search result itself, in a tuple.
-      new_results = [(entity, geomath.distance(center, entity.location))
-                     for entity in new_results]
-      new_results = sorted(new_results, lambda dr1, dr2: cmp(dr1[1], dr2[1]))
-      new_results = new_results[:max_results]
-
-      # Merge new_results into results or the other way around, depending on
-      # which is larger.
-      if len(results) > len(new_results):
-        _merge_results_in_place(results, new_results)
-      else:
-        _merge_results_in_place(new_results, results)
-        results = new_results
-
-      results = results[:max_results]
-
-      sorted_edges, sorted_edge_distances = \
-          util.distance_sorted_edges(cur_geocells, center)
-
-      if len(results) == 0 or len(cur_geocells) == 4:
-        # Either no results (in which case we optimize by not looking at
-        # adjacents, go straight to the parent) or we've searched 4 adjacent
-        # geocells, in which case we should now search the parents of those
-        # geocells.
-        cur_containing_geocell = cur_containing_geocell[:-1]
-        cur_geocells = list(set([cell[:-1] for cell in cur_geocells]))
-        if not cur_geocells or not cur_geocells[0]:
-          break  # Done with search, we've searched everywhere.
-
-      elif len(cur_geocells) == 1:
-        # Get adjacent in one direction.
-        # TODO(romannurik): Watch for +/- 90 degree latitude edge case geocells.
-        nearest_edge = sorted_edges[0]
-        cur_geocells.append(geocell.adjacent(cur_geocells[0], nearest_edge))
-
-      elif len(cur_geocells) == 2:
-        # Get adjacents in perpendicular direction.
-        nearest_edge = util.distance_sorted_edges([cur_containing_geocell],
-                                                   center)[0][0]
-        if nearest_edge[0] == 0:
-          # Was vertical, perpendicular is horizontal.
-          perpendicular_nearest_edge = [x for x in sorted_edges if x[0] != 0][0]
-        else:
-          # Was horizontal, perpendicular is vertical.
-          perpendicular_nearest_edge = [x for x in sorted_edges if x[0] == 0][0]
-
-        cur_geocells.extend(
-            [geocell.adjacent(cell, perpendicular_nearest_edge)
-             for cell in cur_geocells])
-
-      # We don't have enough items yet, keep searching.
-      if len(results) < max_results:
-        if DEBUG:
-          logging.debug('have %d results but want %d results, '
-                        'continuing search' % (len(results), max_results))
-        continue
-
-      if DEBUG:
-        logging.debug('have %d results' % (len(results),))
-
-      # If the currently max_results'th closest item is closer than any
-      # of the next test geocells, we're done searching.
-      current_farthest_returnable_result_dist = \
-          geomath.distance(center, results[max_results - 1][0].location)
-      if (closest_possible_next_result_dist >=
-          current_farthest_returnable_result_dist):
-        if DEBUG:
-          logging.debug('DONE next result at least %f away, '
-                        'current farthest is %f dist' %
-                        (closest_possible_next_result_dist,
-                         current_farthest_returnable_result_dist))
-        break
-
-      if DEBUG:
-        logging.debug('next result at least %f away, '
-                      'current farthest is %f dist' %
-                      (closest_possible_next_result_dist,
-                       current_farthest_returnable_result_dist))
-
-    if DEBUG:
-      logging.info('proximity query looked '
-                   'in %d geocells' % len(searched_cells))
-
-    return [entity for (entity, dist) in results[:max_results]
-            if not max_distance or dist < max_distance]
+    return geoquery.proximity_fetch(
+        storage.DatastoreBackend(query), center, max_results=max_results,
+        max_distance=max_distance)
@@ -0,0 +1,342 @@
+#!/usr/bin/python2.5
+
+"""Runs bounding box, region and proximity queries against a storage backend.
+
+These are the query engines behind GeoModel's fetch methods. They only talk to
+a storage.Backend, so they run equally on the App Engine datastore and on the
+in-memory and SQLite backends.
+"""
+
+import heapq
+import logging
+
+import geocell
+import geomath
+import geotypes
+import util
+
+DEBUG = False
+
+# The maximum number of geocells a proximity search looks in per round.
+MAX_PROXIMITY_ROUND_CELLS = 16
+
+
+def _max_cells(backend, max_cells):
+  if backend.max_query_cells is None:
+    return max_cells
+  return min(max_cells, backend.max_query_cells)
+
+
+def bounding_box_fetch(backend, bbox, max_results=1000, cost_function=None,
+                       max_cells=geocell.MAX_BBOX_COVER_CELLS):
+  """Fetches the entities of a backend that are inside a bounding box.
+
+  Args:
+    backend: The storage.Backend to query.
+    bbox: A geotypes.Box indicating the bounding box to filter entities by.
+    max_results: An optional int indicating the maximum number of desired
+        results.
+    cost_function: An optional function that accepts two arguments:
+        * num_cells: the number of cells to search
+        * resolution: the resolution of each cell to search
+        and returns the 'cost' of querying against this number of cells
+        at the given resolution. If given, the box is searched with a set of
+        same-resolution cells chosen by this function instead of a
+        mixed-resolution cover.
+    max_cells: An optional int indicating the maximum number of geocells to
+        search when no cost_function is given; at most the backend's
+        max_query_cells.
+
+  Returns:
+    The fetched entities.
+
+  Raises:
+    Any exceptions that the backend's query() can raise.
+  """
+  results = []
+
+  if cost_function is None:
+    query_geocells = geocell.best_bbox_cover(
+        bbox, max_cells=_max_cells(backend, max_cells))
+  else:
+    query_geocells = geocell.best_bbox_search_cells(bbox, cost_function)
+
+  if query_geocells:
+    for entity in backend.query(query_geocells):
+      if len(results) == max_results:
+        break
+      if (entity.location.lat >= bbox.south and
+          entity.location.lat <= bbox.north and
+          entity.location.lon >= bbox.west and
+          entity.location.lon <= bbox.east):
+        results.append(entity)
+
+  if DEBUG:
+    logging.info('bbox query looked in %d geocells' % len(query_geocells))
+
+  return results
+
+
+def region_fetch(backend, region, max_results=1000,
+                 max_cells=geocell.MAX_BBOX_COVER_CELLS):
+  """Fetches the entities of a backend that are inside a region.
+
+  Runs a single query against a mixed-resolution geocell cover of the region,
+  followed by an exact geometric filter.
+
+  Args:
+    backend: The storage.Backend to query.
+    region: A geotypes.Box, geotypes.Circle or geotypes.Polygon indicating
+        the region to filter entities by.
+    max_results: An optional int indicating the maximum number of desired
+        results.
+    max_cells: An optional int indicating the maximum number of geocells to
+        search; at most the backend's max_query_cells.
+
+  Returns:
+    The fetched entities, in the backend's order.
+
+  Raises:
+    Any exceptions that the backend's query() can raise.
+  """
+  results = []
+
+  query_geocells = geocell.region_cover(
+      region, max_cells=_max_cells(backend, max_cells))
+
+  if query_geocells:
+    for entity in backend.query(query_geocells):
+      if len(results) == max_results:
+        break
+      if region.contains(entity.location):
+        results.append(entity)
+
+  if DEBUG:
+    logging.info('region query looked in %d geocells' % len(query_geocells))
+
+  return results
+
+
+def proximity_fetch(backend, center, max_results=10, max_distance=0):
+  """Fetches the entities of a backend closest to a center point.
+
+  Fetches at most <max_results> entities, ordered by ascending distance from
+  the given center point, and optionally limited by the given maximum
+  distance.
+
+  This runs a best-first search over geocells. Candidate cells are kept in a
+  priority queue ordered by their shortest distance to the center point, and
+  each round queries the closest few not-yet-searched cells at once and queues
+  their neighbors. The search stops as soon as max_results entities have been
+  found and the closest unsearched cell is farther away than the
+  max_results'th closest entity. When the cells at the current resolution are
+  too small for the distances involved, the search frontier is coarsened to
+  the parent resolution; already searched cells are never queried again.
+
+  Args:
+    backend: The storage.Backend to query.
+    center: A geotypes.Point or db.GeoPt indicating the center point around
+        which to search for matching entities.
+    max_results: An int indicating the maximum number of desired results.
+        The default is 10, and the larger this number, the longer the fetch
+        will take.
+    max_distance: An optional number indicating the maximum distance to
+        search, in meters.
+
+  Returns:
+    The fetched entities, sorted in ascending order by distance to the search
+    center.
+
+  Raises:
+    Any exceptions that the backend's query() can raise.
+  """
+  results = []
+
+  searched_cells = set()
+  queued_cells = set()
+
+  # Priority queue of (closest possible distance, geocell) tuples. All
+  # queued cells have the same resolution.
+  resolution = geocell.MAX_GEOCELL_RESOLUTION
+  if max_distance:
+    # No need to start with cells much smaller than the search radius.
+    while resolution > 1 and _should_coarsen(resolution, center, results,
+                                             max_results, max_distance):
+      resolution -= 1
+  start_cell = geocell.compute(center, resolution)
+  cell_heap = [(0, start_cell)]
+  queued_cells.add(start_cell)
+
+  def _is_done(closest_possible_next_result_dist):
+    if max_distance and closest_possible_next_result_dist > max_distance:
+      return True
+    # If the currently max_results'th closest item is closer than any
+    # of the remaining geocells, we're done searching.
+    return (len(results) >= max_results and
+            closest_possible_next_result_dist >=
+            results[max_results - 1][1])
+
+  num_queries = 0
+  while cell_heap:
+    if _is_done(cell_heap[0][0]):
+      break
+
+    # Take the closest cells that would have to be searched anyway.
+    cur_geocells = [heapq.heappop(cell_heap)[1]]
+    while (cell_heap and len(cur_geocells) < MAX_PROXIMITY_ROUND_CELLS and
+           not _is_done(cell_heap[0][0])):
+      cur_geocells.append(heapq.heappop(cell_heap)[1])
+
+    query_geocells = []
+    for cell in cur_geocells:
+      query_geocells.extend(_unsearched_cells(cell, searched_cells))
+    searched_cells.update(cur_geocells)
+
+    # Run query on the next set of geocells.
+    new_results, round_queries = _fetch_geocells(backend, query_geocells)
+    num_queries += round_queries
+    if DEBUG:
+      logging.info('fetch complete for %s' % (','.join(query_geocells),))
+
+    # Queue the neighbors of the searched cells.
+    for cell in cur_geocells:
+      for adjacent_cell in geocell.all_adjacents(cell):
+        if adjacent_cell is None or adjacent_cell in queued_cells:
+          continue
+        queued_cells.add(adjacent_cell)
+        dist = _cell_distance(adjacent_cell, center)
+        if not max_distance or dist <= max_distance:
+          heapq.heappush(cell_heap, (dist, adjacent_cell))
+
+    # Begin storing distance from the search result entity to the
+    # search center along with the search result itself, in a tuple.
+    new_results = zip(new_results, geomath.distances(
+        center, [entity.location for entity in new_results]))
+    new_results.sort(key=lambda dr: dr[1])
+
+    # Both lists are (entity, dist) tuples sorted by dist; merge them keeping
+    # only the closest max_results, with no duplicate entities.
+    results = list(util.merge_sorted(
+        results, new_results, key=lambda dr: dr[1],
+        dedup_key=lambda dr: dr[0].key(), limit=max_results))
+
+    if resolution > 1 and _should_coarsen(resolution, center, results,
+                                          max_results, max_distance):
+      # Replace the frontier with the parents of all searched and queued
+      # cells, skipping parents that have been searched entirely.
+      resolution -= 1
+      frontier = set([cell[:-1] for cell in searched_cells
+                      if len(cell) == resolution + 1])
+      frontier.update([cell[:-1] for (dist, cell) in cell_heap])
+      cell_heap = []
+      for cell in frontier:
+        queued_cells.add(cell)
+        if _unsearched_cells(cell, searched_cells):
+          cell_heap.append((_cell_distance(cell, center), cell))
+        else:
+          searched_cells.add(cell)
+      heapq.heapify(cell_heap)
+
+    if DEBUG:
+      logging.debug('have %d results, searching resolution %d' %
+                    (len(results), resolution))
+
+  if DEBUG:
+    logging.info('proximity query looked in %d geocells '
+                 'using %d queries' % (len(searched_cells), num_queries))
+
+  return [entity for (entity, dist) in results[:max_results]
+          if not max_distance or dist < max_distance]
+
+
+def _fetch_geocells(backend, cells):
+  """Fetches all entities of a backend in the given geocells.
+
+  The given cells must not overlap. Queries that hit the backend's fetch limit
+  are retried on smaller sets of cells so that no matching entity is missed.
+
+  Returns:
+    A tuple of the list of fetched entities and the number of queries run.
+  """
+  entities = []
+  num_queries = 0
+  chunk_size = backend.max_query_cells or max(len(cells), 1)
+  for i in range(0, len(cells), chunk_size):
+    chunk = cells[i:i + chunk_size]
+    chunk_entities = list(backend.query(chunk,
+                                        limit=backend.max_fetch_results))
+    num_queries += 1
+
+    if (backend.max_fetch_results is not None and
+        len(chunk_entities) == backend.max_fetch_results):
+      # Truncated; split the cells up, one query per cell and then one query
+      # per cell's children, as long as the resolution allows.
+      split_cells = None
+      if len(chunk) > 1:
+        split_cells = [[cell] for cell in chunk]
+      elif len(chunk[0]) < geocell.MAX_GEOCELL_RESOLUTION:
+        split_cells = [geocell.children(chunk[0])]
+
+      if split_cells:
+        chunk_entities = []
+        for cell_set in split_cells:
+          split_entities, split_queries = _fetch_geocells(backend, cell_set)
+          chunk_entities.extend(split_entities)
+          num_queries += split_queries
+
+    entities.extend(chunk_entities)
+
+  return entities, num_queries
+
+
+def _cell_distance(cell, point):
+  """Returns the shortest distance from a point to anywhere in a geocell."""
+  if geocell.contains_point(cell, point):
+    return 0
+  return geocell.point_distance(cell, point)
+
+
+def _unsearched_cells(cell, searched_cells):
+  """Returns the smallest list of geocells covering the parts of the given
+  cell that are not already covered by the given set of searched cells."""
+  for resolution in range(1, len(cell) + 1):
+    if cell[:resolution] in searched_cells:
+      return []
+
+  for searched_cell in searched_cells:
+    if searched_cell.startswith(cell):
+      break
+  else:
+    return [cell]
+
+  cells = []
+  for child in geocell.children(cell):
+    cells.extend(_unsearched_cells(child, searched_cells))
+  return cells
+
+
+def _should_coarsen(resolution, center, results, max_results, max_distance):
+  """Returns whether a proximity search should move to coarser geocells.
+
+  Coarsens while fewer than max_results results have been found and there is
+  no maximum distance, or when covering the current search radius would take
+  more than MAX_PROXIMITY_ROUND_CELLS cells of the current resolution.
+  """
+  if len(results) >= max_results:
+    search_radius = results[max_results - 1][1]
+    if max_distance:
+      search_radius = min(search_radius, max_distance)
+  elif max_distance:
+    search_radius = max_distance
+  else:
+    return True
+
+  bbox = geocell.compute_box(geocell.compute(center, resolution))
+  cell_height = geomath.haversine(
+      bbox.south_west, geotypes.Point.unchecked(bbox.north, bbox.west))
+  cell_width = geomath.haversine(
+      geotypes.Point.unchecked(center.lat, bbox.west),
+      geotypes.Point.unchecked(center.lat, bbox.east))
+  num_cells = ((2 * search_radius / cell_height + 1) *
+               (2 * search_radius / cell_width + 1))
+  return num_cells > MAX_PROXIMITY_ROUND_CELLS
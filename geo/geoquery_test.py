@@ -0,0 +1,72 @@
+#!/usr/bin/python2.5
+
+"""Unit tests for geoquery.py."""
+
+import random
+import unittest
+
+import geomath
+import geoquery
+import geotypes
+import storage
+
+
+class LimitedMemoryBackend(storage.MemoryBackend):
+  """A MemoryBackend with datastore-like query limits."""
+  max_query_cells = 30
+  max_fetch_results = 20
+
+
+def _make_records(count, seed=0):
+  rand = random.Random(seed)
+  return [storage.GeoRecord(i, geotypes.Point(rand.gauss(44.97, 0.1),
+                                              rand.gauss(-93.26, 0.1)))
+          for i in range(count)]
+
+
+class GeoQueryTests(unittest.TestCase):
+  def setUp(self):
+    self.records = _make_records(500)
+    self.backends = [storage.MemoryBackend(self.records),
+                     LimitedMemoryBackend(self.records),
+                     storage.SQLiteBackend()]
+    self.backends[2].put(self.records)
+
+  def test_proximity_fetch(self):
+    rand = random.Random(1)
+    for trial in range(5):
+      center = geotypes.Point(rand.gauss(44.97, 0.1), rand.gauss(-93.26, 0.1))
+      by_distance = sorted([(geomath.haversine(center, record.location),
+                             record.key()) for record in self.records])
+      for max_results, max_distance in [(1, 0), (10, 0), (50, 5000)]:
+        expected = [key for dist, key in by_distance
+                    if not max_distance or dist < max_distance][:max_results]
+        for backend in self.backends:
+          results = geoquery.proximity_fetch(backend, center,
+                                             max_results=max_results,
+                                             max_distance=max_distance)
+          self.assertEquals(expected, [record.key() for record in results])
+
+  def test_bounding_box_fetch(self):
+    bbox = geotypes.Box(45.0, -93.2, 44.9, -93.3)
+    expected = sorted([record.key() for record in self.records
+                       if bbox.contains(record.location)])
+    self.assertTrue(expected)
+    for backend in self.backends:
+      results = geoquery.bounding_box_fetch(backend, bbox)
+      self.assertEquals(expected, sorted([r.key() for r in results]))
+      self.assertEquals(3, len(geoquery.bounding_box_fetch(backend, bbox,
+                                                           max_results=3)))
+
+  def test_region_fetch(self):
+    circle = geotypes.Circle(geotypes.Point(44.97, -93.26), 8000)
+    expected = sorted([record.key() for record in self.records
+                       if circle.contains(record.location)])
+    self.assertTrue(expected)
+    for backend in self.backends:
+      results = geoquery.region_fetch(backend, circle)
+      self.assertEquals(expected, sorted([r.key() for r in results]))
+
+
+if __name__ == '__main__':
+  unittest.main()
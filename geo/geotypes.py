@@ -18,6 +18,11 @@
 
 __author__ = 'api.roman.public@gmail.com (Roman Nurik)'
 
+import array
+import math
+
+import geomath
+
 
 class Point(object):
   """A two-dimensional point in the [-90,90] x [-180,180] lat/lon space.
@@ -26,6 +31,7 @@ class Point(object):
     lat: A float in the range [-90,90] indicating the point's latitude.
     lon: A float in the range [-180,180] indicating the point's longitude.
   """
+  __slots__ = ('lat', 'lon')
 
   def __init__(self, lat, lon):
     """Initializes a point with the given latitude and longitude."""
@@ -37,6 +43,18 @@ class Point(object):
     self.lat = lat
     self.lon = lon
 
+  @classmethod
+  def unchecked(cls, lat, lon):
+    """Creates a point without range validation.
+
+    For internal use in hot loops, where the coordinates are known to be in
+    range, e.g. because they were derived from geocells.
+    """
+    point = object.__new__(cls)
+    point.lat = lat
+    point.lon = lon
+    return point
+
   def __eq__(self, other):
     return self.lat == other.lat and self.lon == other.lon
 
@@ -57,6 +75,7 @@ class Box(object):
     south: A float indicating the box's South latitude.
     west: A float indicating the box's West longitude.
   """
+  __slots__ = ('_ne', '_sw')
 
   def __init__(self, north, east, south, west):
     # TODO(romannurik): port geojs LatLonBox here
@@ -79,7 +98,7 @@ class Box(object):
   north = property(lambda self: self._ne.lat, _set_north)
 
   def _set_east(self, val):
-    self._ne.lat = val
+    self._ne.lon = val
   east  = property(lambda self: self._ne.lon, _set_east)
 
   def _set_south(self, val):
@@ -92,9 +111,319 @@ class Box(object):
     self._sw.lon = val
   west  = property(lambda self: self._sw.lon, _set_west)
 
+  def contains(self, point):
+    """Returns whether the given point is inside the box or on its edges."""
+    return (self.south <= point.lat and point.lat <= self.north and
+            self.west <= point.lon and point.lon <= self.east)
+
+  def intersects(self, box):
+    """Returns whether the given box overlaps or touches this box."""
+    return (self.south <= box.north and box.south <= self.north and
+            self.west <= box.east and box.west <= self.east)
+
+  def bounding_box(self):
+    """Returns the smallest box containing this region, i.e. this box."""
+    return self
+
   def __eq__(self, other):
     return self._ne == other._ne and self._sw == other._sw
 
   def __str__(self):
     return '(N:%f, E:%f, S:%f, W:%f)' % (self.north, self.east,
                                          self.south, self.west)
+
+
+class FrozenBox(Box):
+  """An immutable geotypes.Box with its edges and spans precomputed.
+
+  Reading the edges of a FrozenBox doesn't go through its corner points, and
+  FrozenBoxes can be shared and cached freely. Geocell bounding boxes are
+  returned as FrozenBoxes.
+
+  Attributes:
+    lat_span: A float indicating the box's latitude span, in degrees.
+    lon_span: A float indicating the box's longitude span, in degrees.
+    (and the read-only attributes of geotypes.Box)
+  """
+  __slots__ = ('north', 'east', 'south', 'west', 'lat_span', 'lon_span')
+
+  def __init__(self, north, east, south, west):
+    if south > north:
+      south, north = north, south
+    Point(north, east)
+    Point(south, west)
+    self._init(north, east, south, west)
+
+  @classmethod
+  def unchecked(cls, north, east, south, west):
+    """Creates a frozen box without range validation or edge swapping.
+
+    For internal use in hot loops, where the edges are known to be valid,
+    e.g. because they were derived from geocells.
+    """
+    box = object.__new__(cls)
+    box._init(north, east, south, west)
+    return box
+
+  def _init(self, north, east, south, west):
+    set_attr = object.__setattr__
+    set_attr(self, 'north', north)
+    set_attr(self, 'east', east)
+    set_attr(self, 'south', south)
+    set_attr(self, 'west', west)
+    set_attr(self, 'lat_span', north - south)
+    set_attr(self, 'lon_span', east - west)
+    set_attr(self, '_ne', Point.unchecked(north, east))
+    set_attr(self, '_sw', Point.unchecked(south, west))
+
+  def __setattr__(self, name, value):
+    raise AttributeError("FrozenBox is immutable")
+
+  north_east = property(lambda self: Point.unchecked(self.north, self.east))
+  south_west = property(lambda self: Point.unchecked(self.south, self.west))
+
+  def __hash__(self):
+    return hash((self.north, self.east, self.south, self.west))
+
+
+class PointArray(object):
+  """A compact list of points stored as contiguous arrays of floats.
+
+  Stores latitudes and longitudes in two array.array('d') columns instead of
+  one object per point; NumPy can view the columns without copying them
+  (see as_numpy()). Points are validated on append.
+
+  Attributes:
+    lats: A read-only array.array of the points' latitudes.
+    lons: A read-only array.array of the points' longitudes.
+  """
+  __slots__ = ('_lats', '_lons')
+
+  def __init__(self, points=()):
+    self._lats = array.array('d')
+    self._lons = array.array('d')
+    self.extend(points)
+
+  lats = property(lambda self: self._lats)
+  lons = property(lambda self: self._lons)
+
+  def append(self, point):
+    """Appends a geotypes.Point or db.GeoPt."""
+    Point(point.lat, point.lon)
+    self._lats.append(point.lat)
+    self._lons.append(point.lon)
+
+  def extend(self, points):
+    """Appends each of the given geotypes.Point or db.GeoPt objects."""
+    for point in points:
+      self.append(point)
+
+  def as_numpy(self):
+    """Returns (lats, lons) NumPy float64 arrays sharing this array's memory.
+
+    The views are only valid until the next append.
+    """
+    return (geomath.numpy.frombuffer(self._lats, dtype=geomath.numpy.float64),
+            geomath.numpy.frombuffer(self._lons, dtype=geomath.numpy.float64))
+
+  def __len__(self):
+    return len(self._lats)
+
+  def __getitem__(self, index):
+    return Point.unchecked(self._lats[index], self._lons[index])
+
+  def __iter__(self):
+    for lat, lon in zip(self._lats, self._lons):
+      yield Point.unchecked(lat, lon)
+
+
+class BoxArray(object):
+  """A compact list of boxes stored as contiguous arrays of floats.
+
+  Attributes:
+    norths: A read-only array.array of the boxes' North latitudes.
+    easts: A read-only array.array of the boxes' East longitudes.
+    souths: A read-only array.array of the boxes' South latitudes.
+    wests: A read-only array.array of the boxes' West longitudes.
+  """
+  __slots__ = ('_norths', '_easts', '_souths', '_wests')
+
+  def __init__(self, boxes=()):
+    self._norths = array.array('d')
+    self._easts = array.array('d')
+    self._souths = array.array('d')
+    self._wests = array.array('d')
+    for box in boxes:
+      self.append(box)
+
+  norths = property(lambda self: self._norths)
+  easts = property(lambda self: self._easts)
+  souths = property(lambda self: self._souths)
+  wests = property(lambda self: self._wests)
+
+  def append(self, box):
+    """Appends a geotypes.Box."""
+    self._norths.append(box.north)
+    self._easts.append(box.east)
+    self._souths.append(box.south)
+    self._wests.append(box.west)
+
+  def containing(self, point):
+    """Returns the indices of the boxes containing the given point."""
+    lat, lon = point.lat, point.lon
+    return [i for i in range(len(self._norths))
+            if (self._souths[i] <= lat and lat <= self._norths[i] and
+                self._wests[i] <= lon and lon <= self._easts[i])]
+
+  def __len__(self):
+    return len(self._norths)
+
+  def __getitem__(self, index):
+    return FrozenBox.unchecked(self._norths[index], self._easts[index],
+                               self._souths[index], self._wests[index])
+
+
+class Circle(object):
+  """A circular region around a center point.
+
+  Attributes:
+    center: A geotypes.Point or db.GeoPt indicating the circle's center.
+    radius: A number indicating the circle's radius, in meters.
+  """
+
+  def __init__(self, center, radius):
+    if radius < 0:
+      raise ValueError("Radius must be non-negative but was %f" % radius)
+
+    self.center = center
+    self.radius = radius
+
+  def contains(self, point):
+    """Returns whether the given point is inside the circle."""
+    return geomath.haversine(self.center, point) <= self.radius
+
+  def intersects(self, box):
+    """Returns whether the given box overlaps the circle.
+
+    Errs on the side of True for boxes that come within a small margin of the
+    circle, as the closest point of a box on the sphere is approximated.
+    """
+    closest = Point.unchecked(
+        min(max(self.center.lat, box.south), box.north),
+        min(max(self.center.lon, box.west), box.east))
+    return geomath.haversine(self.center, closest) <= self.radius * 1.01 + 1
+
+  def bounding_box(self):
+    """Returns the smallest box containing the circle.
+
+    The box spans all longitudes if the circle contains a pole, and is clipped
+    at the antimeridian.
+    """
+    lat_span = math.degrees(float(self.radius) / geomath.RADIUS)
+    north = min(90, self.center.lat + lat_span)
+    south = max(-90, self.center.lat - lat_span)
+
+    if north == 90 or south == -90:
+      return Box(north, 180, south, -180)
+
+    lon_span = lat_span / math.cos(math.radians(
+        max(abs(north), abs(south))))
+    return Box(north, min(180, self.center.lon + lon_span),
+               south, max(-180, self.center.lon - lon_span))
+
+  def __str__(self):
+    return '(C:%s, R:%f)' % (self.center, self.radius)
+
+
+class Polygon(object):
+  """A simple polygonal region, treating latitude/longitude as planar.
+
+  This is accurate for small polygons such as user-drawn search areas, but
+  polygons must not cross the antimeridian.
+
+  Attributes:
+    vertices: A read-only list of geotypes.Point indicating the polygon's
+        vertices, in order. The polygon is implicitly closed.
+  """
+
+  def __init__(self, vertices):
+    if len(vertices) < 3:
+      raise ValueError("A polygon needs at least 3 vertices but had %d" %
+                       len(vertices))
+
+    self._vertices = list(vertices)
+    self._bbox = Box(max([v.lat for v in vertices]),
+                     max([v.lon for v in vertices]),
+                     min([v.lat for v in vertices]),
+                     min([v.lon for v in vertices]))
+
+  vertices = property(lambda self: self._vertices)
+
+  def _edges(self):
+    return zip(self._vertices, self._vertices[1:] + self._vertices[:1])
+
+  def contains(self, point):
+    """Returns whether the given point is inside the polygon (ray casting)."""
+    if not self._bbox.contains(point):
+      return False
+
+    inside = False
+    for v1, v2 in self._edges():
+      if (v1.lat > point.lat) != (v2.lat > point.lat):
+        crossing_lon = (v1.lon + (point.lat - v1.lat) *
+                        (v2.lon - v1.lon) / (v2.lat - v1.lat))
+        if point.lon < crossing_lon:
+          inside = not inside
+    return inside
+
+  def intersects(self, box):
+    """Returns whether the given box overlaps the polygon."""
+    if not self._bbox.intersects(box):
+      return False
+
+    # Either a vertex of one is inside the other, or their edges cross.
+    for vertex in self._vertices:
+      if box.contains(vertex):
+        return True
+    if self.contains(box.north_east):
+      return True
+
+    box_corners = [box.south_west, Point(box.south, box.east),
+                   box.north_east, Point(box.north, box.west)]
+    box_edges = zip(box_corners, box_corners[1:] + box_corners[:1])
+    for v1, v2 in self._edges():
+      for c1, c2 in box_edges:
+        if _segments_intersect(v1, v2, c1, c2):
+          return True
+    return False
+
+  def bounding_box(self):
+    """Returns the smallest box containing the polygon."""
+    return self._bbox
+
+  def __str__(self):
+    return '(%s)' % ', '.join([str(v) for v in self._vertices])
+
+
+def _segments_intersect(p1, p2, p3, p4):
+  """Returns whether segment p1-p2 intersects segment p3-p4 (planar)."""
+  def orientation(a, b, c):
+    value = ((b.lon - a.lon) * (c.lat - a.lat) -
+             (b.lat - a.lat) * (c.lon - a.lon))
+    return (value > 0) - (value < 0)
+
+  def on_segment(a, b, c):
+    return (min(a.lon, b.lon) <= c.lon and c.lon <= max(a.lon, b.lon) and
+            min(a.lat, b.lat) <= c.lat and c.lat <= max(a.lat, b.lat))
+
+  o1 = orientation(p1, p2, p3)
+  o2 = orientation(p1, p2, p4)
+  o3 = orientation(p3, p4, p1)
+  o4 = orientation(p3, p4, p2)
+
+  if o1 != o2 and o3 != o4:
+    return True
+  return ((o1 == 0 and on_segment(p1, p2, p3)) or
+          (o2 == 0 and on_segment(p1, p2, p4)) or
+          (o3 == 0 and on_segment(p3, p4, p1)) or
+          (o4 == 0 and on_segment(p3, p4, p2)))
@@ -39,6 +39,14 @@ class PointTests(unittest.TestCase):
     self.assertEquals(geotypes.Point(37, -122), geotypes.Point(37, -122))
     self.assertNotEquals(geotypes.Point(37, -122), geotypes.Point(0, 0))
 
+    # points are slotted
+    self.assertRaises(AttributeError, setattr, point, 'alt', 0)
+
+  def test_unchecked(self):
+    point = geotypes.Point.unchecked(37, -122)
+    self.assertEquals(geotypes.Point(37, -122), point)
+    self.assertTrue(isinstance(point, geotypes.Point))
+
 class BoxTests(unittest.TestCase):
   def test_Box(self):
     # an invalid box
@@ -62,6 +70,108 @@ class BoxTests(unittest.TestCase):
         geotypes.Box(37, -122, 34, -125),
         geotypes.Box(34, -122, 37, -125))
 
+    box.east = -121
+    self.assertEquals(-121, box.east)
+    self.assertEquals(37, box.north)
+
+  def test_FrozenBox(self):
+    self.assertRaises(ValueError, geotypes.FrozenBox, 95, 0, 0, 0)
+
+    box = geotypes.FrozenBox(34, -122, 37, -125)
+    self.assertEquals(geotypes.Box(37, -122, 34, -125), box)
+    self.assertEquals((37, -122, 34, -125),
+                      (box.north, box.east, box.south, box.west))
+    self.assertEquals((3, 3), (box.lat_span, box.lon_span))
+    self.assertEquals(geotypes.Point(37, -122), box.north_east)
+    self.assertEquals(geotypes.Point(34, -125), box.south_west)
+    self.assertTrue(box.contains(geotypes.Point(35, -123)))
+
+    self.assertRaises(AttributeError, setattr, box, 'north', 38)
+    self.assertRaises(AttributeError, setattr, box, 'lat_span', 4)
+
+    self.assertEquals(hash(box), hash(
+        geotypes.FrozenBox.unchecked(37, -122, 34, -125)))
+
+
+class PointArrayTests(unittest.TestCase):
+  def test_PointArray(self):
+    points = geotypes.PointArray([geotypes.Point(37, -122),
+                                  geotypes.Point(42, -75)])
+    points.append(geotypes.Point(0, 0))
+    self.assertRaises(ValueError, points.append,
+                      geotypes.Point.unchecked(95, 0))
+
+    self.assertEquals(3, len(points))
+    self.assertEquals([37, 42, 0], list(points.lats))
+    self.assertEquals([-122, -75, 0], list(points.lons))
+    self.assertEquals(geotypes.Point(42, -75), points[1])
+    self.assertEquals([geotypes.Point(37, -122), geotypes.Point(42, -75),
+                       geotypes.Point(0, 0)], list(points))
+
+    if geotypes.geomath.numpy is not None:
+      lats, lons = points.as_numpy()
+      self.assertEquals([37, 42, 0], lats.tolist())
+      self.assertEquals([-122, -75, 0], lons.tolist())
+
+
+class BoxArrayTests(unittest.TestCase):
+  def test_BoxArray(self):
+    boxes = geotypes.BoxArray([geotypes.Box(37, -122, 34, -125),
+                               geotypes.Box(36, -120, 35, -123)])
+    self.assertEquals(2, len(boxes))
+    self.assertEquals(geotypes.Box(36, -120, 35, -123), boxes[1])
+    self.assertEquals([37, 36], list(boxes.norths))
+    self.assertEquals([0, 1], boxes.containing(geotypes.Point(35.5, -122.5)))
+    self.assertEquals([0], boxes.containing(geotypes.Point(34.5, -124)))
+    self.assertEquals([], boxes.containing(geotypes.Point(0, 0)))
+
+
+class CircleTests(unittest.TestCase):
+  def test_Circle(self):
+    self.assertRaises(ValueError, geotypes.Circle, geotypes.Point(37, -122), -1)
+
+    circle = geotypes.Circle(geotypes.Point(37, -122), 1000)
+    self.assertTrue(circle.contains(geotypes.Point(37, -122)))
+    self.assertTrue(circle.contains(geotypes.Point(37.008, -122)))
+    self.assertFalse(circle.contains(geotypes.Point(37.01, -122)))
+
+    bbox = circle.bounding_box()
+    self.assertTrue(bbox.contains(geotypes.Point(37.008, -122)))
+    self.assertTrue(bbox.contains(geotypes.Point(37, -121.989)))
+    self.assertFalse(bbox.contains(geotypes.Point(37.01, -122)))
+
+    self.assertTrue(circle.intersects(geotypes.Box(37.01, -121.9, 37, -122)))
+    self.assertTrue(circle.intersects(geotypes.Box(38, -121.9, 37.008, -123)))
+    self.assertFalse(circle.intersects(geotypes.Box(38, -121.9, 37.01, -123)))
+
+    # circles containing a pole span all longitudes
+    bbox = geotypes.Circle(geotypes.Point(89.99, 0), 5000).bounding_box()
+    self.assertEquals((90, 180, -180), (bbox.north, bbox.east, bbox.west))
+
+
+class PolygonTests(unittest.TestCase):
+  def test_Polygon(self):
+    self.assertRaises(ValueError, geotypes.Polygon,
+                      [geotypes.Point(0, 0), geotypes.Point(1, 1)])
+
+    # an L-shaped polygon
+    polygon = geotypes.Polygon([
+        geotypes.Point(0, 0), geotypes.Point(0, 2), geotypes.Point(1, 2),
+        geotypes.Point(1, 1), geotypes.Point(2, 1), geotypes.Point(2, 0)])
+    self.assertEquals(geotypes.Box(2, 2, 0, 0), polygon.bounding_box())
+
+    self.assertTrue(polygon.contains(geotypes.Point(0.5, 0.5)))
+    self.assertTrue(polygon.contains(geotypes.Point(1.5, 0.5)))
+    self.assertTrue(polygon.contains(geotypes.Point(0.5, 1.5)))
+    self.assertFalse(polygon.contains(geotypes.Point(1.5, 1.5)))
+    self.assertFalse(polygon.contains(geotypes.Point(3, 0.5)))
+
+    self.assertTrue(polygon.intersects(geotypes.Box(0.6, 0.6, 0.4, 0.4)))
+    self.assertTrue(polygon.intersects(geotypes.Box(3, 3, -1, -1)))
+    self.assertTrue(polygon.intersects(geotypes.Box(1.5, 1.2, 0.5, 0.8)))
+    self.assertFalse(polygon.intersects(geotypes.Box(1.9, 1.9, 1.1, 1.1)))
+    self.assertFalse(polygon.intersects(geotypes.Box(5, 5, 3, 3)))
+
 
 if __name__ == '__main__':
   unittest.main()
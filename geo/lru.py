@@ -0,0 +1,131 @@
+#!/usr/bin/python2.5
+
+"""Defines a bounded least-recently-used cache and a memoizing decorator."""
+
+import threading
+
+# Indices into the [prev, next, key, value] lists of the recency list.
+_PREV, _NEXT, _KEY, _VALUE = 0, 1, 2, 3
+
+
+class LRUCache(object):
+  """A bounded mapping that evicts its least recently used entries.
+
+  Entries are kept in a doubly-linked recency list threaded through a dict,
+  so lookups, insertions and evictions are all O(1). The cache is safe to
+  share between threads.
+
+  Attributes:
+    max_size: An int indicating the maximum number of entries.
+    hits: The number of get() calls that found their key.
+    misses: The number of get() calls that didn't.
+  """
+
+  def __init__(self, max_size):
+    if max_size < 1:
+      raise ValueError("Cache size must be positive but was %d" % max_size)
+
+    self.max_size = max_size
+    self.hits = 0
+    self.misses = 0
+    self._lock = threading.Lock()
+    self._clear()
+
+  def _clear(self):
+    self._map = {}
+    self._root = []
+    self._root[:] = [self._root, self._root, None, None]
+
+  def get(self, key, default=None):
+    """Returns the value cached for the given key, or default."""
+    self._lock.acquire()
+    try:
+      link = self._map.get(key)
+      if link is None:
+        self.misses += 1
+        return default
+
+      # Move the entry to the most recently used end.
+      link[_PREV][_NEXT] = link[_NEXT]
+      link[_NEXT][_PREV] = link[_PREV]
+      last = self._root[_PREV]
+      last[_NEXT] = self._root[_PREV] = link
+      link[_PREV] = last
+      link[_NEXT] = self._root
+
+      self.hits += 1
+      return link[_VALUE]
+    finally:
+      self._lock.release()
+
+  def put(self, key, value):
+    """Caches the given value, evicting the least recently used if full."""
+    self._lock.acquire()
+    try:
+      link = self._map.get(key)
+      if link is not None:
+        link[_VALUE] = value
+        return
+
+      if len(self._map) >= self.max_size:
+        oldest = self._root[_NEXT]
+        self._root[_NEXT] = oldest[_NEXT]
+        oldest[_NEXT][_PREV] = self._root
+        del self._map[oldest[_KEY]]
+
+      last = self._root[_PREV]
+      link = [last, self._root, key, value]
+      last[_NEXT] = self._root[_PREV] = self._map[key] = link
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    """Removes all entries and resets the hit and miss counters."""
+    self._lock.acquire()
+    try:
+      self._clear()
+      self.hits = 0
+      self.misses = 0
+    finally:
+      self._lock.release()
+
+  def stats(self):
+    """Returns a dict with the cache's hits, misses, size and max_size."""
+    return {'hits': self.hits, 'misses': self.misses,
+            'size': len(self), 'max_size': self.max_size}
+
+  def __contains__(self, key):
+    return key in self._map
+
+  def __len__(self):
+    return len(self._map)
+
+
+def memoize(max_size):
+  """Returns a decorator caching a function's results in an LRUCache.
+
+  The decorated function's positional arguments must be hashable, and its
+  results must not be mutated by callers. The cache is exposed as the
+  decorated function's 'cache' attribute.
+
+  Args:
+    max_size: The maximum number of results to cache.
+  """
+  def decorator(fn):
+    cache = LRUCache(max_size)
+    missing = object()
+
+    def wrapper(*args):
+      result = cache.get(args, missing)
+      if result is missing:
+        result = fn(*args)
+        cache.put(args, result)
+      return result
+
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    wrapper.cache = cache
+    wrapper.uncached = fn
+    return wrapper
+
+  return decorator
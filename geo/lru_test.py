@@ -0,0 +1,63 @@
+#!/usr/bin/python2.5
+
+"""Unit tests for lru.py."""
+
+import unittest
+
+import lru
+
+
+class LRUCacheTests(unittest.TestCase):
+  def test_LRUCache(self):
+    self.assertRaises(ValueError, lru.LRUCache, 0)
+
+    cache = lru.LRUCache(2)
+    self.assertEquals(None, cache.get('a'))
+    cache.put('a', 1)
+    cache.put('b', 2)
+    self.assertEquals(1, cache.get('a'))
+
+    # 'b' is now the least recently used, and gets evicted
+    cache.put('c', 3)
+    self.assertEquals(2, len(cache))
+    self.assertFalse('b' in cache)
+    self.assertEquals(1, cache.get('a'))
+    self.assertEquals(3, cache.get('c'))
+    self.assertEquals('none', cache.get('b', 'none'))
+
+    # updating doesn't evict
+    cache.put('c', 4)
+    self.assertEquals(4, cache.get('c'))
+    self.assertTrue('a' in cache)
+
+    self.assertEquals({'hits': 4, 'misses': 2, 'size': 2, 'max_size': 2},
+                      cache.stats())
+
+    cache.clear()
+    self.assertEquals({'hits': 0, 'misses': 0, 'size': 0, 'max_size': 2},
+                      cache.stats())
+
+  def test_memoize(self):
+    calls = []
+
+    @lru.memoize(2)
+    def square(x):
+      """Squares x."""
+      calls.append(x)
+      return x * x
+
+    self.assertEquals('square', square.__name__)
+    self.assertEquals('Squares x.', square.__doc__)
+
+    self.assertEquals(4, square(2))
+    self.assertEquals(4, square(2))
+    self.assertEquals(9, square(3))
+    self.assertEquals(16, square(4))
+    self.assertEquals(4, square(2))
+    self.assertEquals([2, 3, 4, 2], calls)
+    self.assertEquals(1, square.cache.hits)
+    self.assertEquals(4, square.uncached(2))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,316 @@
+#!/usr/bin/python2.5
+
+"""Defines the storage backends that geoquery runs geospatial queries against.
+
+A backend answers a single kind of query: fetch the entities located in any
+of a list of geocells. Entities are objects with a 'location' attribute
+(a geotypes.Point or db.GeoPt) and a key() method returning a hashable key.
+
+DatastoreBackend runs queries against App Engine datastore entities of a
+GeoModel subclass. MemoryBackend and SQLiteBackend hold their own entities
+and don't depend on App Engine, so that the query engine can be tested,
+benchmarked and profiled locally at production data volumes.
+"""
+
+import bisect
+import copy
+import cPickle as pickle
+import sqlite3
+
+import geocell
+import geotypes
+
+# Upper bound on the characters following a geocell prefix; all geocell
+# characters sort before it.
+_CELL_RANGE_END = chr(ord(geocell._GEOCELL_ALPHABET[-1]) + 1)
+
+
+class GeoRecord(object):
+  """A minimal located entity, as stored by MemoryBackend and SQLiteBackend.
+
+  Attributes:
+    location: The geotypes.Point at which the record is located.
+    data: An arbitrary (picklable, for SQLiteBackend) value.
+  """
+  __slots__ = ('_key', 'location', 'data')
+
+  def __init__(self, key, location, data=None):
+    self._key = key
+    self.location = location
+    self.data = data
+
+  def key(self):
+    return self._key
+
+  def __eq__(self, other):
+    return (isinstance(other, GeoRecord) and self._key == other._key and
+            self.location == other.location and self.data == other.data)
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  def __repr__(self):
+    return 'GeoRecord(%r, %r, %r)' % (self._key, self.location, self.data)
+
+
+class Backend(object):
+  """The interface of a geocell-indexed entity store.
+
+  Attributes:
+    max_query_cells: The maximum number of geocells a single query() call may
+        be given, or None if unlimited.
+    max_fetch_results: The maximum number of entities a single query() call
+        returns, or None if unlimited.
+  """
+  max_query_cells = None
+  max_fetch_results = None
+
+  def query(self, cells, limit=None):
+    """Returns the entities located in any of the given geocells.
+
+    Args:
+      cells: A list of geocells; at most max_query_cells.
+      limit: An optional maximum number of entities to return. None means
+          no limit other than max_fetch_results.
+
+    Returns:
+      An iterable over the matching entities, with no duplicates. Callers may
+      stop iterating early.
+    """
+    raise NotImplementedError()
+
+
+class DatastoreBackend(Backend):
+  """A backend running IN queries on a GeoModel's location_geocells.
+
+  Every query runs on a copy of the given db.Query, so that any filters
+  already set on it are kept.
+  """
+  max_query_cells = 30
+  max_fetch_results = 1000
+
+  def __init__(self, query):
+    """Creates a backend for the given db.Query on GeoModel entities."""
+    # TODO(romannurik): Check for GqlQuery.
+    self._query = query
+
+  def query(self, cells, limit=None):
+    temp_query = copy.deepcopy(self._query)  # TODO(romannurik): is this safe?
+    temp_query.filter('location_geocells IN', cells)
+    if limit is None:
+      return temp_query
+    return temp_query.fetch(min(limit, self.max_fetch_results))
+
+
+class FilteredBackend(Backend):
+  """A view of another backend holding only the entities matching a filter.
+
+  Useful for running geoquery fetches on a subset of an in-memory index,
+  the way additional filters narrow a db.Query.
+  """
+
+  def __init__(self, backend, predicate):
+    """Creates a filtered view of a backend.
+
+    Args:
+      backend: The storage.Backend to filter.
+      predicate: A function taking an entity and returning whether it should
+          be included.
+    """
+    self._backend = backend
+    self._predicate = predicate
+
+  def query(self, cells, limit=None):
+    count = 0
+    for entity in self._backend.query(cells):
+      if limit is not None and count == limit:
+        return
+      if self._predicate(entity):
+        count += 1
+        yield entity
+
+
+def _max_res_geocells(entities):
+  """Returns the max resolution geocell of each of the given entities."""
+  if geocell.numpy is not None and len(entities) > 1:
+    return geocell.compute_many([entity.location.lat for entity in entities],
+                                [entity.location.lon for entity in entities],
+                                as_strings=True)
+  return [geocell.compute(entity.location) for entity in entities]
+
+
+class MemoryBackend(Backend):
+  """An in-process backend holding entities in a sorted geocell index.
+
+  Only each entity's max resolution geocell is indexed; a query for a
+  geocell is a binary search for the range of indexed geocells it prefixes.
+  Any object with a location and a hashable key() can be stored.
+  """
+
+  def __init__(self, entities=None):
+    self._entities = {}  # key -> (max resolution geocell, entity)
+    self._cells = []  # sorted max resolution geocells ...
+    self._keys = []  # ... and the keys of their entities.
+    if entities:
+      self.put(entities)
+
+  def __len__(self):
+    return len(self._entities)
+
+  def __contains__(self, key):
+    return key in self._entities
+
+  def get(self, key, default=None):
+    """Returns the stored entity with the given key, or default."""
+    if key in self._entities:
+      return self._entities[key][1]
+    return default
+
+  def put(self, entities):
+    """Stores the given entities, replacing any with the same keys."""
+    entities = [entity for entity in entities if entity.location]
+    cells = _max_res_geocells(entities)
+    self.delete([entity.key() for entity in entities])
+
+    # Insert a few entities in place; sort once for bulk loads.
+    rebuild = len(entities) > len(self._cells) / 8
+    for entity, cell in zip(entities, cells):
+      key = entity.key()
+      self._entities[key] = (cell, entity)
+      if not rebuild:
+        i = bisect.bisect_right(self._cells, cell)
+        self._cells.insert(i, cell)
+        self._keys.insert(i, key)
+
+    if rebuild:
+      index = sorted([(cell, key)
+                      for key, (cell, entity) in self._entities.iteritems()])
+      self._cells = [cell for cell, key in index]
+      self._keys = [key for cell, key in index]
+
+  def delete(self, keys):
+    """Removes the entities with the given keys, if stored."""
+    for key in keys:
+      if key not in self._entities:
+        continue
+      cell = self._entities.pop(key)[0]
+      i = bisect.bisect_left(self._cells, cell)
+      while self._keys[i] != key:
+        i += 1
+      del self._cells[i]
+      del self._keys[i]
+
+  def clear(self):
+    """Removes all entities."""
+    self._entities.clear()
+    self._cells = []
+    self._keys = []
+
+  def __iter__(self):
+    for cell, entity in self._entities.itervalues():
+      yield entity
+
+  def query(self, cells, limit=None):
+    seen_keys = set()
+    for cell in cells:
+      start = bisect.bisect_left(self._cells, cell)
+      end = bisect.bisect_left(self._cells, cell + _CELL_RANGE_END, start)
+      for key in self._keys[start:end]:
+        if key in seen_keys:
+          continue
+        if limit is not None and len(seen_keys) == limit:
+          return
+        seen_keys.add(key)
+        yield self._entities[key][1]
+
+
+class SQLiteBackend(Backend):
+  """A backend storing GeoRecords in a geocell-indexed SQLite table.
+
+  Each record is a row holding its key, location, max resolution geocell and
+  pickled data; a query for a set of geocells is a set of range scans on the
+  geocell index. File databases are opened in write-ahead logging mode so
+  that readers don't block the writer.
+  """
+
+  def __init__(self, path=':memory:', table='geo_records'):
+    """Opens (creating it if needed) a record table in an SQLite database.
+
+    Args:
+      path: The database file path, or ':memory:' for a private in-memory
+          database.
+      table: The name of the table holding the records.
+    """
+    self._table = table
+    self._conn = sqlite3.connect(path)
+    if path != ':memory:':
+      self._conn.execute('PRAGMA journal_mode=WAL')
+      self._conn.execute('PRAGMA synchronous=NORMAL')
+    self._conn.execute('CREATE TABLE IF NOT EXISTS %s (key PRIMARY KEY, '
+                       'lat REAL NOT NULL, lon REAL NOT NULL, '
+                       'geocell TEXT NOT NULL, data BLOB)' % table)
+    self._conn.execute('CREATE INDEX IF NOT EXISTS %s_geocell ON %s (geocell)'
+                       % (table, table))
+    self._conn.commit()
+
+  def close(self):
+    self._conn.close()
+
+  def __len__(self):
+    return self._conn.execute('SELECT COUNT(*) FROM %s'
+                              % self._table).fetchone()[0]
+
+  def _to_record(self, row):
+    key, lat, lon, data = row
+    if data is not None:
+      data = pickle.loads(str(data))
+    return GeoRecord(key, geotypes.Point.unchecked(lat, lon), data)
+
+  def get(self, key, default=None):
+    """Returns the stored GeoRecord with the given key, or default."""
+    row = self._conn.execute('SELECT key, lat, lon, data FROM %s WHERE key = ?'
+                             % self._table, (key,)).fetchone()
+    if row is None:
+      return default
+    return self._to_record(row)
+
+  def put(self, records):
+    """Stores the given GeoRecords in a single transaction, replacing any with
+    the same keys."""
+    records = [record for record in records if record.location]
+    cells = _max_res_geocells(records)
+    rows = []
+    for record, cell in zip(records, cells):
+      data = record.data
+      if data is not None:
+        data = sqlite3.Binary(pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+      rows.append((record.key(), record.location.lat, record.location.lon,
+                   cell, data))
+    self._conn.executemany('INSERT OR REPLACE INTO %s VALUES (?, ?, ?, ?, ?)'
+                           % self._table, rows)
+    self._conn.commit()
+
+  def delete(self, keys):
+    """Removes the records with the given keys, if stored."""
+    self._conn.executemany('DELETE FROM %s WHERE key = ?' % self._table,
+                           [(key,) for key in keys])
+    self._conn.commit()
+
+  def clear(self):
+    """Removes all records."""
+    self._conn.execute('DELETE FROM %s' % self._table)
+    self._conn.commit()
+
+  def query(self, cells, limit=None):
+    if not cells:
+      return
+    sql = ('SELECT key, lat, lon, data FROM %s WHERE ' % self._table +
+           ' OR '.join(['(geocell >= ? AND geocell < ?)'] * len(cells)))
+    args = []
+    for cell in cells:
+      args.extend([cell, cell + _CELL_RANGE_END])
+    if limit is not None:
+      sql += ' LIMIT ?'
+      args.append(limit)
+    for row in self._conn.execute(sql, args):
+      yield self._to_record(row)
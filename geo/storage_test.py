@@ -0,0 +1,111 @@
+#!/usr/bin/python2.5
+
+"""Unit tests for storage.py."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import geocell
+import geotypes
+import storage
+
+
+def _records():
+  return [storage.GeoRecord(1, geotypes.Point(37.78, -122.41), 'sf'),
+          storage.GeoRecord(2, geotypes.Point(37.80, -122.27), {'city': 'oak'}),
+          storage.GeoRecord(3, geotypes.Point(40.71, -74.01)),
+          storage.GeoRecord(4, geotypes.Point(37.78, -122.41), 'sf2')]
+
+
+class StorageTests(unittest.TestCase):
+  def assertBackendQueries(self, backend):
+    backend.put(_records())
+    self.assertEquals(4, len(backend))
+    self.assertEquals('sf', backend.get(1).data)
+    self.assertEquals({'city': 'oak'}, backend.get(2).data)
+    self.assertEquals(None, backend.get(5))
+
+    sf_cell = geocell.compute(geotypes.Point(37.78, -122.41))
+    def keys(cells, limit=None):
+      return sorted([record.key() for record in backend.query(cells, limit)])
+
+    self.assertEquals([1, 4], keys([sf_cell]))
+    self.assertEquals([1, 2, 4], keys([sf_cell[:3]]))
+    self.assertEquals([1, 2, 3, 4], keys([sf_cell[:3], sf_cell,
+                                          geocell.compute(
+                                              geotypes.Point(40.71, -74.01))]))
+    self.assertEquals(2, len(keys([sf_cell[:3]], limit=2)))
+    self.assertEquals([], keys([]))
+
+    # Replacing moves records between cells.
+    backend.put([storage.GeoRecord(4, geotypes.Point(40.71, -74.01), 'ny')])
+    self.assertEquals(4, len(backend))
+    self.assertEquals([1], keys([sf_cell]))
+    self.assertEquals('ny', backend.get(4).data)
+
+    backend.delete([1, 5])
+    self.assertEquals([], keys([sf_cell]))
+    self.assertEquals(3, len(backend))
+
+    backend.clear()
+    self.assertEquals(0, len(backend))
+    self.assertEquals([], keys([sf_cell[:1]]))
+
+  def test_MemoryBackend(self):
+    self.assertBackendQueries(storage.MemoryBackend())
+
+    backend = storage.MemoryBackend(_records())
+    self.assertTrue(1 in backend)
+    self.assertEquals(4, len(list(backend)))
+
+    # Single puts into a large index are inserted in order.
+    for i in range(100, 120):
+      backend.put([storage.GeoRecord(i, geotypes.Point(i % 80, i))])
+    self.assertEquals(sorted(backend._cells), backend._cells)
+    self.assertEquals(sorted(backend._entities.keys()),
+                      sorted(backend._keys))
+
+  def test_SQLiteBackend(self):
+    self.assertBackendQueries(storage.SQLiteBackend())
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+      path = os.path.join(temp_dir, 'geo.db')
+      backend = storage.SQLiteBackend(path)
+      backend.put(_records())
+      backend.close()
+      self.assertEquals('sf', storage.SQLiteBackend(path).get(1).data)
+    finally:
+      shutil.rmtree(temp_dir)
+
+  def test_FilteredBackend(self):
+    backend = storage.FilteredBackend(storage.MemoryBackend(_records()),
+                                      lambda record: record.data is not None)
+    cells = [geocell.compute(geotypes.Point(37.78, -122.41), 1),
+             geocell.compute(geotypes.Point(40.71, -74.01), 1)]
+    self.assertEquals([1, 2, 4],
+                      sorted([record.key() for record in backend.query(cells)]))
+    self.assertEquals(2, len(list(backend.query(cells, limit=2))))
+
+  def test_DatastoreBackend(self):
+    class FakeQuery(object):
+      def __init__(self):
+        self.filters = []
+      def filter(self, property_operator, value):
+        self.filters.append((property_operator, value))
+        return self
+      def fetch(self, limit):
+        return [limit]
+
+    query = FakeQuery()
+    backend = storage.DatastoreBackend(query)
+    self.assertEquals([1000], backend.query(['8e'], limit=5000))
+    self.assertEquals([], query.filters)
+    self.assertEquals([('location_geocells IN', ['8e'])],
+                      backend.query(['8e']).filters)
+
+
+if __name__ == '__main__':
+  unittest.main()
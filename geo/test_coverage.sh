@@ -6,5 +6,9 @@ coverage -x geomath_test.py
 coverage -x geotypes_test.py
 coverage -x util_test.py
 coverage -x geocell_test.py
+coverage -x lru_test.py
+coverage -x storage_test.py
+coverage -x geoquery_test.py
+coverage -x benchmark_test.py
 
-coverage -r -m geomath.py geotypes.py util.py geocell.py
+coverage -r -m geomath.py geotypes.py util.py geocell.py lru.py storage.py geoquery.py benchmark.py
@@ -18,6 +18,8 @@
 
 __author__ = 'api.roman.public@gmail.com (Roman Nurik)'
 
+import heapq
+
 import geocell
 import geomath
 import geotypes
@@ -42,6 +44,8 @@ def merge_in_place(*lists, **kwargs):
   Returns:
     list1, in-placed merged wit the other lists, or an empty list if no lists
     were specified.
+
+  NOTE: This is quadratic in the total list length; prefer merge_sorted().
   """
   cmp_fn = kwargs.get('cmp_fn') or cmp
   dup_fn = kwargs.get('dup_fn') or None
@@ -82,6 +86,61 @@ def merge_in_place(*lists, **kwargs):
   return lists[0]
 
 
+def merge_sorted(*iterables, **kwargs):
+  """Lazily merges an arbitrary number of pre-sorted iterables.
+
+  This is a heap-based k-way merge: each item is compared O(log k) times, and
+  items are only pulled from the source iterables as the merged output is
+  consumed.
+
+  Args:
+    iterable1: The first sorted iterable.
+    iterable2: A subsequent sorted iterable.
+    ...
+    iterablen:  "   "
+    key: An optional function that returns the sort key of an item, matching
+        the order the iterables are sorted in.
+    dedup_key: An optional function that returns a hashable identity for an
+        item; only the first (lowest sorted) item of each identity is yielded.
+    limit: An optional maximum number of items to yield.
+
+  Yields:
+    The merged items, in sorted order.
+  """
+  key = kwargs.get('key') or (lambda item: item)
+  dedup_key = kwargs.get('dedup_key') or None
+  limit = kwargs.get('limit')
+
+  # Heap of (sort key, iterable index, item, iterator) tuples; the index
+  # keeps the merge stable and stops comparisons from reaching the items.
+  heap = []
+  for index, iterable in enumerate(iterables):
+    iterator = iter(iterable)
+    for item in iterator:
+      heap.append((key(item), index, item, iterator))
+      break
+  heapq.heapify(heap)
+
+  seen = set()
+  count = 0
+  while heap and (limit is None or count < limit):
+    item_key, index, item, iterator = heap[0]
+    for next_item in iterator:
+      heapq.heapreplace(heap, (key(next_item), index, next_item, iterator))
+      break
+    else:
+      heapq.heappop(heap)
+
+    if dedup_key:
+      identity = dedup_key(item)
+      if identity in seen:
+        continue
+      seen.add(identity)
+
+    yield item
+    count += 1
+
+
 def distance_sorted_edges(cells, point):
   """Returns the edges of the rectangular region containing all of the
   given geocells, sorted by distance from the given point, along with
@@ -101,17 +160,14 @@ def distance_sorted_edges(cells, point):
   # TODO(romannurik): Assert that lat,lon are actually inside the geocell.
   boxes = [geocell.compute_box(cell) for cell in cells]
 
-  max_box = geotypes.Box(max([box.north for box in boxes]),
-                         max([box.east for box in boxes]),
-                         min([box.south for box in boxes]),
-                         min([box.west for box in boxes]))
+  max_box = geotypes.FrozenBox.unchecked(max([box.north for box in boxes]),
+                                         max([box.east for box in boxes]),
+                                         min([box.south for box in boxes]),
+                                         min([box.west for box in boxes]))
+  edge_point = geotypes.Point.unchecked
   return zip(*sorted([
-      ((0,-1), geomath.distance(geotypes.Point(max_box.south, point.lon),
-                                point)),
-      ((0,1),  geomath.distance(geotypes.Point(max_box.north, point.lon),
-                                point)),
-      ((-1,0), geomath.distance(geotypes.Point(point.lat, max_box.west),
-                                point)),
-      ((1,0),  geomath.distance(geotypes.Point(point.lat, max_box.east),
-                                point))],
+      ((0,-1), geomath.distance(edge_point(max_box.south, point.lon), point)),
+      ((0,1),  geomath.distance(edge_point(max_box.north, point.lon), point)),
+      ((-1,0), geomath.distance(edge_point(point.lat, max_box.west), point)),
+      ((1,0),  geomath.distance(edge_point(point.lat, max_box.east), point))],
       lambda x, y: cmp(x[1], y[1])))
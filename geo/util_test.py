@@ -43,5 +43,40 @@ class MergeInPlaceTests(unittest.TestCase):
         list1)
 
 
+class MergeSortedTests(unittest.TestCase):
+  def test_merge_sorted(self):
+    self.assertEquals([], list(util.merge_sorted()))
+
+    list1 = [0, 1, 5, 6, 8, 9, 15]
+    list2 = [0, 2, 3, 5, 8, 10, 11, 17]
+    list3 = [1, 4, 6, 8, 10, 15, 16]
+    list4 = [-1, 19]
+    list5 = [20]
+    list6 = []
+
+    self.assertEquals(
+        sorted(list1 + list2 + list3 + list4 + list5 + list6),
+        list(util.merge_sorted(list1, list2, list3, list4, list5, list6)))
+
+    self.assertEquals(
+        [-1, 0, 1, 2, 3, 4, 5, 6, 8, 9, 10, 11, 15, 16, 17, 19, 20],
+        list(util.merge_sorted(list1, list2, list3, list4, list5, list6,
+                               dedup_key=lambda x: x)))
+
+    self.assertEquals(
+        [-1, 0, 1, 2],
+        list(util.merge_sorted(iter(list1), iter(list2), iter(list4),
+                               dedup_key=lambda x: x, limit=4)))
+
+  def test_merge_sorted_key(self):
+    # (entity, distance) tuples, deduplicated by entity
+    list1 = [('a', 1), ('b', 3), ('c', 5)]
+    list2 = [('d', 2), ('b', 3), ('e', 4)]
+    self.assertEquals(
+        [('a', 1), ('d', 2), ('b', 3), ('e', 4)],
+        list(util.merge_sorted(list1, list2, key=lambda x: x[1],
+                               dedup_key=lambda x: x[0], limit=4)))
+
+
 if __name__ == '__main__':
   unittest.main()
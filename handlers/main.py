@@ -64,29 +64,6 @@ class MapHandler(BaseHandler):
             })
 
 class MainHandler(webapp.RequestHandler):
-    def geocode(self, address):
-        from google.appengine.api import urlfetch
-        from urllib import urlencode
-        from django.utils import simplejson as json
-
-        geocoding_api = 'http://maps.googleapis.com/maps/api/geocode/\
-json?%s' % urlencode([
-            ('address', address),
-            ('sensor', 'false')
-        ])
-
-        result = urlfetch.fetch(geocoding_api)
-        if result.status_code == 200:
-            response = json.loads(result.content)
-            if response['status'] == 'OK':
-                location = response['results'][0]['geometry']['location']
-                low_res_flag = 'political'\
-                        in response['results'][0]['types']
-
-                return low_res_flag, [location['lat'], location['lng']]
-            else:
-                return response['status'], None
-
     def get(self):
         from datetime import datetime, timedelta
         from time import mktime
@@ -113,13 +90,13 @@ json?%s' % urlencode([
 
         elif self.request.get('filter'):
             from google.appengine.api.taskqueue import Task
-            ts = datetime.now() - timedelta(days=1)
-            for lst in List.all():
-                task = Task(url='/tasks/filter/',
-                            params={'id': lst.key().id(),
-                                    'since': mktime(ts.timetuple())
-                            })
-                task.add('postqueue')
+            Task(url='/tasks/digest/', method='GET').add('emailqueue')
+
+        elif (self.request.get('migrate_filters') and
+              users.is_current_user_admin()):
+            from craigslist import alerts
+            self.response.out.write('Migrated %d alert filters' %
+                                    alerts.migrate_filters())
 
         else:
             post_list = List.all().filter('city =', 'minneapolis').filter(
@@ -16,6 +16,7 @@
 #
 
 from craigslist import List, Post, ListSubscriber, AlertFilter
+from craigslist import postindex
 
 from geo import geotypes, geomath
 from google.appengine.ext import webapp
@@ -26,9 +27,15 @@ from google.appengine.api import urlfetch
 from django.utils import simplejson as json
 
 import re
-import pickle
 from datetime import datetime, timedelta
 
+def id_or_name(value):
+    """Returns the key id or key name passed as a string; ids are all
+    digits, and key names never are."""
+    if value.isdigit():
+        return int(value)
+    return value
+
 class JSONHandler(webapp.RequestHandler):
     def _error(self, message, code=400):
         self.error(code)
@@ -40,25 +47,27 @@ class JSONHandler(webapp.RequestHandler):
 
         return None
 
-    def apply_filters(self, query):
+    def freshness_cutoff(self):
+        """Returns the creation time posts must be newer than, or None."""
         try:
             freshness = int(self.request.get('freshness', 48))
         except ValueError:
-            return query
+            return None
 
         if freshness > 0:
-            query_date = datetime.utcnow() + timedelta(hours=-freshness)
+            return datetime.utcnow() + timedelta(hours=-freshness)
+
+    def apply_filters(self, query):
+        query_date = self.freshness_cutoff()
+        if query_date:
             query = query.filter('created >', query_date)
 
         return query
 
 class PackHandler(JSONHandler):
     def post(self):
-        try:
-            kind = self.request.get('kind')
-            id = int(self.request.get('id'))
-        except ValueError:
-            return self._error('BAD REQUEST', 400)
+        kind = self.request.get('kind')
+        id = id_or_name(self.request.get('id'))
 
         if not kind or not id:
             return self._error('BAD REQUEST', 400)
@@ -148,14 +157,16 @@ class PostRetrieveHandler(JSONHandler):
         else:
             return []
     def get(self):
-        try:
-            post_id = int(self.request.get('id'))
-        except ValueError:
+        post_id = id_or_name(self.request.get('id'))
+        if not post_id:
             return self._error("INVALID_IDENTIFIER", 400)
 
         self.response.headers['Content-Type'] = 'application/json'
 
-        post = Post.get_by_id(post_id)
+        if isinstance(post_id, int):
+            post = Post.get_by_id(post_id)
+        else:
+            post = Post.get_by_key_name(post_id)
         if post:
             post_hosted_images = self.retrieve_images(post.link)
             return self.response.out.write(json.dumps(
@@ -197,8 +208,8 @@ class FilterHandler(JSONHandler):
                  {
                  'id': uf.key().id(),
                  'street': uf.street_name,
-                 'center': pickle.loads(uf.geo_region)['center'],
-                 'radius': pickle.loads(uf.geo_region)['radius'],
+                 'center': uf.get_region()[0],
+                 'radius': uf.get_region()[1],
                  'maxPrice': uf.max_price
                  } for uf in user_filters]
             }))
@@ -222,10 +233,7 @@ class FilterHandler(JSONHandler):
             if user_filter.owner != user:
                 return self._error("UNAUTHORIZED_REQUEST", 400)
 
-            user_filter.geo_region = pickle.dumps({
-                'center': [latitude, longitude],
-                'radius': radius
-            })
+            user_filter.set_region(latitude, longitude, radius)
             user_filter.max_price = max_price
             user_filter.street_name = street_name
         elif user and list_watched:
@@ -233,12 +241,9 @@ class FilterHandler(JSONHandler):
                 sublist=db.Key.from_path('List', list_watched),
                 max_price=max_price,
                 street_name=street_name,
-                owner=user,
-                geo_region=pickle.dumps({
-                    'center': [latitude, longitude],
-                    'radius': radius
-                })
+                owner=user
             )
+            user_filter.set_region(latitude, longitude, radius)
 
         if user_filter:
             filter_key = user_filter.put()
@@ -266,30 +271,42 @@ class ProximitySearchHandler(JSONHandler):
         if not latitude or not longitude or not list_search_against:
             return self._error('INVALID_PARAMETERS', 400) # Bad request
 
-        list_key = List.get_by_id(list_search_against).key()
-        query = Post.all().filter('posted_list =', list_key).order('-created')
-        if not approx_results:
-            query = query.filter('approx_geolocation =', False)
-
         center = geotypes.Point(latitude, longitude)
 
-        proximity_posts = Post.proximity_fetch(
-            query,
-            center,
-            max_results=max_results,
-            max_distance=radius
-        )
+        # Serve from the in-memory index of the list when possible.
+        index = postindex.get(list_search_against)
+        if index is not None:
+            proximity_posts = index.proximity_fetch(
+                center,
+                max_results=max_results,
+                max_distance=radius,
+                approx=bool(approx_results)
+            )
+        else:
+            list_key = List.get_by_id(list_search_against).key()
+            query = Post.all().filter(
+                'posted_list =', list_key).order('-created')
+            if not approx_results:
+                query = query.filter('approx_geolocation =', False)
+
+            proximity_posts = Post.proximity_fetch(
+                query,
+                center,
+                max_results=max_results,
+                max_distance=radius
+            )
 
         self.response.headers['Content-Type'] = 'application/json'
         if proximity_posts:
+            distances = geomath.distances(
+                center, [post.location for post in proximity_posts])
             results = [{'title': post.title,
                         'price': post.price,
                         'location': [post.latitude, post.longitude],
-                        'id': post.key().id(),
-                        'distance': round(geomath.distance(center,
-                            geotypes.Point(post.latitude, post.longitude))),
+                        'id': post.key().id_or_name(),
+                        'distance': round(distance),
                         'created': post.created.ctime(),
-                       } for post in proximity_posts]
+                       } for post, distance in zip(proximity_posts, distances)]
 
             return self.response.out.write(json.dumps({
                 'status': 'OK',
@@ -327,17 +344,29 @@ class BoundSearchHandler(JSONHandler):
                 or not list_search_against:
             self._error('INVALID_PARAMETERS', 400) # Bad request
 
-        list_key = List.get_by_id(list_search_against).key()
-        query = self.apply_filters(Post.all().filter(
-            'posted_list =', list_key)).order('-created')
-        if not approx_results:
-            query = query.filter('approx_geolocation =', False)
+        bbox = geotypes.Box(north, east, south, west)
 
-        bound_posts = Post.bounding_box_fetch(
-            query,
-            geotypes.Box(north, east, south, west),
-            max_results=max_results
-        )
+        # Serve from the in-memory index of the list when possible.
+        index = postindex.get(list_search_against)
+        if index is not None:
+            bound_posts = index.bounding_box_fetch(
+                bbox,
+                max_results=max_results,
+                approx=bool(approx_results),
+                since=self.freshness_cutoff()
+            )
+        else:
+            list_key = List.get_by_id(list_search_against).key()
+            query = self.apply_filters(Post.all().filter(
+                'posted_list =', list_key)).order('-created')
+            if not approx_results:
+                query = query.filter('approx_geolocation =', False)
+
+            bound_posts = Post.bounding_box_fetch(
+                query,
+                bbox,
+                max_results=max_results
+            )
 
         self.response.headers['Content-Type'] = 'application/json'
         if bound_posts:
@@ -345,7 +374,7 @@ class BoundSearchHandler(JSONHandler):
                         'price': post.price,
                         'location': [post.latitude, post.longitude],
                         'created': post.created.ctime(),
-                        'id': post.key().id()
+                        'id': post.key().id_or_name()
                        } for post in bound_posts]
 
             self.response.out.write(json.dumps({
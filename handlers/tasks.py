@@ -1,141 +1,304 @@
 #!/usr/bin/env python
 
-from craigslist import List, Post, ListSubscriber, AlertFilter
+from craigslist import List, Post, ListSubscriber, AlertMatch, ListSnapshot
+from craigslist import alerts, extract, feed, geocoding, postindex
+from craigslist import pricestats, schedule, snapshot
 
 from google.appengine.ext import webapp
 from google.appengine.ext.webapp import util
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import urlfetch
 from google.appengine.api import mail
 from google.appengine.ext import db
+from google.appengine.api import taskqueue
 from google.appengine.api.taskqueue import Task
 from django.utils import simplejson as json
-from geo.geotypes import Point
 
-import re
 import time
-import pickle
-from math import floor
-from datetime import datetime, timedelta
-from urllib import unquote_plus, urlencode
-from xml.dom.minidom import parseString as xml_parse
-
-RE_LOC = re.compile(r'http://maps.google.com/\?q=loc\%3A(.+)"')
-RE_ALT_LOC = re.compile(r'-->Location: (.+)\s*<li>')
-RE_DATE = re.compile(
-    r'^(\d{4}-\d{2}-\d{2})T(\d{2}:\d{2}:\d{2})([-+]\d{2}:\d{2})$')
-
-def strip_tags(html):
-    """Remove all HTML tags"""
-    html = re.sub(r'\n', '', html)
-    html = re.sub(r'<br[^>]*>', '\n', html)
-    html = re.sub(r'</?\w[^>]*?>', '', html)
-    html = re.sub('\n', '<br />', html)
-    return re.sub(r'&#\d+;', ' ', html).strip()
+import calendar
+import hashlib
+import logging
+from datetime import datetime
+
+# The maximum number of posts, and of bytes of post data, in a post task.
+POST_BATCH_SIZE = 20
+POST_BATCH_BYTES = 64 * 1024
+
+# Geocoding statuses after which a post is deferred, without counting as an
+# attempt, until the rate limiter expects to have tokens for it.
+DEFER_GEOCODING_STATUSES = (geocoding.DEFERRED, geocoding.OVER_QUERY_LIMIT)
+
+# Geocoding statuses after which a post is tried again, the number of times
+# a post is tried, and the seconds before the first retry.
+RETRY_GEOCODING_STATUSES = (geocoding.UNAVAILABLE,)
+MAX_POST_ATTEMPTS = 5
+RETRY_COUNTDOWN = 60
+
+# The List properties a sync changes.
+SYNC_PROPERTIES = ['last_updated', 'feed_etag', 'feed_last_modified',
+                   'feed_hash', 'arrival_rate', 'last_polled', 'next_sync']
+
+def store_sync_state(sync_list):
+    """Stores the SYNC_PROPERTIES of a List, in a transaction so as not to
+    revert the price stats craigslist.pricestats stores in it meanwhile."""
+    def store():
+        stored_list = List.get(sync_list.key())
+        if stored_list is None:
+            return
+        for name in SYNC_PROPERTIES:
+            setattr(stored_list, name, getattr(sync_list, name))
+        stored_list.put()
+    db.run_in_transaction(store)
+
+def enqueue_posts(posts_params, attempt=1, countdown=0, deferred=False):
+    """Queues post tasks for the given posts, as dicts of post fields, in
+    batches of at most POST_BATCH_SIZE posts and POST_BATCH_BYTES bytes.
+    Deferred posts are counted in the geocoding backlog until processed."""
+    batches = [[]]
+    batch_bytes = 0
+    for post_params in posts_params:
+        post_bytes = len(json.dumps(post_params))
+        if batches[-1] and (len(batches[-1]) == POST_BATCH_SIZE or
+                            batch_bytes + post_bytes > POST_BATCH_BYTES):
+            batches.append([])
+            batch_bytes = 0
+        batches[-1].append(post_params)
+        batch_bytes += post_bytes
+
+    for batch in batches:
+        if batch:
+            task = Task(url='/tasks/post/',
+                        params={'posts': json.dumps(batch),
+                                'attempt': attempt,
+                                'deferred': int(deferred)},
+                        countdown=countdown)
+            task.add('postqueue')
+
+    if deferred:
+        geocoding.limiter.deferred(len(posts_params))
 
 class SyncHandler(webapp.RequestHandler):
     """Synchronize RSS feeds from Craigslist. All new advertisements will be
-    inserted into a taskqueue, waiting for processing, if valid."""
-    def get(self):
-        lists = List.all()
-        for sync_list in lists:
-            rss_url = sync_list.rss_url
+    inserted into a taskqueue, waiting for processing, if valid.
 
-            result = urlfetch.fetch(rss_url)
-            if result.status_code == 200:
-                list_dom = xml_parse(result.content)
-                posts = list_dom.getElementsByTagName("item")
-                
-                self.process_posts(sync_list, posts)
+    Feeds are fetched concurrently, at most max_concurrent_fetches at a time,
+    and each is processed as soon as it arrives; a feed that doesn't arrive
+    within fetch_deadline seconds is skipped until the next sync. Feeds are
+    requested conditionally on their last ETag and Last-Modified headers,
+    and aren't parsed if unmodified or identical to the last one processed.
 
-    def process_posts(self, assoc_list, posts):
-        text = lambda post, tag: \
-                post.getElementsByTagName(tag)[0].firstChild.nodeValue
+    Syncs all Lists, or only the one whose id is given, as queued by
+    ScheduleHandler; either way, each List's next sync is scheduled by its
+    post arrival rate.
+    """
+    max_concurrent_fetches = 10
+    fetch_deadline = 10
 
+    def get(self):
+        list_id = int(self.request.get('id', 0))
+        if list_id:
+            lists = iter(filter(None, [List.get_by_id(list_id)]))
+        else:
+            lists = iter(List.all())
+        pending = {}
+        counts = {'processed': 0, 'not_modified': 0, 'unchanged': 0,
+                  'failed': 0}
+
+        def start_fetch():
+            try:
+                sync_list = lists.next()
+            except StopIteration:
+                return
+            headers = {}
+            if sync_list.feed_etag:
+                headers['If-None-Match'] = sync_list.feed_etag
+            if sync_list.feed_last_modified:
+                headers['If-Modified-Since'] = sync_list.feed_last_modified
+
+            rpc = urlfetch.create_rpc(deadline=self.fetch_deadline)
+            urlfetch.make_fetch_call(rpc, sync_list.rss_url, headers=headers)
+            pending[rpc] = sync_list
+
+        for i in range(self.max_concurrent_fetches):
+            start_fetch()
+
+        while pending:
+            rpc = apiproxy_stub_map.UserRPC.wait_any(pending.keys())
+            sync_list = pending.pop(rpc)
+            start_fetch()
+
+            try:
+                result = rpc.get_result()
+            except urlfetch.Error, e:
+                logging.warning('Failed to fetch %s: %r' %
+                                (sync_list.rss_url, e))
+                outcome, new_posts = 'failed', None
+            else:
+                try:
+                    outcome, new_posts = self.process_feed(sync_list, result)
+                except Exception:
+                    # Still scheduled below, so that a feed whose sync keeps
+                    # failing is retried at its next sync, not by the queue.
+                    logging.exception('Failed to sync %s' %
+                                      sync_list.rss_url)
+                    outcome, new_posts = 'failed', None
+
+            counts[outcome] += 1
+            schedule.polled(sync_list, new_posts)
+            store_sync_state(sync_list)
+
+        logging.info('Synced feeds: %(processed)d processed, '
+                     '%(not_modified)d not modified, %(unchanged)d '
+                     'unchanged, %(failed)d failed' % counts)
+        self.response.out.write('%r<br />' % counts)
+
+    # Syncs of a single List are queued by ScheduleHandler.
+    post = get
+
+    def process_feed(self, sync_list, result):
+        """Processes a fetched feed unless it is unchanged, without storing
+        the List, and returns which of the sync counters it falls under and
+        the number of new posts, or None if the fetch failed."""
+        if result.status_code == 304:
+            return 'not_modified', 0
+        if result.status_code != 200:
+            return 'failed', None
+
+        content_hash = hashlib.md5(result.content).hexdigest()
+        unchanged = content_hash == sync_list.feed_hash
+        if not unchanged:
+            # Feeds list the newest posts first, so parsing stops at the
+            # first post synced before. Posts are only queued once the feed
+            # is parsed, so nothing of a malformed feed is.
+            try:
+                new_posts = self.process_posts(sync_list, feed.iter_items(
+                    result.content, since=sync_list.last_updated))
+            except SyntaxError, e:
+                # The validators aren't stored, so the feed is fetched
+                # again in full.
+                logging.warning('Failed to parse %s: %r' %
+                                (sync_list.rss_url, e))
+                return 'failed', None
+
+        (sync_list.feed_etag, sync_list.feed_last_modified,
+         sync_list.feed_hash) = (result.headers.get('ETag'),
+                                 result.headers.get('Last-Modified'),
+                                 content_hash)
+        if unchanged:
+            return 'unchanged', 0
+        return 'processed', new_posts
+
+    def process_posts(self, assoc_list, posts):
         ref_time = assoc_list.last_updated
         latest_time = datetime.utcfromtimestamp(0)
 
         price_list = []
+        new_posts = []
+        new_count = 0
 
         for raw_post in posts:
-            created = self.parse_raw_date(text(raw_post, 'dc:date'))
+            created = raw_post.created
+            if created and created > ref_time:
+                new_count += 1
 
-            title = text(raw_post, 'title')
-            prices = map(int, re.findall(r'\$(\d+)', title))
-            if not prices:
+            title = raw_post.title
+            fields = extract.extract(title, raw_post.description)
+            if fields.price is None:
                 self.response.out.write(title + ' Price not found<br />')
                 continue
 
-            price = max(prices)
-            price_list.append(price)
-
             if not created or created <= ref_time:
                 self.response.out.write('Timing issue<br />')
                 continue
             if created > latest_time:
                 latest_time = created
 
-            description = text(raw_post, 'description')
-            addr_match = RE_LOC.search(description)
-            alt_addr_match = RE_ALT_LOC.search(description)
+            price_list.append((created, fields.price))
 
-            if not addr_match and not alt_addr_match:
+            if fields.address is None:
                 self.response.out.write(title + ' No valid address<br />')
                 continue
 
-            # Always try to follow the more accurate position first.
-            address = addr_match.group(1) if addr_match else \
-                alt_addr_match.group(1)
-            alt_addr_flag = addr_match is None
-
-            link = text(raw_post, 'link')
+            link = raw_post.link
 
             self.response.out.write('Task: ' + link + ' added to queue.<br />')
 
-            task = Task(url='/tasks/post/',
-                        params={'title': title,
-                         'price': price,
-                         'description': strip_tags(description),
-                         'link': link,
-                         'created': time.mktime(created.timetuple()),
-                         'address': unquote_plus(address),
-                         'alt_addr': int(alt_addr_flag),
-                         'list': assoc_list.key().id()
-                        })
+            new_posts.append({'title': title,
+                              'price': fields.price,
+                              'description': fields.text,
+                              'link': link,
+                              'created': time.mktime(created.timetuple()),
+                              'address': fields.address,
+                              'alt_addr': int(fields.alt_addr),
+                              'list': assoc_list.key().id()
+                             })
 
-            task.add('postqueue')
+        enqueue_posts(new_posts)
 
         if latest_time > ref_time:
-            # Aggregate results
+            # Add the new prices to the List's price sketches
             task = Task(url='/tasks/aggregate/',
                         params={
                             'id': assoc_list.key().id(),
-                            'prices': ','.join(map(str, price_list))
+                            'prices': ','.join([
+                                str(price) for created, price in price_list]),
+                            'created': ','.join([
+                                str(time.mktime(created.timetuple()))
+                                for created, price in price_list])
                         })
+            task.add('postqueue')
 
-            # Add to the same queue, so we can guarantee that the aggregation
-            # is executed after processing all posts.
-            task.add('postqueue') 
-
-            # Filter the newly synced results
-            task = Task(url='/tasks/filter/',
-                        params={'id': assoc_list.key().id(),
-                                'since': time.mktime(
-                                    assoc_list.last_updated.timetuple())
-                        })
+            # Rebuild the post snapshot once the new posts are stored.
+            task = Task(url='/tasks/snapshot/',
+                        params={'id': assoc_list.key().id()})
             task.add('postqueue')
 
             assoc_list.last_updated = latest_time
-            assoc_list.put()
-
-    def parse_raw_date(self, raw_date):
-        match = RE_DATE.match(raw_date)
-        if match:
-            post_date, post_time, tz_info = match.groups()
-            utc_minutes_offset = -reduce(lambda x, y: x*60+y, 
-                                        map(int, tz_info.split(':')))
-            return datetime.strptime(
-                ' '.join([post_date, post_time]),
-                '%Y-%m-%d %H:%M:%S') + timedelta(minutes=utc_minutes_offset)
+
+        return new_count
+
+class ScheduleHandler(webapp.RequestHandler):
+    """Queues a sync task for each List due to be polled; see
+    craigslist.schedule. Run by cron."""
+    batch_size = 1000
+
+    def keys(self, query):
+        keys = []
+        while True:
+            batch = query.fetch(self.batch_size)
+            keys.extend(batch)
+            if len(batch) < self.batch_size:
+                return keys
+            query.with_cursor(query.cursor())
+
+    def get(self):
+        now = datetime.utcnow()
+        # Lists stored before scheduling have no next_sync index row, so
+        # no next_sync filter finds them: take every List but those not
+        # due yet.
+        not_due = set(self.keys(List.all(keys_only=True).filter(
+            'next_sync >', now)))
+        due = db.get([key for key in self.keys(List.all(keys_only=True))
+                      if key not in not_due])
+
+        queued = 0
+        for sync_list in due:
+            if sync_list is None:
+                continue
+            # Named after the time it is due, so that a List isn't queued
+            # twice for the same poll.
+            list_id = sync_list.key().id()
+            task = Task(url='/tasks/sync/',
+                        name='sync-%d-%d' % (list_id, schedule.task_time(
+                            sync_list.next_sync, now)),
+                        params={'id': list_id})
+            try:
+                task.add('syncqueue')
+                queued += 1
+            except (taskqueue.TaskAlreadyExistsError,
+                    taskqueue.TombstonedTaskError):
+                pass
+        logging.info('Queued %d of %d due List syncs' % (queued, len(due)))
 
 class MailTaskHandler(webapp.RequestHandler):
     def post(self):
@@ -154,183 +317,310 @@ class MailTaskHandler(webapp.RequestHandler):
         pass
 
 class CleanupTaskHandler(webapp.RequestHandler):
-    def get(self):
-        timestamp_outdated = datetime.now() - timedelta(days=7)
-        outdated_posts = Post.all().filter('created <', timestamp_outdated)
+    """Deletes the posts created before the retention cutoff, then the alert
+    matches of the same period, and expires the data derived from them.
+
+    Expired entities are walked with keys-only queries, batch_size keys per
+    round trip, and deleted in bulk. When a request has run for time_budget
+    seconds, it queues a task to carry on from its query cursor, so a
+    backlog of any size is deleted by a chain of tasks, each well within the
+    request deadline. The cron request starts the chain; the last task
+    expires the post indexes and price sketches, and updates the snapshots.
+    """
+    batch_size = 500
+    time_budget = 20
+
+    # The kinds deleted, in order, with their creation time property.
+    kinds = [(Post, 'created'), (AlertMatch, 'created')]
 
-        db.delete(outdated_posts)
+    def get(self):
+        self.cleanup(postindex.retention_cutoff(), 0, None, 0, time.time())
 
-class FilterTaskHandler(webapp.RequestHandler):
     def post(self):
-        try:
-            list_id = int(self.request.get('id', 0))
-            filter_since = datetime.fromtimestamp(float(
-                self.request.get('since', 0.0)))
-        except:
-            self.error(500)
-
-        if list_id:
-            assoc_list = db.Key.from_path('List', list_id)
-            filters = AlertFilter.all().filter('sublist =', assoc_list)
-            for user_filter in filters:
-                watched_cond = pickle.loads(user_filter.geo_region)
-
-                posts_query = Post.all().filter(
-                    'posted_list =', assoc_list).filter(
-                        'created >', filter_since)
-
-                match_posts = filter(
-                    lambda post: user_filter.max_price == 0 or \
-                        post.price <= user_filter.max_price,
-                    Post.proximity_fetch(
-                        posts_query,
-                        Point(*watched_cond['center']),
-                        max_distance=watched_cond['radius']
-                    )
-                )
-
-                # Dispatch tasks to send emails to users
-                if match_posts:
-                    message_body = """Hey %(nickname)s,
-
-    We are happy to notify you that %(count)d housing ads were posted moments
-ago that we thought you might be interested in, based on your criteria:
-
-        <%(distance)d> meters around <%(location)s> and less than <$%(price)d>
-
-    You can either follow the link(s) below, or visit your Craigsreptile
-website for map visualization.
-
-%(updates)s
-
-    NOTE: Please do not reply this email. Thanks.""" % {
-    'nickname': user_filter.owner.nickname(),
-    'count': len(match_posts),
-    'distance': watched_cond['radius'],
-    'location': user_filter.street_name,
-    'price': user_filter.max_price,
-    'updates' : '\n\n'.join(['    %s\n%s' % (post.link, post.title)
-                             for post in match_posts])
-}
-
-                    message_subject = 'Craigsreptile Alert: %d new ads you \
-might be interested in' % len(match_posts)
-
-                    email_task = Task(
-                        url='/tasks/mail/',
-                        params={
-                            'to':user_filter.owner.email(),
-                            'subject': message_subject,
-                            'body': message_body
-                    })
+        self.cleanup(
+            datetime.utcfromtimestamp(float(self.request.get('cutoff'))),
+            int(self.request.get('kind', 0)),
+            self.request.get('cursor') or None,
+            int(self.request.get('deleted', 0)),
+            float(self.request.get('started')))
+
+    def cleanup(self, cutoff, kind, cursor, deleted, started):
+        start = time.time()
+        deleted_now = 0
+        while kind < len(self.kinds):
+            model, created_property = self.kinds[kind]
+            query = model.all(keys_only=True).filter(
+                created_property + ' <', cutoff)
+            if cursor:
+                query.with_cursor(cursor)
+            keys = query.fetch(self.batch_size)
+            if keys:
+                db.delete(keys)
+                deleted_now += len(keys)
+            if len(keys) < self.batch_size:
+                kind += 1
+                cursor = None
+            else:
+                cursor = query.cursor()
+
+            if (kind < len(self.kinds) and
+                time.time() - start > self.time_budget):
+                task = Task(url='/tasks/cleanup/',
+                            params={'cutoff': calendar.timegm(
+                                        cutoff.utctimetuple()),
+                                    'kind': kind,
+                                    'cursor': cursor or '',
+                                    'deleted': deleted + deleted_now,
+                                    'started': started})
+                task.add('cleanupqueue')
+                break
+
+        elapsed = time.time() - start
+        deleted += deleted_now
+        logging.info('Cleanup deleted %d entities in %.1fs (%.0f/s), %d '
+                     'in %.1fs since the cleanup started' %
+                     (deleted_now, elapsed, deleted_now / max(elapsed, 0.001),
+                      deleted, time.time() - started))
+        if kind < len(self.kinds):
+            return
+
+        postindex.posts_expired(cutoff)
+        pricestats.expire(cutoff)
+        # Drop the expired posts from the snapshots.
+        for list_key in List.all(keys_only=True):
+            Task(url='/tasks/snapshot/',
+                 params={'id': list_key.id()}).add('postqueue')
+
+class SnapshotTaskHandler(webapp.RequestHandler):
+    """Updates the columnar snapshot of a List with the posts stored since
+    the last update, dropping expired ones. The first snapshot of a List is
+    built from all its live posts, unless there are too many to index."""
+    batch_size = 500
 
-                    email_task.add('emailqueue')
+    def post(self):
+        list_id = int(self.request.get('id', 0))
+        if not list_id:
+            return
+
+        list_key = db.Key.from_path('List', list_id)
+        cutoff = postindex.retention_cutoff()
+        stored_since = datetime.utcnow()
+
+        loaded = ListSnapshot.load(list_id)
+        if loaded is not None and snapshot.is_current(loaded[0]):
+            data, last_stored_since = loaded
+            query = Post.all().filter('posted_list =', list_key).filter(
+                'stored >=', last_stored_since - postindex.STORE_SKEW
+            ).order('stored')
+        else:
+            data = None
+            live_posts = Post.all(keys_only=True).filter(
+                'posted_list =', list_key).filter('created >=', cutoff)
+            limit = postindex.MAX_INDEXED_POSTS
+            if live_posts.count(limit + 1) > limit:
+                logging.warning('List %d has too many posts to snapshot' %
+                                list_id)
+                return
+            query = Post.all().filter('posted_list =', list_key).filter(
+                'created >=', cutoff).order('created')
+
+        posts = []
+        while True:
+            batch = query.fetch(self.batch_size)
+            posts.extend(batch)
+            if len(batch) < self.batch_size:
+                break
+            query.with_cursor(query.cursor())
+
+        data = snapshot.update(data, posts, cutoff)
+        if not ListSnapshot.store(list_id, data, stored_since):
+            logging.warning('Snapshot of list %d not stored (%d bytes)' %
+                            (list_id, len(data)))
+
+class DigestTaskHandler(webapp.RequestHandler):
+    """Sends each owner with pending alert matches, once their digest window
+    has passed, a single email listing the posts matched by any of their
+    AlertFilters on any List. Run by cron."""
+    def get(self):
+        sent = 0
+        notified = []
+        for owner, matches in alerts.pending_digests().iteritems():
+            digest = alerts.render_digest(owner, matches)
+            if digest:
+                subject, body = digest
+                email_task = Task(
+                    url='/tasks/mail/',
+                    params={
+                        'to': owner.email(),
+                        'subject': subject,
+                        'body': body
+                })
+                email_task.add('emailqueue')
+                sent += 1
+            notified.extend(matches)
+
+        for match in notified:
+            match.notified = True
+        for i in range(0, len(notified), alerts.DIGEST_BATCH_SIZE):
+            db.put(notified[i:i + alerts.DIGEST_BATCH_SIZE])
+        logging.info('Sent %d alert digests for %d matches' %
+                     (sent, len(notified)))
+
+    # Digests requested by filter tasks queued before digests were
+    # scheduled by cron.
+    post = get
+
+class MigrateFiltersHandler(webapp.RequestHandler):
+    """Migrates the AlertFilters stored before cover cells, which match no
+    posts until they are; see craigslist.alerts.migrate_filters. Run by
+    cron."""
+    def get(self):
+        self.response.out.write('Migrated %d alert filters' %
+                                alerts.migrate_filters())
 
 class AggregationTaskHandler(webapp.RequestHandler):
-    """This worker will be called by a scheduled cron job, to aggregate over
-    cached posts in the datastore. 
-    Currently, we will aggregate the lower/upper quantile and median of prices
-    posted on the list, as a reference for users seeking for
-    apartments/houses/rooms."""
+    """Adds the prices of the posts of a List created since its last sync to
+    its price sketches, and refreshes the quantiles and histogram of prices
+    of its live posts, as a reference for users seeking for
+    apartments/houses/rooms; see craigslist.pricestats."""
     def post(self):
         aggre_list_id = int(self.request.get('id', 0))
-        prices = map(int, self.request.get('prices').split(','))
+        if not aggre_list_id or not self.request.get('prices'):
+            return
 
-        if aggre_list_id:
-            post_list = List.get_by_id(aggre_list_id)
-            prices.sort()
-            # Quantile values
-            uq_idx = int(floor(len(prices)*0.75))
-            uq = prices[uq_idx]
-            lq = prices[int(floor(len(prices)*0.25))]
-            median = prices[int(floor(len(prices)*0.5))]
-
-            post_list.aggregated_prices = [lq, median, uq]
-            post_list.put()
+        prices = map(int, self.request.get('prices').split(','))
+        created = [datetime.utcfromtimestamp(float(timestamp))
+                   for timestamp in self.request.get('created').split(',')]
+        pricestats.add_prices(aggre_list_id, zip(created, prices))
 
 class PostTaskHandler(webapp.RequestHandler):
     """The worker for processing posted advertisement on subscribed lists. 
     The worker will try to get the coordinates corresponding to the
-    advertisement posted for map overlaying visulization."""
-    
-    def geocode(self, address):
-        geocoding_api = 'http://beta.tremblefrog.org/geocoding.php?%s' % \
-            urlencode([ ('address', address), ('sensor', 'false') ])
-
-        result = urlfetch.fetch(geocoding_api)
-        if result.status_code == 200:
-            response = json.loads(result.content)
-            if response['status'] == 'OK':
-                location = response['results'][0]['geometry']['location']
-                low_res_flag = 'political'\
-                        in response['results'][0]['types']
-
-                return low_res_flag, db.GeoPt(
-                    location['lat'], location['lng'])
-            else:
-                return response['status'], None
+    advertisement posted for map overlaying visulization.
+
+    Each task carries a batch of posts, as queued by enqueue_posts(). Their
+    addresses are geocoded together through the geocoding cache, and the
+    geocoded posts are stored with a single batch put. Posts deferred by the
+    geocoding rate limiter, or that couldn't be geocoded because of a
+    transient error, are queued again in a new task."""
+
+    def geocoding_address(self, post_params, lists):
+        """Returns the normalized address to geocode for a post. If an
+        alternative address is indicated, the city name is appended (maybe
+        redundant) to the address for correct geocoding."""
+        if not post_params['alt_addr']:
+            return geocoding.normalize_address(post_params['address'])
+
+        list_id = post_params['list']
+        if list_id not in lists:
+            lists[list_id] = List.get_by_id(list_id)
+        assoc_list = lists[list_id]
+
+        return geocoding.normalize_address(post_params['address'],
+                                           assoc_list.city, assoc_list.state)
+
+    def request_posts(self):
+        if self.request.get('posts'):
+            return json.loads(self.request.get('posts'))
+
+        # A single post, as queued before posts were batched.
+        return [{'title': self.request.get('title'),
+                 'created': float(self.request.get('created')),
+                 'description': self.request.get('description'),
+                 'link': self.request.get('link'),
+                 'price': int(self.request.get('price')),
+                 'address': self.request.get('address'),
+                 'alt_addr': int(self.request.get('alt_addr') or 0),
+                 'list': int(self.request.get('list'))}]
 
     def post(self):
-        title = self.request.get('title')
-        created = datetime.utcfromtimestamp(float(self.request.get('created')))
-        description = self.request.get('description')
-        link = self.request.get('link')
-        price = int(self.request.get('price'))
-        address = self.request.get('address')
-        alt_addr_flag = self.request.get('alt_addr')
-        posted_list = db.Key.from_path('List', 
-                                    int(self.request.get('list')))
+        posts_params = self.request_posts()
+        attempt = int(self.request.get('attempt', 1))
+        if int(self.request.get('deferred', 0)):
+            geocoding.limiter.resumed(len(posts_params))
 
         # To retrieve the geolocation and geocode the address into coordinates
         # for geospatial indexing.
-
-        # If an alternative address is indicated, try append (maybe redundant)
-        # the city name to the address for correct geocoding.
-        if not alt_addr_flag:
-            address = self.request.get('address')
-        else: 
-            assoc_list = List.get_by_id(posted_list.id())
-            city, state = re.compile(assoc_list.city, re.IGNORECASE),\
-                    re.compile(assoc_list.state, re.IGNORECASE)
-            if not city.search(self.request.get('address')) and not\
-                   state.search(self.request.get('address')):
-                address = ' '.join([self.request.get('address'),
-                                    assoc_list.city,
-                                    assoc_list.state
-                                   ])
-            else:
-                address = self.request.get('address')
-
-        status, post_geolocation = self.geocode(address)
-        if post_geolocation:
-            post = Post(title=title,
-                        description=description,
-                        link=link,
-                        created=created,
-                        price=price,
-                        posted_list=posted_list,
-                        location=post_geolocation,
-                        approx_geolocation=status
-                       )
-            post.update_location()
-            post.put()
-        else:
-            # If the error happens to be over query limit, generate an internal
-            # error, signaling the taskqueue to re-process the task after an
-            # interval.
-            if status == 'OVER_QUERY_LIMIT':
-                self.error(500)
+        lists = {}
+        addresses = [self.geocoding_address(post_params, lists)
+                     for post_params in posts_params]
+        results = geocoding.geocode_many(addresses)
+
+        posts = []
+        retry_params = []
+        deferred_params = []
+        for post_params, address in zip(posts_params, addresses):
+            result = results[address]
+            if result.location:
+                posts.append(Post(
+                    key_name=Post.key_name_for(post_params['list'],
+                                               post_params['link']),
+                    title=post_params['title'],
+                    description=post_params['description'],
+                    link=post_params['link'],
+                    created=datetime.utcfromtimestamp(post_params['created']),
+                    price=post_params['price'],
+                    posted_list=db.Key.from_path('List', post_params['list']),
+                    location=result.location,
+                    approx_geolocation=result.approx
+                ))
+            elif result.status in DEFER_GEOCODING_STATUSES:
+                deferred_params.append(post_params)
+            elif result.status in RETRY_GEOCODING_STATUSES:
+                retry_params.append(post_params)
             # Otherwise, if it's zero results or request denied error, do
             # nothing
 
+        if posts:
+            Post.update_locations(posts)
+            db.put(posts)
+            # The posts are stored: failing the task now would only geocode
+            # them again, and queue the deferred posts twice.
+            try:
+                postindex.posts_stored(posts)
+            except Exception:
+                logging.exception('Failed to index %d stored posts' %
+                                  len(posts))
+            try:
+                alerts.match_posts(posts)
+            except Exception:
+                logging.exception('Failed to match %d stored posts' %
+                                  len(posts))
+
+        # Wait for the geocoding rate limiter to have tokens for deferred
+        # posts, and re-process posts that failed after an interval.
+        if deferred_params:
+            enqueue_posts(deferred_params, attempt=attempt,
+                          countdown=geocoding.limiter.retry_after(
+                              len(deferred_params)),
+                          deferred=True)
+        if retry_params and attempt < MAX_POST_ATTEMPTS:
+            enqueue_posts(retry_params, attempt=attempt + 1,
+                          countdown=RETRY_COUNTDOWN * attempt)
+        elif retry_params:
+            logging.warning('Dropping %d posts after %d geocoding attempts' %
+                            (len(retry_params), attempt))
+
+class GeocodingStatsHandler(webapp.RequestHandler):
+    """Reports the geocoding rate limiter's rate and backlog, and the
+    instance's geocoding cache stats."""
+    def get(self):
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.out.write(json.dumps(geocoding.stats()))
+
 def main():
     application = webapp.WSGIApplication([
         ('/tasks/sync/', SyncHandler),
+        ('/tasks/schedule/', ScheduleHandler),
         ('/tasks/post/', PostTaskHandler),
         ('/tasks/aggregate/', AggregationTaskHandler),
         ('/tasks/mail/', MailTaskHandler),
-        ('/tasks/filter/', FilterTaskHandler),
+        ('/tasks/digest/', DigestTaskHandler),
+        ('/tasks/filter/', DigestTaskHandler),
+        ('/tasks/migrate_filters/', MigrateFiltersHandler),
         ('/tasks/cleanup/', CleanupTaskHandler),
+        ('/tasks/snapshot/', SnapshotTaskHandler),
+        ('/tasks/geocoding/', GeocodingStatsHandler),
     ], debug=True)
     util.run_wsgi_app(application)
 